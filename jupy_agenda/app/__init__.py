@@ -3,12 +3,24 @@ from flask import Flask, current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_mail import Mail
+from markupsafe import Markup, escape
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import sqlite3
 
 # Initialize extensions
 db = SQLAlchemy()
 login_manager = LoginManager()
 mail = Mail() # Initialize Mail
 
+@event.listens_for(Engine, 'connect')
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite ignores foreign keys (and so ON DELETE CASCADE) unless enabled on each connection."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
 def create_app(config_class=None): # Added config_class argument
     """Create and configure the Flask application."""
     app = Flask(__name__, instance_relative_config=True, template_folder='../templates') # instance_relative_config=True
@@ -89,6 +101,14 @@ def create_app(config_class=None): # Added config_class argument
         from .models import User
         return User.query.get(int(user_id))
 
+    # Template filter used by the email reminder templates
+    @app.template_filter('nl2br')
+    def nl2br(value):
+        """Escapes the text and turns newlines into <br> tags."""
+        if value is None:
+            return ''
+        return Markup('<br>\n').join(escape(value).split('\n'))
+
     # Register Blueprints
     from .auth_routes import auth_bp
     from .main_routes import main_bp
@@ -100,6 +120,8 @@ def create_app(config_class=None): # Added config_class argument
     from .material_routes import material_bp
     from .note_routes import note_bp
     from .stats_routes import stats_bp # Import the new stats blueprint
+    from .notification_routes import notification_bp
+    from .metrics_routes import metrics_bp
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(main_bp, url_prefix='/') 
     app.register_blueprint(calendar_bp, url_prefix='/calendar')
@@ -110,6 +132,8 @@ def create_app(config_class=None): # Added config_class argument
     app.register_blueprint(material_bp, url_prefix='/materials')
     app.register_blueprint(note_bp, url_prefix='/notes')
     app.register_blueprint(stats_bp, url_prefix='/statistics') # Register stats blueprint
+    app.register_blueprint(notification_bp, url_prefix='/notifications')
+    app.register_blueprint(metrics_bp, url_prefix='/metrics')
 
     # Create database tables if they don't exist
     # This is a simple way to ensure tables are created.
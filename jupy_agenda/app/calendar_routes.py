@@ -1,13 +1,27 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, current_app
+from flask import Blueprint, Response, render_template, redirect, url_for, flash, request, abort, current_app, jsonify, stream_with_context
 from flask_login import login_required, current_user
-from .forms import EventForm
-from .models import User, Event, Reminder # Ensure Reminder is imported
+from .forms import EventForm, ImportEventsForm
+from .models import User, Event, EventException, Reminder # Ensure Reminder is imported
 from . import db
-from datetime import datetime, date, timedelta # Ensure timedelta is imported
+from .services.reminder_rules import rules_enabled
+from .services.reminder_policy import event_reminder_time
+from .services.reminder_maintenance import occurrence_reminder_rows
+from .services.recurrence import refresh_recurrence, occurs_at
+from .services.ical import calendar_version, iter_calendar
+from .services.ical_import import import_ics
+from .services.event_calendar import occurrences_overlapping, iter_occurrence_rows, bucket_by_day, day_start
+from werkzeug.http import http_date, is_resource_modified, quote_etag
+from datetime import datetime, date, timedelta, timezone # Ensure timedelta is imported
 import calendar
+import io
+import json
+import secrets
 
 calendar_bp = Blueprint('calendar', __name__)
 
+DEFAULT_API_MAX_DAYS = 366 # Widest range /calendar/api/events expands in one request
+DEFAULT_ICAL_MAX_AGE = 300 # Seconds feed clients may reuse their copy before revalidating
+
 @calendar_bp.route('/calendar')
 @calendar_bp.route('/calendar/<int:year>/<int:month>')
 @login_required
@@ -29,27 +43,18 @@ def month_view(year=None, month=None):
     cal = calendar.Calendar() # Default is Monday first day of week
     month_days = cal.monthdatescalendar(year, month) # List of weeks (each week is a list of datetime.date objects)
 
-    # Fetch events for the current user for the displayed month
-    # Get the first day of the month and the first day of the next month
-    first_day_of_month = date(year, month, 1)
     if month == 12:
         first_day_of_next_month = date(year + 1, 1, 1)
     else:
         first_day_of_next_month = date(year, month + 1, 1)
 
-    events_query = Event.query.filter(
-        Event.user_id == current_user.id,
-        Event.start_time >= first_day_of_month,
-        Event.start_time < first_day_of_next_month
-    ).order_by(Event.start_time).all()
+    # Fetch events for the current user that overlap the displayed grid (the month padded to whole weeks);
+    # recurring events are expanded into their occurrences for that window only
+    first_shown, last_shown = month_days[0][0], month_days[-1][-1]
+    events = occurrences_overlapping(current_user.id, day_start(first_shown), day_start(last_shown + timedelta(days=1)))
 
-    # Organize events by day for easy lookup in the template
-    events_by_day = {}
-    for event in events_query:
-        event_date = event.start_time.date()
-        if event_date not in events_by_day:
-            events_by_day[event_date] = []
-        events_by_day[event_date].append(event)
+    # Organize events by day for easy lookup in the template; multi-day events appear on every day they cover
+    events_by_day = bucket_by_day(events, first_shown, last_shown)
 
     # Previous and next month logic
     prev_month_date = date(year, month, 1) - timedelta(days=1) # Go to last day of prev month
@@ -70,6 +75,111 @@ def month_view(year=None, month=None):
                            month_name=calendar.month_name[month])
 
 
+def _parse_api_time(value):
+    """?start=/?end= as a naive UTC datetime: a date ('2024-03-01') or an ISO datetime, with or without an offset."""
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+def _api_event(item):
+    entry = {'id': item.id, 'title': item.title, 'start': item.start_time.isoformat(), 'end': item.end_time.isoformat()}
+    recurrence_id = getattr(item, 'recurrence_id', None)
+    if recurrence_id is not None:
+        entry['recurrence_id'] = recurrence_id.isoformat() # Occurrence of a recurring event
+    return entry
+
+@calendar_bp.route('/api/events')
+@login_required
+def api_events():
+    """
+    The user's events overlapping [?start, ?end) as compact JSON, for a
+    client-rendered calendar: {"start", "end", "events": [{"id", "title",
+    "start", "end"[, "recurrence_id"]}, ...]} ordered by start. Only those
+    columns are read, and the body is streamed as rows come in rather than
+    built in memory. The range may span at most CALENDAR_API_MAX_DAYS (default 366).
+    """
+    try:
+        range_start = _parse_api_time(request.args['start'])
+        range_end = _parse_api_time(request.args['end'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'start and end are required ISO dates or datetimes'}), 400
+    max_days = current_app.config.get('CALENDAR_API_MAX_DAYS', DEFAULT_API_MAX_DAYS)
+    if not range_start < range_end <= range_start + timedelta(days=max_days):
+        return jsonify({'error': f'end must be after start and at most {max_days} days later'}), 400
+
+    rows = iter_occurrence_rows(current_user.id, range_start, range_end)
+
+    def body():
+        yield f'{{"start":"{range_start.isoformat()}","end":"{range_end.isoformat()}","events":['
+        separator = ''
+        for item in rows:
+            yield separator + json.dumps(_api_event(item), separators=(',', ':'))
+            separator = ','
+        yield ']}'
+
+    return Response(stream_with_context(body()), mimetype='application/json')
+
+
+def _ical_response(user_id, filename=None):
+    """
+    The user's calendar as a streamed text/calendar response. ETag and
+    Last-Modified come from one aggregate query; a client whose copy is
+    current (If-None-Match / If-Modified-Since) gets a 304 and no event is read.
+    """
+    tag, latest = calendar_version(user_id)
+    headers = {'ETag': quote_etag(tag),
+               'Cache-Control': f"private, max-age={current_app.config.get('ICAL_FEED_MAX_AGE', DEFAULT_ICAL_MAX_AGE)}"}
+    if latest is not None:
+        headers['Last-Modified'] = http_date(latest)
+    if not is_resource_modified(request.environ, etag=tag, last_modified=latest):
+        return Response(status=304, headers=headers)
+
+    if filename:
+        headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    uid_domain = current_app.config.get('ICAL_UID_DOMAIN') or current_app.config.get('SERVER_NAME') or request.host.split(':')[0]
+    return Response(stream_with_context(iter_calendar(user_id, uid_domain)), mimetype='text/calendar', headers=headers)
+
+@calendar_bp.route('/export.ics')
+@login_required
+def export_ics():
+    """Downloads all of the user's events as an iCalendar file."""
+    return _ical_response(current_user.id, filename='jupy-agenda.ics')
+
+@calendar_bp.route('/feed/<token>.ics')
+def ical_feed(token):
+    """Subscription feed for external calendar clients; the secret token in the URL stands in for the login."""
+    user = User.query.filter_by(calendar_token=token).first_or_404()
+    return _ical_response(user.id)
+
+@calendar_bp.route('/feed/token', methods=['POST'])
+@login_required
+def rotate_feed_token():
+    """Creates the user's feed URL, or replaces it so the old one stops working."""
+    current_user.calendar_token = secrets.token_urlsafe(32)
+    db.session.commit()
+    flash('Novo endereço de assinatura do calendário criado.', 'success')
+    return redirect(url_for('main.profile'))
+
+
+@calendar_bp.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_events():
+    """Imports the events of an uploaded .ics file in bulk batches, reading the upload as a stream."""
+    form = ImportEventsForm()
+    if form.validate_on_submit():
+        try:
+            lines = io.TextIOWrapper(form.file.data.stream, encoding='utf-8', errors='replace')
+            stats = import_ics(lines, current_user.id)
+            flash(f"{stats['events']} eventos importados ({stats['recurring']} recorrentes). "
+                  f"Ignorados: {stats['skipped']}, inválidos: {stats['invalid']}.", 'success')
+            return redirect(url_for('calendar.month_view'))
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Erro ao importar eventos: {e}', 'danger')
+    return render_template('calendar/import_form.html', title='Import Events', form=form)
+
+
 @calendar_bp.route('/event/delete/<int:event_id>', methods=['POST']) # POST only for deletion
 @login_required
 def delete_event(event_id):
@@ -95,21 +205,31 @@ def _update_event_reminder(event):
     """
     Deletes existing pending reminders for an event and creates a new one
     if the event's start_time is in the future.
-    Reminder is set for 1 hour before the event.
+    Reminder is set EVENT_REMINDER_MINUTES (default 60) before the event.
+    A recurring event gets one per occurrence within the reminder horizon
+    instead; the dispatcher moves that horizon forward.
+    Does nothing in rules mode: reminders are then computed at dispatch time.
     """
+    if rules_enabled():
+        return
     try:
         # Delete existing pending reminders for this event
         Reminder.query.filter_by(user_id=event.user_id, item_type='event', item_id=event.id, sent_status='pending').delete()
-        
-        if event.start_time > datetime.utcnow() + timedelta(minutes=5): # Only if event is in future (plus a small buffer)
-            reminder_time = event.start_time - timedelta(hours=1)
+
+        if event.rrule:
+            rows = occurrence_reminder_rows(event, event.user.notification_method, datetime.utcnow())
+            db.session.add_all(Reminder(**row) for row in rows)
+            current_app.logger.info(f"Created {len(rows)} occurrence reminders for event {event.id}")
+        elif event.start_time > datetime.utcnow() + timedelta(minutes=5): # Only if event is in future (plus a small buffer)
+            reminder_time = event_reminder_time(event.start_time)
             if reminder_time > datetime.utcnow(): # Ensure reminder time itself is in the future
                 new_reminder = Reminder(
                     user_id=event.user_id,
                     item_type='event',
                     item_id=event.id,
+                    event_id=event.id,
                     reminder_time=reminder_time,
-                    notification_method='email' # Default, could be configurable later
+                    notification_method=event.user.notification_method # The user's channel: 'email', 'inapp' or 'webhook'
                 )
                 db.session.add(new_reminder)
                 # db.session.commit() will be called in the main route
@@ -138,8 +258,10 @@ def add_event():
                 title=form.title.data,
                 description=form.description.data,
                 start_time=form.start_time.data,
-                end_time=form.end_time.data
+                end_time=form.end_time.data,
+                rrule=form.rrule.data
             )
+            refresh_recurrence(new_event)
             db.session.add(new_event)
             db.session.flush() # Flush to get new_event.id for reminder
             _update_event_reminder(new_event) # Add reminder logic
@@ -167,6 +289,8 @@ def edit_event(event_id):
             event.description = form.description.data
             event.start_time = form.start_time.data
             event.end_time = form.end_time.data
+            event.rrule = form.rrule.data
+            refresh_recurrence(event) # New rule version: cached expansions of the old one are not used
             _update_event_reminder(event) # Add/Update reminder logic
             db.session.commit()
             flash('Evento atualizado com sucesso!', 'success')
@@ -175,4 +299,41 @@ def edit_event(event_id):
             db.session.rollback()
             flash(f'Erro ao atualizar evento: {e}', 'danger')
             
-    return render_template('calendar/event_form.html', title='Edit Event', form=form, legend=f'Edit "{event.title}"', event_id=event.id)
+    # Opened from one occurrence of a recurring event: offer to cancel just that one
+    occurrence = _parse_occurrence(request.args.get('occurrence')) if event.rrule else None
+    return render_template('calendar/event_form.html', title='Edit Event', form=form, legend=f'Edit "{event.title}"', event_id=event.id,
+                           occurrence=occurrence)
+
+
+def _parse_occurrence(value):
+    """The occurrence start passed as ?occurrence=/form field (ISO format), or None."""
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+@calendar_bp.route('/event/<int:event_id>/occurrence/cancel', methods=['POST'])
+@login_required
+def cancel_occurrence(event_id):
+    """Cancels one occurrence of a recurring event (an EXDATE); the rest of the series is kept."""
+    event = Event.query.get_or_404(event_id)
+    if event.user_id != current_user.id:
+        abort(403) # Forbidden
+    occurrence = _parse_occurrence(request.form.get('occurrence'))
+    if not event.rrule or occurrence is None or not occurs_at(event, occurrence):
+        abort(400)
+
+    try:
+        exception = EventException.query.filter_by(event_id=event.id, original_start=occurrence).first()
+        if exception is None:
+            exception = EventException(event_id=event.id, original_start=occurrence)
+            event.exceptions.append(exception) # So the reminder refresh below already skips it
+        exception.cancelled = True
+        refresh_recurrence(event)
+        _update_event_reminder(event) # Its reminder goes too
+        db.session.commit()
+        flash('Ocorrência cancelada.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Erro ao cancelar ocorrência: {e}', 'danger')
+    return redirect(url_for('calendar.month_view', year=occurrence.year, month=occurrence.month))
@@ -2,6 +2,9 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, BooleanField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError
 from .models import User # To check for existing username/email
+from .services.recurrence import parse_rrule
+from .services.webhook_delivery import WebhookError, check_webhook_url, webhook_policy
+from flask_wtf.file import FileField, FileAllowed, FileRequired
 
 class RegistrationForm(FlaskForm):
     """Form for user registration."""
@@ -51,6 +54,8 @@ class EventForm(FlaskForm):
     end_time = DateTimeField('End Time (YYYY-MM-DD HH:MM:SS)', 
                              validators=[DataRequired()], 
                              format='%Y-%m-%d %H:%M:%S')
+    rrule = StringField('Repeat (RRULE, e.g. FREQ=WEEKLY;BYDAY=MO)',
+                        validators=[Optional(), Length(max=500)]) # Blank: a one-off event
     submit = SubmitField('Save Event')
 
     def validate_end_time(self, end_time_field):
@@ -59,6 +64,20 @@ class EventForm(FlaskForm):
             if end_time_field.data <= self.start_time.data:
                 raise ValidationError('End time must be after start time.')
 
+    def validate_rrule(self, rrule_field):
+        """Ensure the recurrence rule can be expanded."""
+        if self.start_time.data and rrule_field.data:
+            try:
+                parse_rrule(rrule_field.data, self.start_time.data)
+            except ValueError as e:
+                raise ValidationError(f'Invalid recurrence rule: {e}')
+
+class ImportEventsForm(FlaskForm):
+    """Form for importing events from an iCalendar file."""
+    file = FileField('iCalendar file (.ics)',
+                     validators=[FileRequired(), FileAllowed(['ics'], 'Only .ics files.')])
+    submit = SubmitField('Import')
+
 from wtforms import DateField, SelectField
 
 class TaskForm(FlaskForm):
@@ -78,7 +97,7 @@ class TaskForm(FlaskForm):
     submit = SubmitField('Save Task')
 
 from wtforms import FloatField
-from wtforms.validators import NumberRange
+from wtforms.validators import NumberRange, URL
 
 class LocationForm(FlaskForm):
     """Form for creating or editing a location."""
@@ -161,3 +180,62 @@ class QuickNoteForm(FlaskForm):
     category = StringField('Category (Optional)', 
                            validators=[Optional(), Length(max=100)])
     submit = SubmitField('Save Note')
+
+class ReminderRulesForm(FlaskForm):
+    """Form for a user's reminder offsets (used when REMINDER_RULES_ENABLED is on)."""
+    event_offsets = StringField('Event reminders (minutes before, comma-separated)',
+                                validators=[Optional(), Length(max=200)])
+    task_times = StringField('Task reminders (HH:MM on the due date, comma-separated)',
+                             validators=[Optional(), Length(max=200)])
+    submit = SubmitField('Save Reminders')
+
+    def event_offset_list(self):
+        """Parsed event offsets in minutes; empty means 'use the default'."""
+        return [int(part) for part in (self.event_offsets.data or '').split(',') if part.strip()]
+
+    def task_offset_list(self):
+        """Parsed task times as minutes after midnight; empty means 'use the default'."""
+        offsets = []
+        for part in (self.task_times.data or '').split(','):
+            if part.strip():
+                hours, minutes = part.strip().split(':')
+                offsets.append(int(hours) * 60 + int(minutes))
+        return offsets
+
+    def validate_event_offsets(self, event_offsets):
+        """Validate that every offset is a whole number of minutes between 0 and 30 days."""
+        try:
+            offsets = self.event_offset_list()
+        except ValueError:
+            raise ValidationError('Use whole numbers of minutes, e.g. "60, 1440".')
+        if any(offset < 0 or offset > 30 * 24 * 60 for offset in offsets):
+            raise ValidationError('Offsets must be between 0 and 43200 minutes.')
+
+    def validate_task_times(self, task_times):
+        """Validate that every time is a valid HH:MM."""
+        try:
+            offsets = self.task_offset_list()
+        except ValueError:
+            raise ValidationError('Use HH:MM times, e.g. "09:00, 18:00".')
+        if any(offset < 0 or offset >= 24 * 60 for offset in offsets):
+            raise ValidationError('Times must be between 00:00 and 23:59.')
+
+class NotificationSettingsForm(FlaskForm):
+    """Form for choosing how reminders are delivered."""
+    notification_method = SelectField('Deliver reminders by',
+                                      choices=[('email', 'Email'), ('inapp', 'In-app notification'), ('webhook', 'Webhook')],
+                                      validators=[DataRequired()])
+    webhook_url = StringField('Webhook URL',
+                              validators=[Optional(), URL(require_tld=False), Length(max=500)])
+    submit = SubmitField('Save')
+
+    def validate_webhook_url(self, webhook_url):
+        """Validate that webhook delivery has an https URL on a public host to post to."""
+        if self.notification_method.data == 'webhook' and not webhook_url.data:
+            raise ValidationError('A webhook URL is required for webhook delivery.')
+        if webhook_url.data:
+            allow_http, allow_private = webhook_policy()
+            try:
+                check_webhook_url(webhook_url.data, allow_http=allow_http, allow_private=allow_private)
+            except WebhookError as e:
+                raise ValidationError(str(e))
@@ -1,5 +1,8 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, redirect, url_for, flash
 from flask_login import login_required, current_user
+from .forms import ReminderRulesForm, NotificationSettingsForm
+from .services.reminder_rules import user_rules, set_user_rules, rules_enabled
+from . import db
 
 main_bp = Blueprint('main', __name__)
 
@@ -16,4 +19,49 @@ def index():
 def profile():
     """Serves the user profile page."""
     # You can pass user-specific data to the template if needed
-    return render_template('profile.html', title='Profile', user=current_user)
+    form = None
+    if rules_enabled():
+        rules = user_rules(current_user.id)
+        form = ReminderRulesForm(
+            event_offsets=', '.join(str(offset) for offset in rules['event']),
+            task_times=', '.join(f"{offset // 60:02d}:{offset % 60:02d}" for offset in rules['task'])
+        )
+    notification_form = NotificationSettingsForm(notification_method=current_user.notification_method,
+                                                 webhook_url=current_user.webhook_url)
+    return render_template('profile.html', title='Profile', user=current_user, reminder_form=form,
+                           notification_form=notification_form)
+
+@main_bp.route('/profile/notifications', methods=['POST'])
+@login_required
+def update_notification_settings():
+    """Saves the user's reminder channel; it applies to reminders created from now on."""
+    form = NotificationSettingsForm()
+    if form.validate_on_submit():
+        current_user.notification_method = form.notification_method.data
+        current_user.webhook_url = form.webhook_url.data or None
+        db.session.commit()
+        flash('Configurações de notificação salvas.', 'success')
+    else:
+        for errors in form.errors.values():
+            for error in errors:
+                flash(error, 'danger')
+    return redirect(url_for('main.profile'))
+
+@main_bp.route('/profile/reminders', methods=['POST'])
+@login_required
+def update_reminder_rules():
+    """Saves the user's reminder offsets. Only the rules table is written."""
+    if not rules_enabled():
+        flash('As regras de lembrete não estão ativadas.', 'warning')
+        return redirect(url_for('main.profile'))
+    form = ReminderRulesForm()
+    if form.validate_on_submit():
+        set_user_rules(current_user.id, 'event', form.event_offset_list())
+        set_user_rules(current_user.id, 'task', form.task_offset_list())
+        db.session.commit()
+        flash('Configurações de lembrete salvas.', 'success')
+    else:
+        for errors in form.errors.values():
+            for error in errors:
+                flash(error, 'danger')
+    return redirect(url_for('main.profile'))
@@ -0,0 +1,30 @@
+from flask import Blueprint, Response, request, current_app, abort
+from .services.reminder_metrics import get_metrics, read_snapshot, render_prometheus
+import hmac
+
+metrics_bp = Blueprint('metrics', __name__)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _authorized():
+    """With METRICS_TOKEN set, scrapers must send it as a Bearer token (or ?token=)."""
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        return True
+    header = request.headers.get('Authorization', '')
+    supplied = header[len('Bearer '):] if header.startswith('Bearer ') else request.args.get('token', '')
+    return hmac.compare_digest(supplied.encode(), token.encode())
+
+@metrics_bp.route('/')
+def reminder_metrics():
+    """
+    Reminder pipeline metrics in the Prometheus text format.
+    Dispatchers run in their own processes (cron, reminder-daemon), so with
+    REMINDER_METRICS_FILE set the accumulated snapshot they write is served;
+    otherwise this process's own counters are.
+    """
+    if not _authorized():
+        abort(401)
+    metrics_file = current_app.config.get('REMINDER_METRICS_FILE')
+    state = read_snapshot(metrics_file) if metrics_file else get_metrics().state()
+    return Response(render_prometheus(state), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -10,6 +10,10 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False, index=True)
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
     password_hash = db.Column(db.String(256), nullable=False) # Increased length for potentially longer hashes
+    # How new reminders reach the user: 'email', 'inapp' or 'webhook'
+    notification_method = db.Column(db.String(20), default='email', nullable=False)
+    webhook_url = db.Column(db.String(500), nullable=True) # Where 'webhook' reminders are POSTed
+    calendar_token = db.Column(db.String(64), unique=True, nullable=True) # Secret in the iCalendar feed URL; None: no feed
 
     def set_password(self, password):
         """Hashes and sets the user's password."""
@@ -37,11 +41,23 @@ class Event(db.Model):
     description = db.Column(db.Text, nullable=True)
     start_time = db.Column(db.DateTime, nullable=False, index=True)
     end_time = db.Column(db.DateTime, nullable=False, index=True)
+    # Recurrence: an RFC 5545 RRULE value (e.g. 'FREQ=WEEKLY;BYDAY=MO,WE') applied from start_time.
+    # start_time/end_time are then the first occurrence; recurrence_end is the end of the last one (None: no end).
+    rrule = db.Column(db.String(500), nullable=True)
+    recurrence_end = db.Column(db.DateTime, nullable=True)
+    rule_version = db.Column(db.Integer, default=1, nullable=False) # Bumped when occurrences change; part of the cache key
+    # IANA zone the rule repeats in (imported TZID, e.g. 'Europe/Lisbon'); None: the rule runs in UTC.
+    # Times stay naive UTC either way, so a 09:00 class stays at 09:00 local across DST changes.
+    timezone = db.Column(db.String(64), nullable=True)
+    ical_uid = db.Column(db.String(255), nullable=True) # UID of an imported VEVENT; re-imports skip what is already there
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationship to User (optional, but good for ORM access)
     user = db.relationship('User', backref=db.backref('events', lazy=True))
+    # Per-occurrence changes of a recurring event; few per event, loaded along with it
+    exceptions = db.relationship('EventException', backref='event', lazy='selectin',
+                                 cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f'<Event {self.title} (User: {self.user_id})>'
@@ -50,6 +66,37 @@ class Event(db.Model):
 
     __table_args__ = (
         db.Index('ix_event_user_start_time', 'user_id', 'start_time'),
+        # Interval-overlap lookups (calendar views): end_time leads so past events are skipped
+        db.Index('ix_event_user_end_start', 'user_id', 'end_time', 'start_time'),
+        # The same lookup for recurring series (recurrence_end is NULL for one-off events)
+        db.Index('ix_event_user_recurrence', 'user_id', 'recurrence_end', 'start_time'),
+        # The iCalendar feed's ETag: max(updated_at) and count per user from the index alone
+        db.Index('ix_event_user_updated', 'user_id', 'updated_at'),
+        db.Index('ix_event_user_ical_uid', 'user_id', 'ical_uid'),
+    )
+
+class EventException(db.Model):
+    """
+    One changed occurrence of a recurring event, identified by the start it
+    would have had (RECURRENCE-ID in iCalendar): either cancelled (EXDATE)
+    or moved/renamed, in which case the set fields replace the event's.
+    """
+    __tablename__ = 'event_exceptions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('events.id', ondelete='CASCADE'), nullable=False)
+    original_start = db.Column(db.DateTime, nullable=False)
+    cancelled = db.Column(db.Boolean, default=False, nullable=False)
+    start_time = db.Column(db.DateTime, nullable=True)
+    end_time = db.Column(db.DateTime, nullable=True)
+    title = db.Column(db.String(120), nullable=True)
+    description = db.Column(db.Text, nullable=True)
+
+    def __repr__(self):
+        return f'<EventException {self.event_id} @ {self.original_start}>'
+
+    __table_args__ = (
+        db.UniqueConstraint('event_id', 'original_start', name='uq_event_exception_occurrence'),
     )
 
 # Make sure datetime is imported if not already at the top
@@ -62,7 +109,7 @@ class Task(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     description = db.Column(db.Text, nullable=False)
-    due_date = db.Column(db.Date, nullable=True) # Date field for due date
+    due_date = db.Column(db.Date, nullable=True, index=True) # Date field for due date; indexed for the reminder rules scan
     priority = db.Column(db.Integer, default=1, nullable=False) # 1-Low, 2-Medium, 3-High
     status = db.Column(db.String(20), default='pending', nullable=False, index=True) # e.g., 'pending', 'completed'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -171,24 +218,155 @@ class Reminder(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     item_type = db.Column(db.String(20), nullable=False)  # 'event' or 'task'
     item_id = db.Column(db.Integer, nullable=False) # ID of the Event or Task
+    # Typed links to the item (the one matching item_type is set); deleting the item deletes its reminders
+    event_id = db.Column(db.Integer, db.ForeignKey('events.id', ondelete='CASCADE'), nullable=True, index=True)
+    task_id = db.Column(db.Integer, db.ForeignKey('tasks.id', ondelete='CASCADE'), nullable=True, index=True)
     reminder_time = db.Column(db.DateTime, nullable=False)
+    # Recurring events: the start of the occurrence this reminder is for (None: the event's start_time)
+    occurrence_start = db.Column(db.DateTime, nullable=True)
     notification_method = db.Column(db.String(20), default='email', nullable=False)
-    sent_status = db.Column(db.String(20), default='pending', nullable=False) # 'pending', 'sent', 'error'
+    # Set on rows materialized from a ReminderRule: the rule's offset, in minutes
+    offset_minutes = db.Column(db.Integer, nullable=True)
+    sent_status = db.Column(db.String(20), default='pending', nullable=False) # 'pending', 'claimed', 'queued', 'sent', 'retry', 'error', 'dead'
+    # Set while a dispatcher worker holds the reminder; an expired lease makes it claimable again
+    claimed_by = db.Column(db.String(120), nullable=True)
+    lease_until = db.Column(db.DateTime, nullable=True)
+    # Failed delivery attempts so far; a 'retry' reminder is due again at next_attempt_at
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Indexed for the reminder daemon's "changed since" refresh
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     # Relationship to User
     user = db.relationship('User', backref=db.backref('reminders', lazy='dynamic'))
+    # passive_deletes: the database's ON DELETE CASCADE removes the reminders, the ORM does not load them
+    event = db.relationship('Event', backref=db.backref('reminders', passive_deletes=True))
+    task = db.relationship('Task', backref=db.backref('reminders', passive_deletes=True))
 
     # Combined with existing ix_reminder_time_sent_status
     __table_args__ = (
         db.Index('ix_reminder_time_sent_status', 'reminder_time', 'sent_status'),
         db.Index('ix_reminder_user_item', 'user_id', 'item_type', 'item_id'), # For finding specific reminders
+        db.Index('ix_reminder_status_next_attempt', 'sent_status', 'next_attempt_at'), # For picking up due retries
+        # One delivery row per (item, rule offset, fire time) in rules mode
+        db.Index('uq_reminder_item_offset', 'item_type', 'item_id', 'offset_minutes', 'reminder_time', unique=True),
     )
 
     def __repr__(self):
         return f'<Reminder {self.id} for {self.item_type} {self.item_id} at {self.reminder_time} (Status: {self.sent_status})>'
 
+class ReminderArchive(db.Model):
+    """
+    Finished reminders ('sent', 'error', 'dead') moved out of `reminders` by
+    flask archive-reminders, so the dispatcher's indexes only cover in-flight work.
+    Keeps the original id; no foreign keys, so rows outlive their event or task.
+    """
+    __tablename__ = 'reminders_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False) # Reminder.id
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    item_type = db.Column(db.String(20), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    event_id = db.Column(db.Integer, nullable=True)
+    task_id = db.Column(db.Integer, nullable=True)
+    reminder_time = db.Column(db.DateTime, nullable=False)
+    occurrence_start = db.Column(db.DateTime, nullable=True)
+    notification_method = db.Column(db.String(20), nullable=False)
+    offset_minutes = db.Column(db.Integer, nullable=True)
+    sent_status = db.Column(db.String(20), nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, index=True) # When the reminder finished; retention purges by it
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ReminderArchive {self.id} for {self.item_type} {self.item_id} (Status: {self.sent_status})>'
+
+class ReminderRule(db.Model):
+    """
+    A per-user reminder offset evaluated at dispatch time (REMINDER_RULES_ENABLED).
+    For events: minutes before start_time. For tasks: minutes after midnight of the due date.
+    """
+    __tablename__ = 'reminder_rules'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    item_type = db.Column(db.String(20), nullable=False)  # 'event' or 'task'
+    offset_minutes = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user = db.relationship('User', backref=db.backref('reminder_rules', lazy='dynamic'))
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'item_type', 'offset_minutes', name='uq_reminder_rule'),
+        db.Index('ix_reminder_rule_type_offset', 'item_type', 'offset_minutes'), # For the per-offset dispatch scan
+    )
+
+    def __repr__(self):
+        return f'<ReminderRule {self.id}: {self.item_type} {self.offset_minutes} min (User: {self.user_id})>'
+
+class OutboxMessage(db.Model):
+    """A rendered reminder email spooled for the outbox sender (flask drain-outbox)."""
+    __tablename__ = 'outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Message-ID header of the spooled email; identifies a resend after a crash
+    message_id = db.Column(db.String(255), unique=True, nullable=False)
+    sender = db.Column(db.String(255), nullable=False)
+    recipients = db.Column(db.Text, nullable=False) # Comma-separated envelope recipients
+    payload = db.Column(db.LargeBinary, nullable=False) # Full RFC 5322 message
+    reminder_ids = db.Column(db.Text, nullable=False) # Comma-separated ids of the 'queued' reminders it covers
+    status = db.Column(db.String(20), default='pending', nullable=False) # 'pending', 'claimed', 'sent', 'retry', 'error', 'dead'
+    claimed_by = db.Column(db.String(120), nullable=True)
+    lease_until = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_outbox_status_next_attempt', 'status', 'next_attempt_at'), # For picking up pending and due retries
+    )
+
+    def reminder_id_list(self):
+        return [int(reminder_id) for reminder_id in self.reminder_ids.split(',') if reminder_id]
+
+    def __repr__(self):
+        return f'<OutboxMessage {self.id} {self.message_id} (Status: {self.status})>'
+
+class Notification(db.Model):
+    """An in-app notification, created when an 'inapp' reminder is dispatched."""
+    __tablename__ = 'notifications'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    reminder_id = db.Column(db.Integer, db.ForeignKey('reminders.id', ondelete='SET NULL'), nullable=True)
+    title = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=True)
+    url = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    read_at = db.Column(db.DateTime, nullable=True)
+
+    user = db.relationship('User', backref=db.backref('notifications', lazy='dynamic'))
+
+    __table_args__ = (
+        db.Index('ix_notification_user_id', 'user_id', 'id'), # For catch-up: a user's notifications after a given id
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'body': self.body,
+            'url': self.url,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'read': self.read_at is not None,
+        }
+
+    def __repr__(self):
+        return f'<Notification {self.id}: {self.title} (User: {self.user_id})>'
+
 # Ensure datetime and date are available
 from datetime import date # For default upload_date
 
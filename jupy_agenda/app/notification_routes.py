@@ -0,0 +1,109 @@
+from flask import Blueprint, Response, jsonify, request, current_app
+from flask_login import login_required, current_user
+from .models import Notification
+from .services.notifications import get_broker, notifications_since
+from . import db
+from sqlalchemy import func
+from datetime import datetime
+import json
+import queue
+import time
+
+notification_bp = Blueprint('notification', __name__)
+
+DEFAULT_HEARTBEAT_SECONDS = 15
+DEFAULT_STREAM_MAX_SECONDS = 300
+
+def _sse_event(payload):
+    """Formats one notification as a Server-Sent Event; its id lets the browser resume with Last-Event-ID."""
+    return f"id: {payload['id']}\nevent: notification\ndata: {json.dumps(payload)}\n\n"
+
+def _drain(subscriber):
+    try:
+        while True:
+            subscriber.get_nowait()
+    except queue.Empty:
+        pass
+
+@notification_bp.route('/')
+@login_required
+def list_notifications():
+    """Catch-up for clients that were offline: the user's notifications after ?since=<id>."""
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', None, type=int)
+    notifications = [n.to_dict() for n in notifications_since(current_user.id, since, limit)]
+    return jsonify({
+        'notifications': notifications,
+        'last_id': notifications[-1]['id'] if notifications else since,
+    })
+
+@notification_bp.route('/read', methods=['POST'])
+@login_required
+def mark_notifications_read():
+    """Marks the user's notifications up to ?up_to=<id> (default: all) as read."""
+    up_to = request.args.get('up_to', None, type=int)
+    query = Notification.query.filter(Notification.user_id == current_user.id, Notification.read_at.is_(None))
+    if up_to is not None:
+        query = query.filter(Notification.id <= up_to)
+    updated = query.update({'read_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return jsonify({'updated': updated})
+
+@notification_bp.route('/stream')
+@login_required
+def stream():
+    """
+    Server-Sent Events stream of the user's new notifications.
+
+    On connect it replays what the browser missed after Last-Event-ID or
+    ?since= (without either, only notifications created from now on are sent), then waits on the user's NotificationBroker queue. A push, or a
+    heartbeat timeout, triggers one indexed catch-up query, which also picks
+    up notifications written by a dispatcher running in another process.
+    The stream ends after NOTIFICATION_STREAM_MAX_SECONDS; EventSource
+    reconnects on its own and resumes from the last id it saw.
+
+    Each open stream occupies a worker thread, so it is only held for users
+    who get reminders in the app; anyone else gets 204 No Content, which
+    also tells EventSource not to reconnect.
+    """
+    if current_user.notification_method != 'inapp':
+        return Response(status=204)
+    app = current_app._get_current_object()
+    user_id = current_user.id
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('since', None, type=int)
+    if last_id is None:
+        last_id = db.session.query(func.max(Notification.id)).filter(Notification.user_id == user_id).scalar() or 0
+    heartbeat = app.config.get('NOTIFICATION_HEARTBEAT_SECONDS', DEFAULT_HEARTBEAT_SECONDS)
+    max_seconds = app.config.get('NOTIFICATION_STREAM_MAX_SECONDS', DEFAULT_STREAM_MAX_SECONDS)
+    broker = get_broker(app)
+    subscriber = broker.subscribe(user_id)
+
+    def events():
+        nonlocal last_id
+        deadline = time.monotonic() + max_seconds
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                # A short-lived context per query, so no connection is held while waiting
+                with app.app_context():
+                    payloads = [n.to_dict() for n in notifications_since(user_id, last_id)]
+                for payload in payloads:
+                    last_id = payload['id']
+                    yield _sse_event(payload)
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    subscriber.get(timeout=min(heartbeat, remaining))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                else:
+                    _drain(subscriber) # A burst of pushes needs only one catch-up query
+        finally:
+            broker.unsubscribe(user_id, subscriber)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -0,0 +1,150 @@
+from flask import current_app
+from flask_mail import email_dispatched, sanitize_address, sanitize_addresses
+from .reminder_metrics import get_metrics
+import asyncio
+import time
+
+try:
+    import aiosmtplib
+except ImportError: # Optional dependency; only needed for the 'async' delivery backend
+    aiosmtplib = None
+
+DEFAULT_POOL_SIZE = 4
+
+class AsyncSMTPDelivery:
+    """
+    Asyncio delivery backend: pushes pre-rendered Flask-Mail messages through
+    a small pool of aiosmtplib connections.
+
+    At most `pool_size` messages are in flight at once (one per connection),
+    so a single thread can keep a slow relay busy. Connections live on a
+    private event loop and are reused across deliver() calls until close().
+    Each connection is recycled after MAIL_MAX_MESSAGES_PER_CONNECTION
+    messages and re-opened once if the relay drops it.
+
+    Usage:
+        engine = AsyncSMTPDelivery(app)
+        results = engine.deliver([(key, msg), ...]) # {key: None or the exception raised}
+        engine.close()
+    """
+
+    def __init__(self, app=None, pool_size=None, max_messages=None, rate_limiter=None):
+        if aiosmtplib is None:
+            raise RuntimeError("The 'async' delivery backend requires aiosmtplib (pip install aiosmtplib).")
+        self.app = app or current_app._get_current_object()
+        config = self.app.config
+        self.pool_size = pool_size or config.get('MAIL_ASYNC_POOL_SIZE', DEFAULT_POOL_SIZE)
+        if max_messages is None:
+            max_messages = config.get('MAIL_MAX_MESSAGES_PER_CONNECTION', 100)
+        self.max_messages = max_messages
+        self.rate_limiter = rate_limiter
+        self.suppress = config.get('MAIL_SUPPRESS_SEND', False)
+        self.connections_opened = 0
+        self.messages_sent = 0
+        self._smtp_settings = dict(
+            hostname=config.get('MAIL_SERVER', 'localhost'),
+            port=config.get('MAIL_PORT', 25),
+            username=config.get('MAIL_USERNAME') or None,
+            password=config.get('MAIL_PASSWORD') or None,
+            use_tls=config.get('MAIL_USE_SSL', False), # implicit TLS, like smtplib.SMTP_SSL
+            start_tls=True if config.get('MAIL_USE_TLS', False) else False,
+            timeout=config.get('MAIL_TIMEOUT', 60),
+        )
+        self._loop = asyncio.new_event_loop()
+        self._clients = [None] * self.pool_size
+        self._sent_on_client = [0] * self.pool_size
+
+    def deliver(self, keyed_messages):
+        """
+        Sends (key, message) pairs and returns {key: None on success, or the exception}.
+        Keys are opaque to the engine (the dispatcher uses tuples of reminder ids).
+        """
+        keyed_messages = list(keyed_messages)
+        if not keyed_messages:
+            return {}
+        return self._loop.run_until_complete(self._deliver(keyed_messages))
+
+    def close(self):
+        """Quits every pooled connection and closes the private event loop."""
+        if self._loop.is_closed():
+            return
+        self._loop.run_until_complete(self._close_clients())
+        self._loop.close()
+
+    async def _close_clients(self):
+        for slot in range(self.pool_size):
+            await self._drop_client(slot)
+
+    async def _deliver(self, keyed_messages):
+        queue = asyncio.Queue()
+        for keyed_message in keyed_messages:
+            queue.put_nowait(keyed_message)
+        results = {}
+        workers = [self._worker(slot, queue, results) for slot in range(min(self.pool_size, len(keyed_messages)))]
+        await asyncio.gather(*workers)
+        return results
+
+    async def _worker(self, slot, queue, results):
+        while True:
+            try:
+                key, msg = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            results[key] = await self._send(slot, msg)
+
+    async def _connected_client(self, slot):
+        client = self._clients[slot]
+        if client is not None and self.max_messages and self._sent_on_client[slot] >= self.max_messages:
+            await self._drop_client(slot)
+            client = None
+        if client is None:
+            client = aiosmtplib.SMTP(**self._smtp_settings)
+            await client.connect()
+            self._clients[slot] = client
+            self._sent_on_client[slot] = 0
+            self.connections_opened += 1
+        return client
+
+    async def _drop_client(self, slot):
+        client = self._clients[slot]
+        self._clients[slot] = None
+        if client is None:
+            return
+        try:
+            await client.quit()
+        except Exception:
+            client.close()
+
+    async def _send(self, slot, msg):
+        if msg.has_bad_headers():
+            return ValueError("Message has bad headers")
+        if msg.date is None:
+            msg.date = time.time()
+
+        if self.rate_limiter:
+            wait = self.rate_limiter.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        started = time.perf_counter()
+        try:
+            if not self.suppress:
+                sender = sanitize_address(msg.sender)
+                recipients = list(sanitize_addresses(msg.send_to))
+                payload = msg.as_bytes()
+                try:
+                    client = await self._connected_client(slot)
+                    await client.sendmail(sender, recipients, payload)
+                except (aiosmtplib.SMTPServerDisconnected, ConnectionError) as e:
+                    self.app.logger.warning(f"Async SMTP connection {slot} lost ({e}). Reconnecting and retrying once.")
+                    await self._drop_client(slot)
+                    client = await self._connected_client(slot)
+                    await client.sendmail(sender, recipients, payload)
+                self._sent_on_client[slot] += 1
+        except Exception as e:
+            return e
+
+        self.messages_sent += 1
+        get_metrics(self.app).record_latency('email', time.perf_counter() - started)
+        email_dispatched.send(self.app, message=msg) # Same signal Flask-Mail emits, so record_messages() still works
+        return None
@@ -0,0 +1,88 @@
+from ..models import Event
+from .. import db
+from .recurrence import expand_event
+from datetime import datetime, timedelta
+import heapq
+
+def _single_overlap(user_id, range_start, range_end):
+    # One-off events: ix_event_user_end_start (user_id, end_time, start_time)
+    return (Event.user_id == user_id, Event.end_time > range_start, Event.start_time < range_end,
+            Event.rrule.is_(None))
+
+def _recurring_overlap(user_id, range_start, range_end):
+    # Recurring series: ix_event_user_recurrence (user_id, recurrence_end, start_time)
+    return (Event.user_id == user_id, Event.recurrence_end > range_start, Event.start_time < range_end)
+
+def events_overlapping(user_id, range_start, range_end):
+    """
+    The user's events that overlap [range_start, range_end), ordered by
+    start_time: one-off events with start_time < range_end AND end_time >
+    range_start, so events that began earlier or span several days are
+    included, plus recurring series whose first start and last end
+    (recurrence_end) enclose part of the range.
+
+    Served by ix_event_user_end_start (user_id, end_time, start_time) and
+    ix_event_user_recurrence (user_id, recurrence_end, start_time): each index
+    range starts past range_start and the start_time bound is checked from
+    the index, so years of past events are never read.
+    """
+    single = Event.query.filter(*_single_overlap(user_id, range_start, range_end)).all()
+    recurring = Event.query.filter(*_recurring_overlap(user_id, range_start, range_end)).all()
+    return sorted(single + recurring, key=lambda event: (event.start_time, event.id))
+
+def occurrences_overlapping(user_id, range_start, range_end):
+    """
+    What the calendar shows for [range_start, range_end): one-off events as
+    they are and recurring ones expanded (windowed, cached) into the
+    occurrences that overlap the range, ordered by start_time.
+    """
+    occurrences = []
+    for event in events_overlapping(user_id, range_start, range_end):
+        if event.rrule:
+            occurrences.extend(expand_event(event, range_start, range_end))
+        else:
+            occurrences.append(event)
+    return sorted(occurrences, key=lambda occurrence: (occurrence.start_time, occurrence.id))
+
+def iter_occurrence_rows(user_id, range_start, range_end, batch_size=500):
+    """
+    Like occurrences_overlapping, but lazy and projected for the JSON API:
+    one-off events are read as (id, title, start_time, end_time) rows,
+    `batch_size` at a time, and merged in start order with the (few,
+    already expanded) occurrences of recurring series. Iterate inside an
+    app context; nothing is loaded as an ORM object except the series.
+    """
+    occurrences = []
+    for event in Event.query.filter(*_recurring_overlap(user_id, range_start, range_end)):
+        occurrences.extend(expand_event(event, range_start, range_end))
+    occurrences.sort(key=lambda occurrence: (occurrence.start_time, occurrence.id))
+
+    rows = db.session.query(Event.id, Event.title, Event.start_time, Event.end_time).filter(
+        *_single_overlap(user_id, range_start, range_end)
+    ).order_by(Event.start_time, Event.id).yield_per(batch_size)
+    return heapq.merge(rows, occurrences, key=lambda item: (item.start_time, item.id))
+
+def event_days(event):
+    """First and last calendar day `event` covers; an end at midnight does not cover that day."""
+    first_day = event.start_time.date()
+    return first_day, max(first_day, (event.end_time - timedelta(microseconds=1)).date())
+
+def bucket_by_day(events, first_day, last_day):
+    """
+    Buckets `events` (ordered by start_time) into {date: [event, ...]} for
+    every day from first_day to last_day they cover, in one pass. Events
+    keep their order within a day, so multi-day events come first.
+    """
+    buckets = {}
+    for event in events:
+        start, end = event_days(event)
+        day = max(start, first_day)
+        end = min(end, last_day)
+        while day <= end:
+            buckets.setdefault(day, []).append(event)
+            day += timedelta(days=1)
+    return buckets
+
+def day_start(day):
+    """Midnight at the start of `day` as a naive datetime (event times are stored naive UTC)."""
+    return datetime.combine(day, datetime.min.time())
@@ -0,0 +1,110 @@
+from ..models import Event, EventException
+from .. import db
+from .recurrence import get_zone, to_local
+from sqlalchemy import func
+import hashlib
+import re
+
+DEFAULT_BATCH_SIZE = 500 # Events fetched per round trip from the server-side cursor
+PRODID = '-//Jupy Agenda//Calendar//PT'
+
+def escape_text(value):
+    """Escapes a TEXT value (RFC 5545 3.3.11)."""
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+def fold(line):
+    """Folds a content line into 75-octet pieces joined by CRLF + space, without splitting a UTF-8 character."""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    pieces, start, limit = [], 0, 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80: # Continuation byte: back off
+            end -= 1
+        pieces.append(encoded[start:end].decode('utf-8'))
+        start, limit = end, 74 # Continuation lines start with the folding space
+    return '\r\n '.join(pieces) + '\r\n'
+
+def format_utc(moment):
+    """A naive UTC datetime as an iCalendar UTC DATE-TIME."""
+    return moment.strftime('%Y%m%dT%H%M%SZ')
+
+def format_time(name, moment, zone_name=None):
+    """A DATE-TIME property: UTC, or local time with a TZID for a series that repeats in that zone."""
+    zone = get_zone(zone_name)
+    if zone is None:
+        return f'{name}:{format_utc(moment)}'
+    return f'{name};TZID={zone_name}:{to_local(moment, zone).strftime("%Y%m%dT%H%M%S")}'
+
+def export_rrule(rule):
+    """Event.rrule for a UTC DTSTART: UNTIL must be a UTC DATE-TIME too (it is stored without the Z)."""
+    rule = re.sub(r'UNTIL=(\d{8})(?![T\d])', r'UNTIL=\1T235959', rule)
+    return re.sub(r'(UNTIL=\d{8}T\d{6})(?!Z)', r'\1Z', rule)
+
+def _vevent(uid, start, end, summary, description, stamp, rrule=None, exdates=(), recurrence_id=None, zone_name=None):
+    lines = ['BEGIN:VEVENT', f'UID:{uid}', f'DTSTAMP:{format_utc(stamp)}', format_time('DTSTART', start, zone_name),
+             format_time('DTEND', end, zone_name), f'SUMMARY:{escape_text(summary)}']
+    if description:
+        lines.append(f'DESCRIPTION:{escape_text(description)}')
+    if rrule:
+        lines.append(f'RRULE:{export_rrule(rrule)}')
+    if exdates:
+        times = [format_time('EXDATE', exdate, zone_name) for exdate in exdates]
+        lines.append(times[0] + ''.join(',' + time.partition(':')[2] for time in times[1:]))
+    if recurrence_id is not None:
+        lines.append(format_time('RECURRENCE-ID', recurrence_id, zone_name))
+    lines.append(f'LAST-MODIFIED:{format_utc(stamp)}')
+    lines.append('END:VEVENT')
+    return ''.join(fold(line) for line in lines)
+
+def calendar_version(user_id):
+    """
+    (ETag, Last-Modified) of the user's feed from one aggregate over
+    ix_event_user_updated: the latest Event.updated_at plus the event
+    count, so deleting an event changes the tag too. Editing a recurring
+    event's exceptions bumps its rule_version and so its updated_at.
+    """
+    latest, count = db.session.query(func.max(Event.updated_at), func.count(Event.id)).filter(
+        Event.user_id == user_id).one()
+    tag = hashlib.sha1(f'{user_id}:{latest.isoformat() if latest else "-"}:{count}'.encode()).hexdigest()
+    return tag, latest
+
+def iter_calendar(user_id, uid_domain, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Generates the user's calendar as iCalendar text, one VEVENT per chunk.
+    Events are read as plain rows from a server-side cursor (where the
+    driver has one) `batch_size` at a time, so the document is never held in memory.
+    Cancelled occurrences become EXDATEs; moved or renamed ones are extra
+    VEVENTs with a RECURRENCE-ID. Series that repeat in a zone (Event.timezone)
+    keep it as a TZID. Iterate inside an app context.
+    """
+    yield ''.join(fold(line) for line in ('BEGIN:VCALENDAR', 'VERSION:2.0', f'PRODID:{PRODID}', 'CALSCALE:GREGORIAN',
+                                          'METHOD:PUBLISH', 'X-WR-CALNAME:Jupy Agenda'))
+
+    exdates = {} # Few rows: only cancelled occurrences of this user's recurring events
+    cancelled = db.session.query(EventException.event_id, EventException.original_start).join(Event).filter(
+        Event.user_id == user_id, EventException.cancelled.is_(True)).order_by(EventException.original_start)
+    for event_id, original_start in cancelled:
+        exdates.setdefault(event_id, []).append(original_start)
+
+    events = db.session.query(
+        Event.id, Event.ical_uid, Event.title, Event.description, Event.start_time, Event.end_time, Event.rrule,
+        Event.updated_at, Event.created_at, Event.timezone,
+    ).filter(Event.user_id == user_id).order_by(Event.id).yield_per(batch_size) # yield_per also sets stream_results
+    for event in events:
+        yield _vevent(event.ical_uid or f'event-{event.id}@{uid_domain}', event.start_time, event.end_time, event.title, event.description,
+                      event.updated_at or event.created_at or event.start_time, event.rrule, exdates.get(event.id, ()),
+                      zone_name=event.timezone)
+
+    overrides = db.session.query(EventException, Event.ical_uid, Event.title, Event.description, Event.start_time,
+                                 Event.end_time, Event.updated_at, Event.timezone).join(Event).filter(
+        Event.user_id == user_id, EventException.cancelled.is_(False)).order_by(EventException.id)
+    for exception, ical_uid, title, description, series_start, series_end, updated_at, zone_name in overrides:
+        start = exception.start_time or exception.original_start
+        end = exception.end_time or start + (series_end - series_start)
+        yield _vevent(ical_uid or f'event-{exception.event_id}@{uid_domain}', start, end, exception.title or title,
+                      exception.description if exception.description is not None else description,
+                      updated_at or series_start, recurrence_id=exception.original_start, zone_name=zone_name)
+
+    yield 'END:VCALENDAR\r\n'
@@ -0,0 +1,258 @@
+from flask import current_app
+from .. import db
+from ..models import Event, EventException, Reminder, User
+from .recurrence import refresh_recurrence, get_zone, to_utc
+from .reminder_rules import rules_enabled
+from .reminder_policy import event_reminder_time
+from .reminder_maintenance import EVENT_REMINDER_BUFFER, refresh_occurrence_reminders
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import hashlib
+import re
+import time
+import uuid
+
+DEFAULT_IMPORT_BATCH_SIZE = 500 # Events per bulk INSERT and transaction
+TITLE_MAX_LENGTH = 120 # Event.title
+UID_MAX_LENGTH = 255 # Event.ical_uid; longer UIDs are stored as their SHA-1
+_DURATION = re.compile(r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+def unfold(lines):
+    """Joins folded content lines (continuations start with a space or tab) from an iterable of text lines."""
+    current = None
+    for raw in lines:
+        line = raw.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+def parse_content_line(line):
+    """'DTSTART;TZID="Europe/Lisbon":20240304T090000' -> ('DTSTART', {'TZID': 'Europe/Lisbon'}, '20240304T090000')."""
+    quoted, split = False, None
+    for index, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == ':' and not quoted:
+            split = index
+            break
+    if split is None:
+        return None
+    name, *params = line[:split].split(';')
+    return name.upper(), {key.upper(): value.strip('"') for key, _, value in (param.partition('=') for param in params)}, line[split + 1:]
+
+def unescape_text(value):
+    return re.sub(r'\\([\\;,nN])', lambda match: '\n' if match.group(1) in 'nN' else match.group(1), value)
+
+def iter_vevents(lines):
+    """
+    Streams the VEVENTs of an iCalendar document as {NAME: [(params, value), ...]}
+    dicts, one at a time, from an iterable of lines (e.g. an open file).
+    Properties of nested components such as VALARM are left out.
+    """
+    stack, properties = [], None
+    for line in unfold(lines):
+        parsed = parse_content_line(line)
+        if parsed is None:
+            continue
+        name, params, value = parsed
+        if name == 'BEGIN':
+            stack.append(value.upper())
+            if stack[-1] == 'VEVENT':
+                properties = {}
+        elif name == 'END':
+            if stack and stack.pop() == 'VEVENT' and properties is not None:
+                yield properties
+                properties = None
+        elif properties is not None and stack and stack[-1] == 'VEVENT':
+            properties.setdefault(name, []).append((params, value))
+
+def parse_ical_time(value, params):
+    """
+    A DATE or DATE-TIME value as (naive UTC datetime, all_day). Times with a
+    Z are UTC, with a TZID are converted from that zone; floating times and
+    unknown zones are taken as UTC.
+    """
+    value = value.strip()
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        return datetime.strptime(value[:8], '%Y%m%d'), True
+    moment = datetime.strptime(value[:15], '%Y%m%dT%H%M%S')
+    zone = None if value.endswith('Z') else get_zone(params.get('TZID'))
+    return (to_utc(moment, zone) if zone else moment), False
+
+def parse_duration(value):
+    match = _DURATION.match(value.strip())
+    if not match:
+        raise ValueError(f'Invalid DURATION: {value}')
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                         minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration if sign == '-' else duration
+
+def _first(properties, name, default=None):
+    values = properties.get(name)
+    return values[0] if values else default
+
+def _uid(properties):
+    uid = _first(properties, 'UID', ({}, ''))[1].strip() or f'{uuid.uuid4()}@import'
+    return uid if len(uid) <= UID_MAX_LENGTH else hashlib.sha1(uid.encode()).hexdigest()
+
+def _event_row(properties, user_id):
+    """
+    The Event row for one VEVENT (start/end/title/rule and its EXDATEs); raises ValueError if it has no usable DTSTART.
+    A recurring event with a DTSTART TZID keeps the zone, so its rule is expanded in local time.
+    """
+    params, value = _first(properties, 'DTSTART', ({}, ''))
+    start, all_day = parse_ical_time(value, params)
+    if 'DTEND' in properties:
+        end = parse_ical_time(_first(properties, 'DTEND')[1], _first(properties, 'DTEND')[0])[0]
+    elif 'DURATION' in properties:
+        end = start + parse_duration(_first(properties, 'DURATION')[1])
+    else:
+        end = start + timedelta(days=1) if all_day else start
+    row = SimpleNamespace(
+        id=None, user_id=user_id, ical_uid=_uid(properties), start_time=start, end_time=max(start, end),
+        title=unescape_text(_first(properties, 'SUMMARY', ({}, ''))[1]).strip()[:TITLE_MAX_LENGTH] or '(sem título)',
+        description=unescape_text(_first(properties, 'DESCRIPTION', ({}, ''))[1]) or None,
+        rrule=_first(properties, 'RRULE', ({}, None))[1], recurrence_end=None, rule_version=1, timezone=None,
+    )
+    if row.rrule and not all_day and not value.strip().endswith('Z') and get_zone(params.get('TZID')):
+        row.timezone = params['TZID'] # Repeat at the same local time across DST changes
+    refresh_recurrence(row) # Validates the rule and sets recurrence_end
+    exdates = [parse_ical_time(exdate, params)[0]
+               for params, value in properties.get('EXDATE', ()) for exdate in value.split(',') if exdate.strip()]
+    return row, exdates
+
+def _reminder_rows(events, user_id, notification_method, now):
+    """Reminder rows for freshly inserted one-off (id, start_time) events, following _update_event_reminder's policy."""
+    rows = []
+    for event_id, start_time in events:
+        reminder_time = event_reminder_time(start_time)
+        if start_time > now + EVENT_REMINDER_BUFFER and reminder_time > now:
+            rows.append({'user_id': user_id, 'item_type': 'event', 'item_id': event_id, 'event_id': event_id, 'task_id': None,
+                         'reminder_time': reminder_time, 'notification_method': notification_method,
+                         'sent_status': 'pending', 'attempts': 0})
+    return rows
+
+def import_ics(lines, user_id, batch_size=None, progress=None, now=None):
+    """
+    Imports the VEVENTs read from `lines` (any iterable of text lines, e.g.
+    an open .ics file or an uploaded stream) as events of `user_id`.
+
+    The document is parsed as a stream. Every `batch_size` events
+    (IMPORT_BATCH_SIZE, default 500) one executemany INSERT writes the
+    events and one more writes their reminders (unless reminder rules are
+    on), in a single transaction; `progress(stats)` is called after each.
+    Recurring events get one reminder per occurrence in the reminder horizon
+    at the end, once their cancelled occurrences are known.
+    Events are keyed by (user, UID), so importing the same file again skips
+    what is already there. Cancelled occurrences (EXDATE, STATUS:CANCELLED)
+    and moved ones (RECURRENCE-ID) become EventException rows at the end.
+
+    Returns a dict with 'events', 'recurring', 'exceptions', 'reminders',
+    'skipped', 'invalid', 'batches', 'seconds' and 'events_per_second'.
+    """
+    batch_size = batch_size or current_app.config.get('IMPORT_BATCH_SIZE', DEFAULT_IMPORT_BATCH_SIZE)
+    now = now or datetime.utcnow()
+    user = db.session.get(User, user_id)
+    if user is None:
+        raise ValueError(f'User {user_id} does not exist')
+    with_reminders = not rules_enabled()
+    notification_method = user.notification_method or 'email'
+
+    stats = {'events': 0, 'recurring': 0, 'exceptions': 0, 'reminders': 0, 'skipped': 0, 'invalid': 0, 'batches': 0}
+    started = time.perf_counter()
+    series_ids = {} # ical_uid -> id of the recurring events imported; for the exceptions
+    pending_exceptions = [] # (uid, original_start, cancelled, override fields); usually few
+    seen_uids = set()
+    chunk = []
+
+    def flush():
+        uids = [row.ical_uid for row, exdates in chunk]
+        existing = {uid for (uid,) in db.session.query(Event.ical_uid).filter(Event.user_id == user_id, Event.ical_uid.in_(uids))}
+        rows = [(row, exdates) for row, exdates in chunk if row.ical_uid not in existing]
+        stats['skipped'] += len(chunk) - len(rows)
+        chunk.clear()
+        if rows:
+            db.session.execute(Event.__table__.insert(), [
+                {'user_id': user_id, 'ical_uid': row.ical_uid, 'title': row.title, 'description': row.description,
+                 'start_time': row.start_time, 'end_time': row.end_time, 'rrule': row.rrule,
+                 'recurrence_end': row.recurrence_end, 'rule_version': 1, 'timezone': row.timezone, 'created_at': now, 'updated_at': now}
+                for row, exdates in rows
+            ])
+            ids = dict(db.session.query(Event.ical_uid, Event.id).filter(
+                Event.user_id == user_id, Event.ical_uid.in_([row.ical_uid for row, exdates in rows])))
+            for row, exdates in rows:
+                if row.rrule:
+                    series_ids[row.ical_uid] = ids[row.ical_uid]
+                    stats['recurring'] += 1
+                    pending_exceptions.extend((row.ical_uid, exdate, True, {}) for exdate in exdates)
+            if with_reminders: # Recurring events get theirs once their exceptions are in
+                reminders = _reminder_rows([(ids[row.ical_uid], row.start_time) for row, exdates in rows if not row.rrule],
+                                           user_id, notification_method, now)
+                if reminders:
+                    db.session.execute(Reminder.__table__.insert(), reminders)
+                stats['reminders'] += len(reminders)
+        db.session.commit()
+        stats['events'] += len(rows)
+        stats['batches'] += 1
+        if progress:
+            progress(dict(stats))
+
+    for properties in iter_vevents(lines):
+        status = _first(properties, 'STATUS', ({}, ''))[1].upper()
+        try:
+            if 'RECURRENCE-ID' in properties: # One changed occurrence of a series
+                params, value = _first(properties, 'RECURRENCE-ID')
+                row, exdates = _event_row(properties, user_id)
+                pending_exceptions.append((row.ical_uid, parse_ical_time(value, params)[0], status == 'CANCELLED',
+                                           {'start_time': row.start_time, 'end_time': row.end_time,
+                                            'title': row.title, 'description': row.description}))
+                continue
+            row, exdates = _event_row(properties, user_id)
+        except (ValueError, TypeError) as e:
+            stats['invalid'] += 1
+            current_app.logger.warning(f"Skipping invalid VEVENT {_first(properties, 'UID', ({}, '?'))[1]}: {e}")
+            continue
+        if status == 'CANCELLED' or row.ical_uid in seen_uids:
+            stats['skipped'] += 1
+            continue
+        seen_uids.add(row.ical_uid)
+        chunk.append((row, exdates))
+        if len(chunk) >= batch_size:
+            flush()
+    if chunk:
+        flush()
+
+    exceptions = {}
+    for uid, original_start, cancelled, fields in pending_exceptions:
+        event_id = series_ids.get(uid)
+        if event_id is None: # Its series was not imported now (not in the file, invalid or already there)
+            stats['skipped'] += 1
+            continue
+        exception = {'event_id': event_id, 'original_start': original_start, 'cancelled': cancelled,
+                     'start_time': None, 'end_time': None, 'title': None, 'description': None}
+        if not cancelled:
+            exception.update(fields)
+        exceptions[(event_id, original_start)] = exception # A later entry for the same occurrence wins
+    rows = list(exceptions.values())
+    for offset in range(0, len(rows), batch_size):
+        db.session.execute(EventException.__table__.insert(), rows[offset:offset + batch_size])
+    db.session.commit()
+    stats['exceptions'] = len(rows)
+    if with_reminders:
+        series = sorted(series_ids.values())
+        for offset in range(0, len(series), batch_size):
+            stats['reminders'] += refresh_occurrence_reminders(event_ids=series[offset:offset + batch_size], now=now,
+                                                               batch_size=batch_size)['created']
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['events_per_second'] = round(stats['events'] / stats['seconds'], 1) if stats['seconds'] else None
+    current_app.logger.info(f"Imported {stats['events']} events ({stats['recurring']} recurring) for user {user_id} "
+                            f"in {stats['batches']} batches, {stats['seconds']} s. Reminders: {stats['reminders']}, "
+                            f"exceptions: {stats['exceptions']}, skipped: {stats['skipped']}, invalid: {stats['invalid']}.")
+    return stats
@@ -0,0 +1,119 @@
+from flask import current_app
+from .. import mail
+import smtplib
+import socket
+
+DEFAULT_MAX_MESSAGES_PER_CONNECTION = 100
+
+# Errors that mean the SMTP session itself is gone (as opposed to a rejected message).
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+def _smtp_code(error):
+    # smtplib exceptions carry smtp_code, aiosmtplib ones carry code
+    code = getattr(error, 'smtp_code', None)
+    if code is None:
+        code = getattr(error, 'code', None)
+    return code if isinstance(code, int) and code > 0 else None
+
+def is_transient_error(error):
+    """
+    True when a send failure is worth retrying later: the relay was unreachable
+    or dropped the session, or answered with a 4xx (temporary) reply.
+    5xx replies and anything else (bad data, template errors) are permanent.
+    Works for both smtplib and aiosmtplib exceptions, and honours a `transient`
+    attribute on other channels' errors (e.g. webhook_delivery.WebhookError).
+    """
+    transient = getattr(error, 'transient', None)
+    if isinstance(transient, bool):
+        return transient
+    code = _smtp_code(error)
+    if code is not None:
+        return 400 <= code < 500
+
+    recipients = getattr(error, 'recipients', None)
+    if recipients:
+        # smtplib: {address: (code, message)}; aiosmtplib: [SMTPRecipientRefused, ...]
+        refusals = recipients.values() if isinstance(recipients, dict) else recipients
+        codes = [refusal[0] if isinstance(refusal, tuple) else _smtp_code(refusal) for refusal in refusals]
+        return all(isinstance(c, int) and 400 <= c < 500 for c in codes)
+
+    return isinstance(error, CONNECTION_ERRORS + (socket.gaierror,))
+
+class PersistentMailConnection:
+    """
+    Sends many messages over one long-lived Flask-Mail connection.
+
+    The connection is opened lazily on the first send, recycled after
+    `max_messages` messages and re-opened once if the server drops it mid-batch.
+    `connections_opened` counts real SMTP sessions (0 when MAIL_SUPPRESS_SEND is on).
+
+    Usage:
+        with PersistentMailConnection() as connection:
+            for msg in messages:
+                connection.send(msg)
+    """
+
+    def __init__(self, max_messages=None):
+        if max_messages is None:
+            max_messages = current_app.config.get('MAIL_MAX_MESSAGES_PER_CONNECTION', DEFAULT_MAX_MESSAGES_PER_CONNECTION)
+        self.max_messages = max_messages
+        self.connections_opened = 0
+        self.messages_sent = 0
+        self._connection = None
+        self._sent_on_connection = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _open(self):
+        connection = mail.connect()
+        connection.__enter__()
+        self._connection = connection
+        self._sent_on_connection = 0
+        if connection.host is not None:
+            self.connections_opened += 1
+
+    def close(self):
+        """Closes the current SMTP session, if any. Errors on QUIT are ignored."""
+        if self._connection is None:
+            return
+        try:
+            self._connection.__exit__(None, None, None)
+        except Exception as e:
+            current_app.logger.warning(f"Error closing SMTP connection: {e}")
+        self._connection = None
+
+    def _send_with_reconnect(self, send):
+        if self._connection is None:
+            self._open()
+        elif self.max_messages and self._sent_on_connection >= self.max_messages:
+            self.close()
+            self._open()
+
+        try:
+            send(self._connection)
+        except CONNECTION_ERRORS as e:
+            current_app.logger.warning(f"SMTP connection lost ({e}). Reconnecting and retrying once.")
+            self.close()
+            self._open()
+            send(self._connection)
+
+        self._sent_on_connection += 1
+        self.messages_sent += 1
+
+    def send(self, msg):
+        """Sends one message, reconnecting when the message quota is used up or the session dropped."""
+        self._send_with_reconnect(lambda connection: connection.send(msg))
+
+    def send_raw(self, sender, recipients, payload):
+        """
+        Sends an already serialized message (bytes) as-is, e.g. one read back
+        from the outbox. A no-op apart from the counters when mail is suppressed.
+        """
+        def send(connection):
+            if connection.host is not None:
+                connection.host.sendmail(sender, recipients, payload)
+        self._send_with_reconnect(send)
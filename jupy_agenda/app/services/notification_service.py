@@ -1,9 +1,25 @@
-from flask import current_app, render_template
-from flask_mail import Message
+from flask import current_app
 from .. import mail, db # Access mail instance from app factory, and db
 from ..models import Reminder, User, Event, Task # Import necessary models
+from .mail_delivery import is_transient_error
+from .reminder_policy import retry_schedule
+from .reminder_renderer import get_renderer
 from datetime import datetime
 
+def build_reminder_message(reminder, user, item):
+    """
+    Builds (but does not send) the email Message for a reminder.
+    The caller is responsible for having loaded the user and the related item.
+    """
+    return get_renderer().reminder_message(reminder, user, item)
+
+def build_digest_message(user, entries):
+    """
+    Builds one email listing several reminders for the same user.
+    `entries` is a list of (reminder, item) pairs, already loaded by the caller.
+    """
+    return get_renderer().digest_message(user, entries)
+
 def send_email_reminder(reminder_id):
     """
     Sends an email for a given reminder.
@@ -21,7 +37,7 @@ def send_email_reminder(reminder_id):
             app.logger.error(f"Reminder with ID {reminder_id} not found.")
             return False
 
-        if reminder.sent_status != 'pending':
+        if reminder.sent_status not in ('pending', 'retry'):
             app.logger.info(f"Reminder {reminder_id} is not pending (status: {reminder.sent_status}). Skipping.")
             return False
 
@@ -32,18 +48,10 @@ def send_email_reminder(reminder_id):
             db.session.commit()
             return False
 
-        item = None
-        template_base = None
-        subject = ""
-
         if reminder.item_type == 'event':
             item = Event.query.get(reminder.item_id)
-            template_base = 'email/event_reminder'
-            subject = f"Event Reminder: {item.title if item else 'N/A'}"
         elif reminder.item_type == 'task':
             item = Task.query.get(reminder.item_id)
-            template_base = 'email/task_reminder'
-            subject = f"Task Reminder: {item.description[:30] if item else 'N/A'}..."
         else:
             app.logger.error(f"Unknown item_type '{reminder.item_type}' for reminder {reminder_id}.")
             reminder.sent_status = 'error'
@@ -64,22 +72,18 @@ def send_email_reminder(reminder_id):
             return False
 
         try:
-            msg = Message(
-                subject,
-                sender=app.config.get('MAIL_DEFAULT_SENDER', 'noreply@jupy.agenda'),
-                recipients=[user.email]
-            )
-            msg.body = render_template(template_base + '.txt', user=user, item=item)
-            msg.html = render_template(template_base + '.html', user=user, item=item)
+            msg = build_reminder_message(reminder, user, item)
             
             if app.config.get('MAIL_SUPPRESS_SEND', False):
                 # If MAIL_SUPPRESS_SEND is True, Flask-Mail's send() is a no-op.
                 # We can log the email content for debugging if needed.
-                app.logger.info(f"MAIL_SUPPRESS_SEND is True. Email for reminder {reminder.id} to {user.email} would be: \nSubject: {msg.subject}\nBody:\n{msg.body}")
+                app.logger.info(f"MAIL_SUPPRESS_SEND is True. Email for reminder {reminder.id} to {user.email} would be: \nSubject: {msg.subject}\nBody:\n{msg.body}",
+                                extra={'event': 'reminder_suppressed', 'channel': 'email', 'reminder_ids': [reminder.id], 'sample': True})
                 mail.send(msg) # This will be a no-op but good to call to ensure flow.
             else:
                 mail.send(msg)
-                app.logger.info(f"Sent reminder {reminder.id} to {user.email} for {reminder.item_type} {item.id}")
+                app.logger.info(f"Sent reminder {reminder.id} to {user.email} for {reminder.item_type} {item.id}",
+                                extra={'event': 'reminder_sent', 'channel': 'email', 'reminder_ids': [reminder.id], 'sample': True})
 
             reminder.sent_status = 'sent'
             reminder.updated_at = datetime.utcnow()
@@ -87,7 +91,13 @@ def send_email_reminder(reminder_id):
             return True
         except Exception as e:
             app.logger.error(f"Error sending email for reminder {reminder.id} to {user.email}: {e}")
-            reminder.sent_status = 'error'
-            reminder.updated_at = datetime.utcnow()
+            now = datetime.utcnow()
+            if is_transient_error(e):
+                # Temporary failure (relay down, 4xx reply): back off and try again later.
+                reminder.attempts = (reminder.attempts or 0) + 1
+                reminder.sent_status, reminder.next_attempt_at = retry_schedule(reminder.attempts, now)
+            else:
+                reminder.sent_status = 'error'
+            reminder.updated_at = now
             db.session.commit()
             return False
@@ -0,0 +1,99 @@
+from flask import current_app
+from .. import db
+from ..models import Notification
+from .reminder_renderer import get_renderer, reminder_subject
+import queue
+import threading
+
+DEFAULT_SUBSCRIBER_QUEUE_SIZE = 100
+DEFAULT_CATCH_UP_LIMIT = 50
+
+class NotificationBroker:
+    """
+    In-process fan-out of new notifications to each user's open SSE streams.
+
+    Every stream subscribes its own bounded queue; publish() never blocks, so
+    a slow browser only drops pushes (it catches up from the notifications
+    table on its next poll) and cannot hold up the dispatcher. It is safe to
+    use from several threads. Use get_broker() to share one per application.
+    """
+
+    def __init__(self, queue_size=DEFAULT_SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = {} # user_id -> set of queues
+
+    def subscribe(self, user_id):
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def publish(self, user_id, payload):
+        """Pushes `payload` to every stream of the user; returns how many streams got it."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        delivered = 0
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(payload)
+                delivered += 1
+            except queue.Full:
+                pass
+        return delivered
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+def get_broker(app=None):
+    """Returns the application's shared NotificationBroker, creating it on first use."""
+    app = app or current_app._get_current_object()
+    broker = app.extensions.get('notification_broker')
+    if broker is None:
+        broker = app.extensions['notification_broker'] = NotificationBroker(
+            app.config.get('NOTIFICATION_QUEUE_SIZE', DEFAULT_SUBSCRIBER_QUEUE_SIZE))
+    return broker
+
+def build_notification(reminder, user, item):
+    """Adds (no commit) the in-app notification for one reminder and returns it."""
+    links = get_renderer().links()
+    if reminder.item_type == 'event':
+        body = f"Início: {item.start_time.strftime('%Y-%m-%d %H:%M')} UTC"
+        url = links['calendar_url']
+    else:
+        body = f"Vencimento: {item.due_date.strftime('%Y-%m-%d')}" if item.due_date else None
+        url = links['tasks_url']
+    notification = Notification(user_id=user.id, reminder_id=reminder.id,
+                                title=reminder_subject(reminder.item_type, item), body=body, url=url)
+    db.session.add(notification)
+    return notification
+
+def notification_payloads(notifications):
+    """
+    (user_id, payload) pairs for notifications added in this transaction.
+    Call it after a flush (ids are assigned) and before the commit expires them.
+    """
+    return [(notification.user_id, notification.to_dict()) for notification in notifications]
+
+def publish_notifications(payloads):
+    """Pushes committed notification payloads to the users' open streams in this process."""
+    broker = get_broker()
+    for user_id, payload in payloads:
+        broker.publish(user_id, payload)
+
+def notifications_since(user_id, after_id=0, limit=None):
+    """A user's notifications with id > after_id, oldest first (the catch-up query)."""
+    limit = limit or current_app.config.get('NOTIFICATION_CATCH_UP_LIMIT', DEFAULT_CATCH_UP_LIMIT)
+    return Notification.query.filter(
+        Notification.user_id == user_id,
+        Notification.id > after_id
+    ).order_by(Notification.id).limit(limit).all()
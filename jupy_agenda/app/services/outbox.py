@@ -0,0 +1,192 @@
+from flask import current_app
+from flask_mail import sanitize_address, sanitize_addresses
+from .. import db
+from ..models import OutboxMessage, Reminder
+from .mail_delivery import PersistentMailConnection, is_transient_error
+from .rate_limit import TokenBucket
+from .reminder_policy import retry_schedule
+from .reminder_metrics import get_metrics, error_cause, write_snapshot
+from sqlalchemy import and_, or_, case
+from datetime import datetime, timedelta
+import time
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_LEASE_SECONDS = 300
+
+def spool_message(msg, reminder_ids):
+    """
+    Adds a rendered message to the outbox (no commit). The caller commits it
+    together with the reminders' move to 'queued', so both happen or neither does.
+    """
+    if msg.date is None:
+        msg.date = time.time()
+    outbox_message = OutboxMessage(
+        message_id=msg.msgId,
+        sender=sanitize_address(msg.sender),
+        recipients=','.join(sanitize_addresses(msg.send_to)),
+        payload=msg.as_bytes(),
+        reminder_ids=','.join(str(reminder_id) for reminder_id in reminder_ids),
+    )
+    db.session.add(outbox_message)
+    return outbox_message
+
+def _claimable_filter(now):
+    return or_(
+        OutboxMessage.status == 'pending',
+        and_(OutboxMessage.status == 'retry', OutboxMessage.next_attempt_at <= now),
+        and_(OutboxMessage.status == 'claimed', OutboxMessage.lease_until < now)
+    )
+
+def count_outbox(now=None):
+    """Number of outbox messages a drain started now would send."""
+    return OutboxMessage.query.filter(_claimable_filter(now or datetime.utcnow())).count()
+
+def claim_outbox_messages(worker_id, limit, lease_seconds=None):
+    """
+    Claims up to `limit` outbox messages for this worker, oldest first, the
+    same way claim_due_reminders() claims reminders (SKIP LOCKED on PostgreSQL,
+    a guarded UPDATE elsewhere).
+    """
+    now = datetime.utcnow()
+    if lease_seconds is None:
+        lease_seconds = current_app.config.get('OUTBOX_LEASE_SECONDS', DEFAULT_LEASE_SECONDS)
+    lease_until = now + timedelta(seconds=lease_seconds)
+    claim_values = {'status': 'claimed', 'claimed_by': worker_id, 'lease_until': lease_until}
+    claimable = _claimable_filter(now)
+    candidates = db.session.query(OutboxMessage.id).filter(claimable).order_by(OutboxMessage.id).limit(limit)
+
+    try:
+        if db.session.get_bind().dialect.name == 'postgresql':
+            message_ids = [row.id for row in candidates.with_for_update(skip_locked=True)]
+            if message_ids:
+                OutboxMessage.query.filter(OutboxMessage.id.in_(message_ids)).update(claim_values, synchronize_session=False)
+        else:
+            OutboxMessage.query.filter(
+                OutboxMessage.id.in_(candidates.subquery().select()),
+                claimable
+            ).update(claim_values, synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return OutboxMessage.query.filter(
+        OutboxMessage.status == 'claimed',
+        OutboxMessage.claimed_by == worker_id,
+        OutboxMessage.lease_until == lease_until
+    ).order_by(OutboxMessage.id).all()
+
+def _finish(messages, status, now, worker_id, extra=None):
+    """Moves outbox messages and the reminders they cover to a final status (no commit)."""
+    if not messages:
+        return
+    OutboxMessage.query.filter(
+        OutboxMessage.id.in_([m.id for m in messages]),
+        OutboxMessage.status == 'claimed',
+        OutboxMessage.claimed_by == worker_id
+    ).update(dict({'status': status, 'lease_until': None}, **(extra or {})), synchronize_session=False)
+    reminder_ids = [reminder_id for m in messages for reminder_id in m.reminder_id_list()]
+    Reminder.query.filter(
+        Reminder.id.in_(reminder_ids),
+        Reminder.sent_status == 'queued'
+    ).update({'sent_status': status, 'updated_at': now}, synchronize_session=False)
+
+def _schedule_retries(messages, now, worker_id):
+    """Backs failed messages off (reminders stay 'queued'); returns those that went dead."""
+    next_attempts = {}
+    dead = []
+    for message in messages:
+        status, next_attempt_at = retry_schedule(message.attempts + 1, now)
+        if status == 'dead':
+            dead.append(message)
+        else:
+            next_attempts[message.id] = next_attempt_at
+    if next_attempts:
+        OutboxMessage.query.filter(
+            OutboxMessage.id.in_(list(next_attempts)),
+            OutboxMessage.status == 'claimed',
+            OutboxMessage.claimed_by == worker_id
+        ).update({'status': 'retry', 'lease_until': None, 'attempts': OutboxMessage.attempts + 1,
+                  'next_attempt_at': case(next_attempts, value=OutboxMessage.id)}, synchronize_session=False)
+    _finish(dead, 'dead', now, worker_id, {'attempts': OutboxMessage.attempts + 1})
+    return dead
+
+def _sent_lags(messages, sent_at):
+    """Seconds between reminder_time and sent_at for each reminder the sent messages cover."""
+    reminder_ids = [reminder_id for m in messages for reminder_id in m.reminder_id_list()]
+    if not reminder_ids:
+        return []
+    reminder_times = db.session.query(Reminder.reminder_time).filter(Reminder.id.in_(reminder_ids))
+    return [(sent_at - reminder_time).total_seconds() for reminder_time, in reminder_times]
+
+def drain_outbox(batch_size=None, worker_id=None):
+    """
+    Stage two of outbox mode: sends every spooled message over a persistent
+    SMTP connection, in claimed chunks, honouring MAIL_MAX_SEND_RATE.
+
+    Each chunk's results are written in one short transaction that also moves
+    the covered reminders from 'queued' to their final status. If the process
+    dies after sending but before that commit, the lease expires and the
+    message is sent again with the same Message-ID, so mail is never lost and
+    a repeat can be recognised by the receiving side.
+    Sends, their latency, dispatch lag and failures feed the reminder metrics
+    like dispatch_due_reminders() does (channel 'email').
+    Returns a dict with 'sent', 'error', 'retry', 'dead', 'batches' and 'connections' counts.
+    """
+    from .reminder_dispatcher import default_worker_id
+
+    app = current_app._get_current_object()
+    metrics = get_metrics(app)
+    batch_size = batch_size or app.config.get('OUTBOX_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    worker_id = worker_id or default_worker_id()
+    rate_limiter = TokenBucket(app.config.get('MAIL_MAX_SEND_RATE', 0))
+    stats = {'sent': 0, 'error': 0, 'retry': 0, 'dead': 0, 'batches': 0, 'connections': 0}
+
+    with PersistentMailConnection() as connection:
+        while True:
+            chunk = claim_outbox_messages(worker_id, batch_size)
+            if not chunk:
+                break
+
+            sent, failed, retry = [], [], []
+            for message in chunk:
+                try:
+                    rate_limiter.acquire()
+                    started = time.perf_counter()
+                    connection.send_raw(message.sender, message.recipients.split(','), message.payload)
+                    metrics.record_latency('email', time.perf_counter() - started)
+                    sent.append(message)
+                except Exception as e:
+                    app.logger.error(f"Error sending outbox message {message.message_id}: {e}",
+                                     extra={'event': 'reminder_failed', 'channel': 'email', 'cause': error_cause(e),
+                                            'reminder_ids': message.reminder_id_list(), 'message_id': message.message_id})
+                    (retry if is_transient_error(e) else failed).append(message)
+                    metrics.record_error(error_cause(e), len(message.reminder_id_list()))
+
+            try:
+                now = datetime.utcnow()
+                lags = _sent_lags(sent, now)
+                _finish(sent, 'sent', now, worker_id, {'sent_at': now})
+                _finish(failed, 'error', now, worker_id)
+                dead = _schedule_retries(retry, now, worker_id)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            metrics.record_sent('email', len(lags), lags)
+
+            stats['sent'] += len(sent)
+            stats['error'] += len(failed)
+            stats['retry'] += len(retry) - len(dead)
+            stats['dead'] += len(dead)
+            stats['batches'] += 1
+            app.logger.info(f"Outbox batch {stats['batches']} done. Sent: {len(sent)}, Errors: {len(failed)}, Retries: {len(retry) - len(dead)}.")
+        stats['connections'] = connection.connections_opened
+
+    metrics_file = app.config.get('REMINDER_METRICS_FILE')
+    if metrics_file:
+        try:
+            write_snapshot(metrics, metrics_file)
+        except OSError as e:
+            app.logger.warning(f"Could not write reminder metrics to {metrics_file}: {e}")
+    return stats
@@ -0,0 +1,55 @@
+import threading
+import time
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting how many operations run per second.
+
+    `rate` tokens are added every second, up to `capacity` (defaults to one
+    second's worth), so short bursts are allowed but the long-run rate is capped.
+    A rate of 0 or None means unlimited.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate or 0
+        self.capacity = capacity if capacity is not None else max(1, self.rate)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Takes `tokens` if available right now; returns False instead of waiting."""
+        if not self.rate:
+            return True
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def reserve(self, tokens=1):
+        """
+        Takes `tokens` now and returns how many seconds the caller must wait
+        before using them. The balance may go negative, so concurrent callers
+        queue up fairly instead of polling. Async callers sleep on the result.
+        """
+        if not self.rate:
+            return 0
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` are available, then takes them."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self._sleep(wait)
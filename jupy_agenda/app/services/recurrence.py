@@ -0,0 +1,271 @@
+from flask import current_app
+from dateutil.rrule import rrulestr, DAILY, WEEKLY, MONTHLY, YEARLY
+from dateutil.relativedelta import relativedelta
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from itertools import islice, takewhile
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import re
+import threading
+
+DEFAULT_CACHE_SIZE = 2048 # Expanded (event, window) entries kept per process
+DEFAULT_MAX_OCCURRENCES = 1000 # Per event and window; guards against rules like a daily event viewed over decades
+ALLOWED_FREQUENCIES = {DAILY, WEEKLY, MONTHLY, YEARLY}
+MAX_RULE_COUNT = 1000 # COUNT of a finite rule
+MAX_RULE_YEARS = 50 # UNTIL, at most this many years after the first occurrence
+_PERIOD = {DAILY: 'days', WEEKLY: 'weeks', MONTHLY: 'months', YEARLY: 'years'}
+
+# recurrence_end of a series without COUNT/UNTIL: a far-future value instead of NULL so
+# "recurrence_end > window_start" stays a plain index range
+NO_END = datetime(9999, 12, 31)
+
+def normalize_rrule(value):
+    """
+    'rrule:freq=weekly;byday=mo ' -> 'FREQ=WEEKLY;BYDAY=MO'; blank -> None.
+    A UTC UNTIL ('...T235959Z') loses its Z, as event times are stored as naive UTC.
+    """
+    value = (value or '').strip().upper()
+    if value.startswith('RRULE:'):
+        value = value[len('RRULE:'):]
+    return re.sub(r'(UNTIL=\d{8}(?:T\d{6})?)Z', r'\1', value) or None
+
+def get_zone(name):
+    """The ZoneInfo for an IANA name; None for a blank or unknown one (the rule then runs in UTC)."""
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+def to_local(moment, zone):
+    """A naive UTC datetime as naive wall time in `zone`."""
+    return moment.replace(tzinfo=timezone.utc).astimezone(zone).replace(tzinfo=None)
+
+def to_utc(moment, zone):
+    """Naive wall time in `zone` as a naive UTC datetime."""
+    return moment.replace(tzinfo=zone).astimezone(timezone.utc).replace(tzinfo=None)
+
+def parse_rrule(value, dtstart):
+    """
+    The dateutil rrule for an Event.rrule value anchored at `dtstart`.
+    Raises ValueError for anything but a single RRULE with FREQ
+    DAILY/WEEKLY/MONTHLY/YEARLY (no DTSTART, RDATE or EXDATE lines;
+    cancelled occurrences are EventException rows).
+    """
+    value = normalize_rrule(value)
+    if not value or '\n' in value or ':' in value:
+        raise ValueError('Expected a single RRULE value, e.g. FREQ=WEEKLY;BYDAY=MO')
+    try:
+        rule = rrulestr(value, dtstart=dtstart)
+    except TypeError: # No FREQ at all
+        raise ValueError('The rule needs a FREQ')
+    if rule._freq not in ALLOWED_FREQUENCIES:
+        raise ValueError('FREQ must be DAILY, WEEKLY, MONTHLY or YEARLY')
+    if rule._interval < 1:
+        raise ValueError('INTERVAL must be at least 1')
+    if rule._count is not None and not 1 <= rule._count <= MAX_RULE_COUNT:
+        raise ValueError(f'COUNT must be between 1 and {MAX_RULE_COUNT}')
+    if rule._until is not None and rule._until > dtstart + relativedelta(years=MAX_RULE_YEARS):
+        raise ValueError(f'UNTIL must be at most {MAX_RULE_YEARS} years after the start')
+    return rule
+
+def _is_dense(value, rule, dtstart):
+    """
+    True if every period of the rule (day, week, month or year) has at least one
+    occurrence: no BY part that filters periods out, and no month day that
+    some months lack. Only such rules are iterated to find the series' end;
+    dateutil walks sparse rules (e.g. FREQ=DAILY;BYMONTH=2;BYMONTHDAY=30)
+    period by period up to year 9999 before it gives up.
+    """
+    parts = {part.partition('=')[0] for part in value.split(';')} - {'FREQ', 'INTERVAL', 'COUNT', 'UNTIL', 'WKST'}
+    if parts - {'BYDAY'}:
+        return False
+    if parts: # A plain BYDAY adds days to weeks, months and years but filters days
+        return rule._freq != DAILY and not re.search(r'BYDAY=[^;]*\d', value)
+    if rule._freq == MONTHLY:
+        return dtstart.day <= 28
+    if rule._freq == YEARLY:
+        return (dtstart.month, dtstart.day) != (2, 29)
+    return True
+
+def _last_start(value, rule, dtstart):
+    """
+    The start of the last occurrence of a finite rule (or an upper bound of
+    it, which is enough for recurrence_end), without listing the series.
+    UNTIL bounds it directly; for COUNT a dense rule is done within
+    COUNT + 1 periods of INTERVAL each, a sparse one within MAX_RULE_YEARS.
+    Only dense rules are walked up to the bound, COUNT items at most.
+    """
+    dense = _is_dense(value, rule, dtstart)
+    bound = dtstart + relativedelta(years=MAX_RULE_YEARS)
+    if rule._until is not None:
+        bound = rule._until
+    elif dense:
+        bound = min(bound, dtstart + relativedelta(**{_PERIOD[rule._freq]: (rule._count + 1) * rule._interval}))
+    if not dense:
+        return bound
+    return rule.before(bound, inc=True) or dtstart
+
+def local_rule(event):
+    """
+    (rule, zone) for a recurring event. With a zone the rule is anchored at
+    the local start and its UNTIL (stored as UTC) is made local too, so the
+    wall-clock time is kept across DST changes; without one it runs in UTC.
+    """
+    zone = get_zone(getattr(event, 'timezone', None))
+    if zone is None:
+        return parse_rrule(event.rrule, event.start_time), None
+    rule = parse_rrule(event.rrule, to_local(event.start_time, zone))
+    if rule._until is not None and 'T' in event.rrule.partition('UNTIL=')[2].partition(';')[0]:
+        rule = rule.replace(until=to_local(rule._until, zone))
+    return rule, zone
+
+def occurs_at(event, start):
+    """True if the naive UTC `start` is an occurrence of the recurring event's rule."""
+    rule, zone = local_rule(event)
+    return (to_local(start, zone) if zone else start) in rule
+
+def refresh_recurrence(event):
+    """
+    Call after changing an event's times, rule or exceptions: normalizes
+    the rule, recomputes recurrence_end and bumps rule_version so cached
+    expansions of the old rule are no longer used. Raises ValueError for an invalid rule.
+    """
+    event.rrule = normalize_rrule(event.rrule)
+    if event.rrule is None:
+        event.recurrence_end = None
+    else:
+        rule, zone = local_rule(event)
+        if rule._count is None and rule._until is None:
+            event.recurrence_end = NO_END
+        else:
+            last = _last_start(event.rrule, rule, rule._dtstart)
+            event.recurrence_end = (to_utc(last, zone) if zone else last) + (event.end_time - event.start_time)
+    if event.id is not None:
+        event.rule_version = (event.rule_version or 0) + 1
+
+class Occurrence:
+    """One occurrence of a recurring event; quacks like an Event (id, title, description, start/end) in templates."""
+
+    __slots__ = ('event', 'start_time', 'end_time', 'recurrence_id', 'title', 'description')
+
+    def __init__(self, event, start_time, end_time, recurrence_id, title=None, description=None):
+        self.event = event
+        self.start_time = start_time
+        self.end_time = end_time
+        self.recurrence_id = recurrence_id # The start this occurrence has in the rule, even if it was moved
+        self.title = title or event.title
+        self.description = description if description is not None else event.description
+
+    @property
+    def id(self):
+        return self.event.id
+
+    def __repr__(self):
+        return f'<Occurrence {self.event.id} @ {self.start_time}>'
+
+class OccurrenceCache:
+    """
+    Thread-safe LRU of expanded windows, keyed by (event id, rule version,
+    window start, window end). Values are plain tuples, never ORM objects,
+    so they can be shared across requests and sessions.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+def get_occurrence_cache(app=None):
+    """Returns the application's shared OccurrenceCache, creating it on first use."""
+    app = app or current_app._get_current_object()
+    cache = app.extensions.get('occurrence_cache')
+    if cache is None:
+        cache = app.extensions['occurrence_cache'] = OccurrenceCache(
+            app.config.get('EVENT_OCCURRENCE_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+    return cache
+
+def _utc_starts(rule, zone, after):
+    """The rule's starts after the naive UTC `after`, as naive UTC, in order."""
+    if zone is None:
+        yield from rule.xafter(after, inc=False)
+        return
+    # A day of slack covers any UTC offset; the UTC check below drops the extra starts
+    for start in rule.xafter(to_local(after, zone) - timedelta(days=1), inc=False):
+        start = to_utc(start, zone)
+        if start > after:
+            yield start
+
+def _expand(event, window_start, window_end, limit):
+    """(start, end, recurrence_id, title, description) of the occurrences overlapping [window_start, window_end)."""
+    duration = event.end_time - event.start_time
+    exceptions = {exception.original_start: exception for exception in event.exceptions}
+    rule, zone = local_rule(event)
+
+    spans = []
+    starts = takewhile(lambda start: start < window_end, _utc_starts(rule, zone, window_start - duration))
+    for start in islice(starts, limit):
+        if start not in exceptions:
+            spans.append((start, start + duration, start, None, None))
+    for original_start, exception in exceptions.items():
+        if exception.cancelled:
+            continue
+        start = exception.start_time or original_start
+        end = exception.end_time or start + duration
+        if start < window_end and end > window_start and (to_local(original_start, zone) if zone else original_start) in rule:
+            spans.append((start, end, original_start, exception.title, exception.description))
+    spans.sort()
+    return tuple(spans)
+
+def expand_event(event, window_start, window_end, cache=None):
+    """
+    Occurrences of the recurring `event` that overlap [window_start,
+    window_end), with its exceptions applied, in start order. Only the
+    window is generated; results are cached per (event, rule_version, window).
+    Pass cache=False for one-off windows (e.g. a reminder pass) that would only evict useful entries.
+    """
+    if cache is None:
+        cache = get_occurrence_cache()
+    key = (event.id, event.rule_version, window_start, window_end)
+    spans = cache.get(key) if cache is not False and event.id is not None else None
+    if spans is None:
+        spans = _expand(event, window_start, window_end,
+                        current_app.config.get('EVENT_MAX_OCCURRENCES', DEFAULT_MAX_OCCURRENCES))
+        if cache is not False and event.id is not None:
+            cache.put(key, spans)
+    return [Occurrence(event, *span) for span in spans]
+
+def occurrence_at(event, start):
+    """
+    The occurrence of the recurring `event` that starts at `start` (a moved
+    one keeps its new title and times), e.g. for a reminder's message.
+    """
+    duration = event.end_time - event.start_time
+    for exception in event.exceptions:
+        if not exception.cancelled and (exception.start_time or exception.original_start) == start:
+            return Occurrence(event, start, exception.end_time or start + duration, exception.original_start,
+                              exception.title, exception.description)
+    return Occurrence(event, start, start + duration, start)
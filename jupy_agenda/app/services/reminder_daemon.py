@@ -0,0 +1,185 @@
+from flask import current_app
+from .. import db
+from ..models import Reminder
+from .reminder_dispatcher import dispatch_due_reminders
+from .reminder_rules import rules_enabled, materialize_due_reminders
+from .rate_limit import TokenBucket
+from datetime import datetime, timedelta
+import heapq
+import threading
+
+DEFAULT_POLL_INTERVAL = 5.0 # Seconds between "changed since" refreshes
+DEFAULT_HORIZON_HOURS = 24 # How far ahead the heap is filled
+# Rows committed slightly out of updated_at order are still picked up by re-reading this overlap.
+REFRESH_OVERLAP = timedelta(seconds=2)
+
+class ReminderScheduler:
+    """
+    In-memory min-heap of upcoming pending reminder times.
+
+    The heap only decides when the daemon wakes up; the dispatcher stays the
+    source of truth, so stale entries (deleted or already sent reminders)
+    simply produce an empty dispatch pass.
+    """
+
+    def __init__(self, horizon=None):
+        self.horizon = horizon or timedelta(hours=DEFAULT_HORIZON_HOURS)
+        self._heap = [] # (reminder_time, reminder_id)
+        self._scheduled = {} # reminder_id -> reminder_time currently in the heap
+        self._last_refresh = None
+        self._horizon_end = None
+
+    def __len__(self):
+        return len(self._scheduled)
+
+    def _schedule(self, reminder_id, reminder_time):
+        if self._scheduled.get(reminder_id) == reminder_time:
+            return
+        # The old entry for a rescheduled reminder stays in the heap and is skipped lazily.
+        self._scheduled[reminder_id] = reminder_time
+        heapq.heappush(self._heap, (reminder_time, reminder_id))
+
+    def _schedule_rows(self, rows):
+        count = 0
+        for reminder_id, reminder_time in rows:
+            self._schedule(reminder_id, reminder_time)
+            count += 1
+        return count
+
+    def load(self, now):
+        """
+        Fills the heap with every pending reminder due before now + horizon,
+        and every retry whose backoff ends by then. Claimed reminders are scheduled at their lease expiry, when the
+        dispatcher may have to take them over from a crashed worker.
+        """
+        self._horizon_end = now + self.horizon
+        self._last_refresh = now
+        rows = db.session.query(Reminder.id, Reminder.reminder_time).filter(
+            Reminder.sent_status == 'pending',
+            Reminder.reminder_time <= self._horizon_end
+        )
+        retries = db.session.query(Reminder.id, Reminder.next_attempt_at).filter(
+            Reminder.sent_status == 'retry',
+            Reminder.next_attempt_at <= self._horizon_end
+        )
+        claimed = db.session.query(Reminder.id, Reminder.lease_until).filter(
+            Reminder.sent_status == 'claimed'
+        )
+        return self._schedule_rows(rows) + self._schedule_rows(retries) + self._schedule_rows(claimed)
+
+    def refresh(self, now):
+        """
+        Picks up reminders written since the last refresh (indexed on updated_at)
+        and slides the horizon forward with a range query on reminder_time.
+        Returns the number of rows (re)scheduled.
+        """
+        if self._last_refresh is None:
+            return self.load(now)
+
+        changed = db.session.query(Reminder.id, Reminder.reminder_time).filter(
+            Reminder.updated_at > self._last_refresh - REFRESH_OVERLAP,
+            Reminder.sent_status == 'pending',
+            Reminder.reminder_time <= now + self.horizon
+        )
+        changed_retries = db.session.query(Reminder.id, Reminder.next_attempt_at).filter(
+            Reminder.updated_at > self._last_refresh - REFRESH_OVERLAP,
+            Reminder.sent_status == 'retry',
+            Reminder.next_attempt_at <= now + self.horizon
+        )
+        changed_claims = db.session.query(Reminder.id, Reminder.lease_until).filter(
+            Reminder.updated_at > self._last_refresh - REFRESH_OVERLAP,
+            Reminder.sent_status == 'claimed'
+        )
+        count = (self._schedule_rows(changed) + self._schedule_rows(changed_retries)
+                 + self._schedule_rows(changed_claims))
+
+        new_horizon_end = now + self.horizon
+        if new_horizon_end > self._horizon_end:
+            entering = db.session.query(Reminder.id, Reminder.reminder_time).filter(
+                Reminder.sent_status == 'pending',
+                Reminder.reminder_time > self._horizon_end,
+                Reminder.reminder_time <= new_horizon_end
+            )
+            count += self._schedule_rows(entering)
+            self._horizon_end = new_horizon_end
+
+        self._last_refresh = now
+        return count
+
+    def reset(self):
+        """Forgets everything; the next refresh() reloads the heap from the database."""
+        self._heap = []
+        self._scheduled = {}
+        self._last_refresh = None
+        self._horizon_end = None
+
+    def _discard_stale_top(self):
+        while self._heap:
+            reminder_time, reminder_id = self._heap[0]
+            if self._scheduled.get(reminder_id) == reminder_time:
+                return
+            heapq.heappop(self._heap)
+
+    def next_due_time(self):
+        """Earliest scheduled reminder_time, or None if nothing is scheduled."""
+        self._discard_stale_top()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """Removes and returns the ids of every scheduled reminder due at `now`."""
+        due = []
+        while True:
+            next_time = self.next_due_time()
+            if next_time is None or next_time > now:
+                return due
+            _, reminder_id = heapq.heappop(self._heap)
+            del self._scheduled[reminder_id]
+            due.append(reminder_id)
+
+    def seconds_until_next(self, now, max_wait):
+        """How long the daemon may sleep: until the next reminder, capped at max_wait."""
+        next_time = self.next_due_time()
+        if next_time is None:
+            return max_wait
+        return max(0.0, min(max_wait, (next_time - now).total_seconds()))
+
+def run_reminder_daemon(poll_interval=None, stop_event=None, batch_size=None):
+    """
+    Runs until stop_event is set: sleeps until the next reminder is due (or the
+    next refresh), then dispatches every due reminder in one batched pass.
+    In rules mode (REMINDER_RULES_ENABLED) due reminders are materialized on
+    every poll, so the refresh sees them as soon as their fire time comes.
+    """
+    app = current_app._get_current_object()
+    poll_interval = poll_interval or app.config.get('REMINDER_DAEMON_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+    horizon = timedelta(hours=app.config.get('REMINDER_DAEMON_HORIZON_HOURS', DEFAULT_HORIZON_HOURS))
+    stop_event = stop_event or threading.Event()
+    scheduler = ReminderScheduler(horizon=horizon)
+    rate_limiter = TokenBucket(app.config.get('MAIL_MAX_SEND_RATE', 0)) # Shared by every pass
+    use_rules = rules_enabled(app)
+
+    loaded = scheduler.load(datetime.utcnow())
+    db.session.remove() # Don't keep a read transaction open while sleeping
+    app.logger.info(f"Reminder daemon started with {loaded} upcoming reminders.")
+
+    while not stop_event.is_set():
+        try:
+            now = datetime.utcnow()
+            if use_rules:
+                materialize_due_reminders(now)
+            scheduler.refresh(now)
+            due = scheduler.pop_due(now)
+            if due:
+                stats = dispatch_due_reminders(batch_size=batch_size, now=now, rate_limiter=rate_limiter,
+                                               materialize=False) # Already done above
+                app.logger.info(f"Reminder daemon woke for {len(due)} reminders. Sent: {stats['sent']}, Errors: {stats['error']}, Retries: {stats['retry']}, Deferred: {stats['deferred']}.")
+        except Exception as e:
+            db.session.rollback()
+            scheduler.reset() # Reminders popped in a failed pass must not be forgotten
+            app.logger.error(f"Reminder daemon iteration failed: {e}", exc_info=True)
+        finally:
+            db.session.remove()
+
+        stop_event.wait(scheduler.seconds_until_next(datetime.utcnow(), poll_interval))
+
+    app.logger.info("Reminder daemon stopped.")
@@ -0,0 +1,824 @@
+from flask import current_app
+from .. import db
+from ..models import Reminder, User, Event, Task
+from .notification_service import build_reminder_message, build_digest_message
+from .reminder_renderer import get_renderer
+from .mail_delivery import PersistentMailConnection, is_transient_error
+from .async_mail_delivery import AsyncSMTPDelivery
+from .outbox import spool_message
+from .notifications import build_notification, notification_payloads, publish_notifications
+from .webhook_delivery import WebhookConnectionPool, webhook_payload
+from .rate_limit import TokenBucket
+from .reminder_policy import deferred_reminder_times, retry_schedule
+from .reminder_rules import rules_enabled, materialize_due_reminders
+from .reminder_maintenance import refresh_occurrence_reminders_if_due
+from .recurrence import occurrence_at
+from .reminder_metrics import get_metrics, error_cause, write_snapshot
+from sqlalchemy import and_, or_, case, inspect
+from sqlalchemy.orm import joinedload
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import os
+import socket
+import threading
+import time
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_LEASE_SECONDS = 300
+
+def default_worker_id():
+    """Identifies this dispatcher process in Reminder.claimed_by."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _claimable_filter(due_before, claimed_at):
+    """
+    Due pending reminders, retries whose backoff has elapsed (served by the
+    (sent_status, next_attempt_at) index) and claimed ones whose worker let
+    the lease expire.
+    """
+    return or_(
+        and_(Reminder.sent_status == 'pending', Reminder.reminder_time <= due_before),
+        and_(Reminder.sent_status == 'retry', Reminder.next_attempt_at <= due_before),
+        and_(Reminder.sent_status == 'claimed', Reminder.lease_until < claimed_at)
+    )
+
+def count_claimable_reminders(now=None):
+    """Number of reminders a dispatch pass started now would pick up."""
+    now = now or datetime.utcnow()
+    return Reminder.query.filter(_claimable_filter(now, now)).count()
+
+def claim_due_reminders(worker_id, limit, now=None, lease_seconds=None):
+    """
+    Atomically moves up to `limit` claimable reminders to 'claimed' for this
+    worker and returns them, oldest first.
+
+    On PostgreSQL the candidate rows are locked with SELECT ... FOR UPDATE
+    SKIP LOCKED, so concurrent workers pick disjoint sets without waiting.
+    Elsewhere (SQLite) a single guarded UPDATE re-checks the claimable
+    condition; SQLite serializes writers, so no row can be claimed twice.
+
+    `now` is the due cutoff; the lease always runs from the actual claim time.
+    The claimed rows come back joined to their user and event or task.
+    """
+    claimed_at = datetime.utcnow()
+    now = now or claimed_at
+    if lease_seconds is None:
+        lease_seconds = current_app.config.get('REMINDER_LEASE_SECONDS', DEFAULT_LEASE_SECONDS)
+    lease_until = claimed_at + timedelta(seconds=lease_seconds)
+    claim_values = {'sent_status': 'claimed', 'claimed_by': worker_id, 'lease_until': lease_until}
+    claimable = _claimable_filter(now, claimed_at)
+
+    candidates = db.session.query(Reminder.id).filter(claimable).order_by(
+        Reminder.reminder_time, Reminder.id
+    ).limit(limit)
+
+    try:
+        if db.session.get_bind().dialect.name == 'postgresql':
+            reminder_ids = [row.id for row in candidates.with_for_update(skip_locked=True)]
+            if reminder_ids:
+                Reminder.query.filter(Reminder.id.in_(reminder_ids)).update(claim_values, synchronize_session=False)
+        else:
+            Reminder.query.filter(
+                Reminder.id.in_(candidates.subquery().select()),
+                claimable
+            ).update(claim_values, synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return _with_items(Reminder.query.filter(
+        Reminder.sent_status == 'claimed',
+        Reminder.claimed_by == worker_id,
+        Reminder.lease_until == lease_until
+    )).order_by(Reminder.reminder_time, Reminder.id).all()
+
+def _with_items(query):
+    """Fetches each reminder's user and event or task in the same query (LEFT JOINs on the FK indexes)."""
+    return query.options(joinedload(Reminder.user), joinedload(Reminder.event), joinedload(Reminder.task))
+
+def _preload_chunk(reminders):
+    """
+    Collects every user, event and task referenced by a chunk of reminders.
+    Rows fetched through _with_items() already carry them; anything not loaded
+    yet (including legacy rows without event_id/task_id) is fetched with one
+    IN (...) query per model instead of one query per reminder.
+    Returns (users_by_id, items_by_key) where items are keyed by (item_type, item_id).
+    """
+    users, items = {}, {}
+    user_ids, event_ids, task_ids = set(), set(), set()
+    for r in reminders:
+        unloaded = inspect(r).unloaded
+        if 'user' in unloaded:
+            user_ids.add(r.user_id)
+        elif r.user is not None:
+            users[r.user_id] = r.user
+        linked = r.event_id if r.item_type == 'event' else r.task_id
+        relation = 'event' if r.item_type == 'event' else 'task'
+        if linked is not None and relation not in unloaded:
+            item = getattr(r, relation)
+            if item is not None:
+                items[(r.item_type, r.item_id)] = item
+        elif r.item_type == 'event':
+            event_ids.add(r.item_id)
+        elif r.item_type == 'task':
+            task_ids.add(r.item_id)
+
+    if user_ids:
+        users.update((u.id, u) for u in User.query.filter(User.id.in_(user_ids)))
+    if event_ids:
+        items.update((('event', e.id), e) for e in Event.query.filter(Event.id.in_(event_ids)))
+    if task_ids:
+        items.update((('task', t.id), t) for t in Task.query.filter(Task.id.in_(task_ids)))
+    return users, items
+
+def _mark_reminders(reminder_ids, status, now, worker_id):
+    """
+    Sets sent_status for many reminders with a single UPDATE (no commit).
+    Only rows this worker still holds are touched, so a worker whose lease
+    expired cannot overwrite the outcome recorded by the worker that took over.
+    """
+    if not reminder_ids:
+        return
+    Reminder.query.filter(
+        Reminder.id.in_(reminder_ids),
+        Reminder.sent_status == 'claimed',
+        Reminder.claimed_by == worker_id
+    ).update(
+        {'sent_status': status, 'lease_until': None, 'updated_at': now},
+        synchronize_session=False
+    )
+
+class _ChunkOutcome:
+    """
+    What happened to each reminder of a chunk: sent, spooled to the outbox
+    (queued), failed for good (error), failed transiently (retry) or held back
+    by the rate limit (deferred, one list of reminder ids per message).
+    `notifications` holds the in-app notifications to publish once committed;
+    `causes` counts failed reminders by error_cause() for the metrics.
+    """
+
+    def __init__(self, sent=None, error=None, retry=None, deferred=None, queued=None):
+        self.sent = sent or []
+        self.error = error or []
+        self.retry = retry or []
+        self.deferred = deferred or []
+        self.queued = queued or []
+        self.notifications = []
+        self.causes = {}
+
+    def merge(self, other):
+        self.sent.extend(other.sent)
+        self.queued.extend(other.queued)
+        self.error.extend(other.error)
+        self.retry.extend(other.retry)
+        self.deferred.extend(other.deferred)
+        self.notifications.extend(other.notifications)
+        for cause, count in other.causes.items():
+            self.causes[cause] = self.causes.get(cause, 0) + count
+        return self
+
+    def rejected(self, reminder_ids, cause):
+        """Files reminder ids that could not be sent at all (bad data, render errors) under error."""
+        self.error.extend(reminder_ids)
+        self.causes[cause] = self.causes.get(cause, 0) + len(reminder_ids)
+
+    def failed(self, reminder_ids, error):
+        """Files reminder ids whose send raised `error` under retry or error."""
+        (self.retry if is_transient_error(error) else self.error).extend(reminder_ids)
+        cause = error_cause(error)
+        self.causes[cause] = self.causes.get(cause, 0) + len(reminder_ids)
+
+def _schedule_retries(reminders, now, worker_id):
+    """
+    Records a failed attempt for each reminder (no commit): back to 'retry'
+    with a backed-off next_attempt_at, or 'dead' once REMINDER_MAX_ATTEMPTS is reached.
+    """
+    next_attempts = {}
+    dead_ids = []
+    for reminder in reminders:
+        status, next_attempt_at = retry_schedule(reminder.attempts + 1, now)
+        if status == 'dead':
+            dead_ids.append(reminder.id)
+        else:
+            next_attempts[reminder.id] = next_attempt_at
+
+    owned = and_(Reminder.sent_status == 'claimed', Reminder.claimed_by == worker_id)
+    values = {'attempts': Reminder.attempts + 1, 'lease_until': None, 'updated_at': now}
+    if next_attempts:
+        Reminder.query.filter(Reminder.id.in_(list(next_attempts)), owned).update(
+            dict(values, sent_status='retry', next_attempt_at=case(next_attempts, value=Reminder.id)),
+            synchronize_session=False
+        )
+    if dead_ids:
+        Reminder.query.filter(Reminder.id.in_(dead_ids), owned).update(
+            dict(values, sent_status='dead', next_attempt_at=None),
+            synchronize_session=False
+        )
+    return len(dead_ids)
+
+def _defer_reminders(groups, reminder_times, worker_id):
+    """
+    Hands reminders that exceeded the send rate back to the pending pool with
+    a new reminder_time (one per group/message), in a single UPDATE (no commit).
+    """
+    new_times = {}
+    for reminder_ids, reminder_time in zip(groups, reminder_times):
+        new_times.update((reminder_id, reminder_time) for reminder_id in reminder_ids)
+    if not new_times:
+        return
+    Reminder.query.filter(
+        Reminder.id.in_(list(new_times)),
+        Reminder.sent_status == 'claimed',
+        Reminder.claimed_by == worker_id
+    ).update(
+        {'sent_status': 'pending', 'claimed_by': None, 'lease_until': None,
+         'reminder_time': case(new_times, value=Reminder.id), 'updated_at': datetime.utcnow()},
+        synchronize_session=False
+    )
+
+def _log_fields(event, channel, reminder_ids, sample=False, **fields):
+    """
+    Structured fields for a per-reminder log record (see reminder_logging).
+    sample=True marks routine success lines, which structured logging samples.
+    """
+    return dict(fields, event=event, channel=channel, reminder_ids=list(reminder_ids), sample=sample)
+
+def _send_allowed(rate_limiter, defer_overflow):
+    """
+    Takes a send slot from the rate limiter. Waits for one unless
+    defer_overflow is set, in which case False means "defer this message".
+    """
+    if rate_limiter is None:
+        return True
+    if defer_overflow:
+        return rate_limiter.try_acquire()
+    rate_limiter.acquire()
+    return True
+
+def _check_reminder(reminder, users, items, require_email=True):
+    """
+    Validates a reminder against the preloaded users and items.
+    Returns (user, item), or None (after logging why) when it cannot be sent.
+    For a recurring event's reminder the item is the occurrence it is for.
+    """
+    app = current_app._get_current_object()
+    user = users.get(reminder.user_id)
+    item = items.get((reminder.item_type, reminder.item_id))
+
+    if reminder.item_type not in ('event', 'task'):
+        app.logger.error(f"Unknown item_type '{reminder.item_type}' for reminder {reminder.id}.")
+        return None
+    if not item:
+        app.logger.warning(f"Item {reminder.item_type} {reminder.item_id} for reminder {reminder.id} not found. Marking as error.")
+        return None
+    if not user:
+        app.logger.warning(f"User {reminder.user_id} for reminder {reminder.id} not found. Marking as error.")
+        return None
+    if require_email and not user.email:
+        app.logger.error(f"User {user.id} has no email address for reminder {reminder.id}.")
+        return None
+    if reminder.item_type == 'event' and reminder.occurrence_start is not None:
+        item = occurrence_at(item, reminder.occurrence_start) # Messages show that occurrence's time and title
+    return user, item
+
+def _digest_groups(entries, digest_window):
+    """
+    Groups (reminder, user, item) entries per user. A group collects the
+    user's reminders falling due within digest_window of its first one.
+    """
+    by_user = {}
+    for entry in sorted(entries, key=lambda e: (e[0].reminder_time, e[0].id)):
+        by_user.setdefault(entry[0].user_id, []).append(entry)
+
+    groups = []
+    for user_entries in by_user.values():
+        group = [user_entries[0]]
+        for entry in user_entries[1:]:
+            if entry[0].reminder_time - group[0][0].reminder_time <= digest_window:
+                group.append(entry)
+            else:
+                groups.append(group)
+                group = [entry]
+        groups.append(group)
+    return groups
+
+def _build_messages(reminders, users, items, digest_window=None):
+    """
+    Builds the emails for a chunk. Without a digest window every reminder gets
+    its own email; with one, a user's reminders due within the window share
+    a single digest email.
+    Returns (prepared, outcome) where prepared is a list of (reminder_ids, message)
+    and outcome a _ChunkOutcome holding the reminders that could not be built.
+    """
+    app = current_app._get_current_object()
+    entries = []
+    outcome = _ChunkOutcome()
+    for reminder in reminders:
+        checked = _check_reminder(reminder, users, items)
+        if checked is None:
+            outcome.rejected([reminder.id], 'invalid')
+        else:
+            entries.append((reminder,) + checked)
+
+    if digest_window:
+        groups = _digest_groups(entries, digest_window)
+    else:
+        groups = [[entry] for entry in entries]
+
+    prepared = []
+    for group in groups:
+        reminder_ids = [reminder.id for reminder, _, _ in group]
+        try:
+            if len(group) == 1:
+                msg = build_reminder_message(*group[0])
+            else:
+                msg = build_digest_message(group[0][1], [(reminder, item) for reminder, _, item in group])
+            prepared.append((reminder_ids, msg))
+        except Exception as e:
+            app.logger.error(f"Error rendering email for reminders {reminder_ids}: {e}")
+            outcome.rejected(reminder_ids, 'render')
+    return prepared, outcome
+
+def _deliver_chunk(reminders, users, items, connection, rate_limiter=None, digest_window=None, defer_overflow=False):
+    """
+    Builds and sends the emails for a chunk of reminders over the given
+    PersistentMailConnection, taking a slot from the optional TokenBucket before each send.
+    Returns a _ChunkOutcome; statuses are not written here.
+    """
+    app = current_app._get_current_object()
+    metrics = get_metrics(app)
+    prepared, outcome = _build_messages(reminders, users, items, digest_window)
+
+    for reminder_ids, msg in prepared:
+        if not _send_allowed(rate_limiter, defer_overflow):
+            outcome.deferred.append(reminder_ids)
+            continue
+        try:
+            started = time.perf_counter()
+            connection.send(msg)
+            metrics.record_latency('email', time.perf_counter() - started)
+            app.logger.info(f"Sent reminders {reminder_ids} to {msg.recipients[0]}",
+                            extra=_log_fields('reminder_sent', 'email', reminder_ids, sample=True))
+            outcome.sent.extend(reminder_ids)
+        except Exception as e:
+            app.logger.error(f"Error sending email for reminders {reminder_ids} to {msg.recipients[0]}: {e}",
+                             extra=_log_fields('reminder_failed', 'email', reminder_ids, cause=error_cause(e)))
+            outcome.failed(reminder_ids, e)
+
+    return outcome
+
+class _SequentialDelivery:
+    """Delivers each chunk in the calling thread over one persistent SMTP connection."""
+
+    def __init__(self, rate_limiter, digest_window=None, defer_overflow=False):
+        self.rate_limiter = rate_limiter
+        self.digest_window = digest_window
+        self.defer_overflow = defer_overflow
+        self.connection = PersistentMailConnection()
+
+    @property
+    def connections_opened(self):
+        return self.connection.connections_opened
+
+    def deliver(self, chunk):
+        users, items = _preload_chunk(chunk)
+        return _deliver_chunk(chunk, users, items, self.connection, self.rate_limiter, self.digest_window, self.defer_overflow)
+
+    def close(self):
+        self.connection.close()
+
+class _ThreadPoolDelivery:
+    """
+    Renders and sends a chunk from a bounded pool of threads.
+
+    Every task pushes its own app context, so it gets its own scoped DB
+    session, and reuses a per-thread SMTP connection. Workers only read; the
+    calling thread remains the single writer of reminder statuses.
+    """
+
+    def __init__(self, app, concurrency, rate_limiter, digest_window=None, defer_overflow=False):
+        self.app = app
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter
+        self.digest_window = digest_window
+        self.defer_overflow = defer_overflow
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='reminder-worker')
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    @property
+    def connections_opened(self):
+        return sum(connection.connections_opened for connection in self._connections)
+
+    def _thread_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = PersistentMailConnection()
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def _deliver_slice(self, reminder_ids):
+        with self.app.app_context():
+            try:
+                reminders = _with_items(Reminder.query.filter(Reminder.id.in_(reminder_ids))).order_by(
+                    Reminder.reminder_time, Reminder.id
+                ).all()
+                users, items = _preload_chunk(reminders)
+                return _deliver_chunk(reminders, users, items, self._thread_connection(),
+                                      self.rate_limiter, self.digest_window, self.defer_overflow)
+            finally:
+                db.session.remove()
+
+    def _slices(self, chunk):
+        """
+        Splits a chunk into at most `concurrency` slices of reminder ids.
+        A user's reminders always land in the same slice, so a digest is never split.
+        """
+        by_user = {}
+        for reminder in chunk:
+            by_user.setdefault(reminder.user_id, []).append(reminder.id)
+        slices = [[] for _ in range(min(self.concurrency, len(by_user)))]
+        for user_ids in sorted(by_user.values(), key=len, reverse=True):
+            min(slices, key=len).extend(user_ids)
+        return slices
+
+    def deliver(self, chunk):
+        slices = self._slices(chunk)
+        futures = [self.executor.submit(self._deliver_slice, reminder_ids) for reminder_ids in slices]
+
+        outcome = _ChunkOutcome()
+        for future, reminder_ids in zip(futures, slices):
+            try:
+                outcome.merge(future.result())
+            except Exception as e:
+                # The whole slice failed before any email went out (e.g. the DB read failed), so it is retried.
+                current_app.logger.error(f"Reminder worker failed: {e}", exc_info=True)
+                outcome.retry.extend(reminder_ids)
+        return outcome
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self.app.app_context():
+            for connection in self._connections:
+                connection.close()
+
+class _AsyncDelivery:
+    """
+    Renders a chunk in the calling thread, then hands the finished messages
+    to the asyncio SMTP engine and reads back one result per message.
+    """
+
+    def __init__(self, app, rate_limiter, digest_window=None, defer_overflow=False):
+        # When deferring, slots are taken up front so the engine never waits on the bucket.
+        self.engine = AsyncSMTPDelivery(app, rate_limiter=None if defer_overflow else rate_limiter)
+        self.rate_limiter = rate_limiter if defer_overflow else None
+        self.digest_window = digest_window
+
+    @property
+    def connections_opened(self):
+        return self.engine.connections_opened
+
+    def deliver(self, chunk):
+        app = current_app._get_current_object()
+        users, items = _preload_chunk(chunk)
+        prepared, outcome = _build_messages(chunk, users, items, self.digest_window)
+        keyed_messages = []
+        for reminder_ids, msg in prepared:
+            if _send_allowed(self.rate_limiter, True):
+                keyed_messages.append((tuple(reminder_ids), msg))
+            else:
+                outcome.deferred.append(reminder_ids)
+
+        for reminder_ids, error in self.engine.deliver(keyed_messages).items():
+            if error is None:
+                outcome.sent.extend(reminder_ids)
+            else:
+                app.logger.error(f"Error sending email for reminders {list(reminder_ids)}: {error}",
+                                 extra=_log_fields('reminder_failed', 'email', list(reminder_ids), cause=error_cause(error)))
+                outcome.failed(reminder_ids, error)
+        return outcome
+
+    def close(self):
+        self.engine.close()
+
+class _OutboxDelivery:
+    """
+    Stage one of outbox mode: renders a chunk and spools every message to the
+    outbox table. Nothing is sent here; flask drain-outbox does that.
+    The spooled rows are committed with the chunk's status UPDATEs.
+    """
+    connections_opened = 0
+
+    def __init__(self, digest_window=None):
+        self.digest_window = digest_window
+
+    def deliver(self, chunk):
+        users, items = _preload_chunk(chunk)
+        prepared, outcome = _build_messages(chunk, users, items, self.digest_window)
+        for reminder_ids, msg in prepared:
+            spool_message(msg, reminder_ids)
+            outcome.queued.extend(reminder_ids)
+        return outcome
+
+    def close(self):
+        pass
+
+class _InAppDelivery:
+    """
+    Delivers 'inapp' reminders: one Notification row per reminder, committed
+    with the chunk's status UPDATEs and then pushed to the user's open
+    /notifications/stream connections. No SMTP and no send-rate limit.
+    """
+    connections_opened = 0
+
+    def deliver(self, chunk):
+        app = current_app._get_current_object()
+        users, items = _preload_chunk(chunk)
+        outcome = _ChunkOutcome()
+        for reminder in chunk:
+            checked = _check_reminder(reminder, users, items, require_email=False)
+            if checked is None:
+                outcome.rejected([reminder.id], 'invalid')
+                continue
+            try:
+                outcome.notifications.append(build_notification(reminder, *checked))
+                outcome.sent.append(reminder.id)
+            except Exception as e:
+                app.logger.error(f"Error building in-app notification for reminder {reminder.id}: {e}")
+                outcome.rejected([reminder.id], 'render')
+        return outcome
+
+    def close(self):
+        pass
+
+class _WebhookDelivery:
+    """
+    Delivers 'webhook' reminders as JSON POSTs to each user's webhook_url.
+
+    A user's reminders in the chunk are batched, up to WEBHOOK_BATCH_SIZE
+    (default 1) per POST. POSTs run on a small thread pool (WEBHOOK_CONCURRENCY)
+    over a shared keep-alive WebhookConnectionPool, which caps requests per
+    host and retries transient failures before the reminder is handed to the
+    usual retry schedule. Payloads are built in the calling thread.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.batch_size = max(1, app.config.get('WEBHOOK_BATCH_SIZE', 1))
+        self.concurrency = app.config.get('WEBHOOK_CONCURRENCY', 4)
+        self.pool = None
+        self.executor = None
+
+    @property
+    def connections_opened(self):
+        return self.pool.connections_opened if self.pool else 0
+
+    def _batches(self, chunk, outcome):
+        users, items = _preload_chunk(chunk)
+        by_user = {}
+        for reminder in chunk:
+            checked = _check_reminder(reminder, users, items, require_email=False)
+            if checked is None:
+                outcome.rejected([reminder.id], 'invalid')
+            elif not checked[0].webhook_url:
+                self.app.logger.error(f"User {reminder.user_id} has no webhook URL for reminder {reminder.id}.")
+                outcome.rejected([reminder.id], 'invalid')
+            else:
+                by_user.setdefault(reminder.user_id, (checked[0], []))[1].append((reminder, checked[1]))
+        for user, entries in by_user.values():
+            for start in range(0, len(entries), self.batch_size):
+                yield user, entries[start:start + self.batch_size]
+
+    def deliver(self, chunk):
+        if self.pool is None:
+            self.pool = WebhookConnectionPool()
+            self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='webhook-worker')
+        outcome = _ChunkOutcome()
+        jobs = []
+        for user, entries in self._batches(chunk, outcome):
+            reminder_ids = [reminder.id for reminder, _ in entries]
+            try:
+                payload = webhook_payload(user, entries)
+            except Exception as e:
+                self.app.logger.error(f"Error building webhook payload for reminders {reminder_ids}: {e}")
+                outcome.rejected(reminder_ids, 'render')
+                continue
+            jobs.append((reminder_ids, user.webhook_url, self.executor.submit(self._post, user.webhook_url, payload)))
+
+        for reminder_ids, url, future in jobs:
+            try:
+                future.result()
+                self.app.logger.info(f"Posted reminders {reminder_ids} to webhook {url}",
+                                     extra=_log_fields('reminder_sent', 'webhook', reminder_ids, sample=True))
+                outcome.sent.extend(reminder_ids)
+            except Exception as e:
+                self.app.logger.error(f"Error posting reminders {reminder_ids} to webhook {url}: {e}",
+                                      extra=_log_fields('reminder_failed', 'webhook', reminder_ids, cause=error_cause(e)))
+                outcome.failed(reminder_ids, e)
+        return outcome
+
+    def _post(self, url, payload):
+        started = time.perf_counter()
+        status = self.pool.post_json(url, payload)
+        get_metrics(self.app).record_latency('webhook', time.perf_counter() - started)
+        return status
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.pool.close()
+
+def _deliver_by_method(chunk, delivery, channels):
+    """Routes each reminder to the channel for its notification_method; any other method goes out as email."""
+    groups = {}
+    for reminder in chunk:
+        method = reminder.notification_method if reminder.notification_method in channels else 'email'
+        groups.setdefault(method, []).append(reminder)
+    outcome = _ChunkOutcome()
+    for method, reminders in groups.items():
+        outcome.merge(channels.get(method, delivery).deliver(reminders))
+    return outcome
+
+def dispatch_due_reminders(batch_size=None, now=None, worker_id=None, concurrency=None, backend=None, digest_minutes=None,
+                           rate_limiter=None, materialize=True):
+    """
+    Sends all due pending reminders in fixed-size chunks.
+
+    Chunks are claimed with claim_due_reminders(), so several dispatchers
+    (on one or many hosts) can run at once without sending duplicates.
+    Each chunk costs one claim, one IN (...) query each for
+    the referenced users, events and tasks, and a single transaction holding
+    the status UPDATEs for the whole chunk. Emails go out over persistent SMTP
+    connections, recycled every MAIL_MAX_MESSAGES_PER_CONNECTION messages.
+
+    With concurrency > 1 each chunk is split across a thread pool of that size;
+    MAIL_MAX_SEND_RATE (messages per second, 0 = unlimited) caps the total
+    send rate across all threads. With MAIL_RATE_OVERFLOW='defer' a message
+    that finds the bucket empty is not waited for: its reminders go back to
+    'pending', rescheduled one slot per 1/rate seconds, and count as 'deferred'.
+    Long-running callers pass their own `rate_limiter` so the bucket (and the
+    rate) carries over from one pass to the next.
+
+    backend='async' (or REMINDER_DELIVERY_BACKEND) renders each chunk up front
+    and sends it through AsyncSMTPDelivery's connection pool instead.
+    backend='outbox' only renders: messages are written to the outbox table in
+    the same transaction that marks their reminders 'queued', and
+    outbox.drain_outbox() sends them later, so SMTP never holds up the database.
+
+    digest_minutes (or REMINDER_DIGEST_WINDOW_MINUTES, 0 = off) merges a user's
+    reminders in the same chunk that fall due within that many minutes of each
+    other into one digest email; they are marked sent in the chunk's single UPDATE.
+    Transient failures (dropped connections, timeouts, SMTP 4xx replies) are
+    not final: the reminder moves to 'retry' with capped exponential backoff
+    plus jitter and becomes 'dead' after REMINDER_MAX_ATTEMPTS failed attempts.
+    Permanent failures (5xx replies, missing data, render errors) are 'error'.
+
+    Reminders with notification_method 'inapp' skip email entirely: they
+    become Notification rows pushed to the browser (see notifications).
+    'webhook' reminders are POSTed as JSON to the user's webhook_url.
+
+    Emails are built by the process-wide ReminderRenderer, so templates are
+    compiled once; 'render_ms' is the average render time per message.
+
+    With REMINDER_RULES_ENABLED the due reminders are first computed from the
+    users' ReminderRule offsets (see reminder_rules) and their delivery rows
+    inserted; 'materialized' counts them. Callers that have already run
+    materialize_due_reminders() for this pass pass materialize=False.
+    Otherwise recurring events get their next occurrences' reminders from
+    refresh_occurrence_reminders_if_due().
+
+    Every pass feeds the process-wide ReminderMetrics (dispatch lag, send
+    latency and failures by cause, see reminder_metrics); with
+    REMINDER_METRICS_FILE set they are also added to that snapshot file.
+    Each pass ends with one 'dispatch_run' summary log record carrying these stats.
+
+    Returns a dict with 'sent', 'queued', 'error', 'retry', 'dead', 'deferred',
+    'materialized', 'batches' and 'connections' counts, plus 'render_ms'.
+    """
+    app = current_app._get_current_object()
+    started = time.perf_counter()
+    errors_before = get_metrics(app).snapshot()['errors']
+    batch_size = batch_size or app.config.get('REMINDER_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    concurrency = concurrency or app.config.get('REMINDER_CONCURRENCY', 1)
+    backend = backend or app.config.get('REMINDER_DELIVERY_BACKEND', 'smtp')
+    now = now or datetime.utcnow()
+    worker_id = worker_id or default_worker_id()
+    rate_limiter = rate_limiter or TokenBucket(app.config.get('MAIL_MAX_SEND_RATE', 0))
+    if digest_minutes is None:
+        digest_minutes = app.config.get('REMINDER_DIGEST_WINDOW_MINUTES', 0)
+    digest_window = timedelta(minutes=digest_minutes) if digest_minutes else None
+    defer_overflow = bool(rate_limiter.rate) and app.config.get('MAIL_RATE_OVERFLOW', 'wait') == 'defer'
+    stats = {'sent': 0, 'queued': 0, 'error': 0, 'retry': 0, 'dead': 0, 'deferred': 0, 'materialized': 0,
+             'batches': 0, 'connections': 0}
+    if rules_enabled(app):
+        if materialize:
+            stats['materialized'] = materialize_due_reminders(now)
+    else:
+        refresh_occurrence_reminders_if_due(now, app) # Reminders for the next occurrences of recurring events
+    renderer = get_renderer(app) # Compiles the templates before any worker thread needs them
+    rendered_before = renderer.stats()
+
+    if backend == 'outbox':
+        delivery = _OutboxDelivery(digest_window)
+    elif backend == 'async':
+        delivery = _AsyncDelivery(app, rate_limiter, digest_window, defer_overflow)
+    elif concurrency > 1:
+        delivery = _ThreadPoolDelivery(app, concurrency, rate_limiter, digest_window, defer_overflow)
+    else:
+        delivery = _SequentialDelivery(rate_limiter, digest_window, defer_overflow)
+    channels = {'inapp': _InAppDelivery(), 'webhook': _WebhookDelivery(app)}
+    try:
+        _dispatch_loop(now, batch_size, worker_id, delivery, stats, rate_limiter.rate, channels)
+    finally:
+        delivery.close()
+        for channel in channels.values():
+            channel.close()
+
+    stats['connections'] = delivery.connections_opened
+    rendered = renderer.stats()
+    messages = rendered['messages'] - rendered_before['messages']
+    stats['render_ms'] = (rendered['seconds'] - rendered_before['seconds']) * 1000 / messages if messages else 0.0
+
+    metrics = get_metrics(app)
+    run_seconds = time.perf_counter() - started
+    metrics.record_run(run_seconds, stats['sent'] + stats['queued'])
+    error_causes = {cause: count - errors_before.get(cause, 0) for cause, count in metrics.snapshot()['errors'].items()
+                    if count > errors_before.get(cause, 0)}
+    app.logger.info(f"Reminder dispatch run done in {run_seconds:.2f} s. Sent: {stats['sent']}, Queued: {stats['queued']}, Errors: {stats['error']}, "
+                    f"Retries: {stats['retry']}, Dead: {stats['dead']}, Deferred: {stats['deferred']}.",
+                    extra=dict(stats, event='dispatch_run', worker_id=worker_id, backend=backend, seconds=round(run_seconds, 3),
+                               error_causes=error_causes))
+    metrics_file = app.config.get('REMINDER_METRICS_FILE')
+    if metrics_file:
+        try:
+            write_snapshot(metrics, metrics_file)
+        except OSError as e:
+            app.logger.warning(f"Could not write reminder metrics to {metrics_file}: {e}")
+    return stats
+
+def _sent_lags(chunk, sent_ids, sent_at, channels):
+    """Seconds between reminder_time and sent_at for each sent reminder, grouped by channel."""
+    sent_ids = set(sent_ids)
+    lags = {}
+    for reminder in chunk:
+        if reminder.id in sent_ids:
+            channel = reminder.notification_method if reminder.notification_method in channels else 'email'
+            lags.setdefault(channel, []).append((sent_at - reminder.reminder_time).total_seconds())
+    return lags
+
+def _dispatch_loop(now, batch_size, worker_id, delivery, stats, send_rate=0, channels=None):
+    """Claims, delivers and records chunks until no due reminder is left."""
+    app = current_app._get_current_object()
+    metrics = get_metrics(app)
+    deferred_messages = 0
+    while True:
+        # Claimed rows leave the claimable set, so re-claiming walks the backlog.
+        chunk = claim_due_reminders(worker_id, batch_size, now=now)
+        if not chunk:
+            break
+
+        outcome = _deliver_by_method(chunk, delivery, channels or {})
+
+        try:
+            updated_at = datetime.utcnow()
+            _mark_reminders(outcome.sent, 'sent', updated_at, worker_id)
+            _mark_reminders(outcome.queued, 'queued', updated_at, worker_id)
+            _mark_reminders(outcome.error, 'error', updated_at, worker_id)
+            dead = 0
+            if outcome.retry:
+                retry_ids = set(outcome.retry)
+                # Backoff runs from past `now`, so this run's later claims won't pick them up again.
+                dead = _schedule_retries([r for r in chunk if r.id in retry_ids], max(now, updated_at), worker_id)
+            if outcome.deferred:
+                # Rescheduled past `now` for the same reason.
+                deferred_times = deferred_reminder_times(max(now, updated_at), len(outcome.deferred), send_rate, deferred_messages)
+                _defer_reminders(outcome.deferred, deferred_times, worker_id)
+                deferred_messages += len(outcome.deferred)
+            payloads = []
+            if outcome.notifications:
+                db.session.flush()
+                payloads = notification_payloads(outcome.notifications)
+            lags = _sent_lags(chunk, outcome.sent, updated_at, channels or {}) # Before the commit expires the rows
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        publish_notifications(payloads)
+        for channel, channel_lags in lags.items():
+            metrics.record_sent(channel, len(channel_lags), channel_lags)
+        for cause, count in outcome.causes.items():
+            metrics.record_error(cause, count)
+
+        stats['sent'] += len(outcome.sent)
+        stats['queued'] += len(outcome.queued)
+        stats['error'] += len(outcome.error)
+        stats['retry'] += len(outcome.retry) - dead
+        stats['dead'] += dead
+        stats['deferred'] += sum(len(reminder_ids) for reminder_ids in outcome.deferred)
+        stats['batches'] += 1
+        app.logger.info(f"Reminder batch {stats['batches']} done. Sent: {len(outcome.sent)}, Queued: {len(outcome.queued)}, Errors: {len(outcome.error)}, "
+                        f"Retries: {len(outcome.retry) - dead}, Dead: {dead}, Deferred: {len(outcome.deferred)} messages.")
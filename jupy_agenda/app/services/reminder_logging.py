@@ -0,0 +1,117 @@
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timezone
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+
+DEFAULT_SAMPLE_RATE = 0.05 # Share of per-reminder success lines that are written
+DEFAULT_QUEUE_SIZE = 10000
+
+# Attributes every LogRecord has; anything else was passed with extra={...} and goes into the JSON line
+_RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {'message', 'asctime', 'sample'}
+
+class JSONFormatter(logging.Formatter):
+    """
+    One JSON object per line: ts, level, logger, message, any fields passed
+    with extra={...} (e.g. reminder_ids, cause) and the traceback, if any.
+    """
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through only `rate` of the records logged with extra={'sample': True}
+    (routine per-reminder success lines). Everything else, failures
+    included, always passes. `dropped` counts the records sampled out.
+    """
+
+    def __init__(self, rate, rng=random):
+        super().__init__()
+        self.rate = rate
+        self.dropped = 0
+        self._rng = rng
+
+    def filter(self, record):
+        if not getattr(record, 'sample', False) or self.rate >= 1:
+            return True
+        if self.rate > 0 and self._rng.random() < self.rate:
+            return True
+        self.dropped += 1
+        return False
+
+class _DroppingQueueHandler(QueueHandler):
+    """QueueHandler on a bounded queue that drops records instead of blocking or printing errors when it is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Unlike QueueHandler.prepare(), keep the message and the traceback apart for the JSON formatter
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _ReminderLogListener(QueueListener):
+    """QueueListener whose stop() may be called twice (explicitly and at exit), as on Python 3.12+."""
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+def configure_reminder_logging(app, stream=None):
+    """
+    Switches app.logger to structured, non-blocking logging for the reminder
+    commands. Records are put on a bounded in-memory queue and a
+    QueueListener thread formats them as JSON and writes them to `stream`
+    (default stderr, or REMINDER_LOG_FILE), so the dispatch loop never waits
+    on log I/O. Per-reminder success lines are sampled at
+    REMINDER_LOG_SAMPLE_RATE (default 0.05); failures and summaries are always kept.
+
+    Returns the started QueueListener; it is stopped (and the queue flushed) at exit.
+    """
+    log_file = app.config.get('REMINDER_LOG_FILE')
+    if log_file:
+        handler = logging.FileHandler(log_file)
+    else:
+        handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JSONFormatter())
+
+    queue_handler = _DroppingQueueHandler(queue.Queue(app.config.get('REMINDER_LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)))
+    queue_handler.addFilter(SamplingFilter(app.config.get('REMINDER_LOG_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)))
+    for existing in list(app.logger.handlers):
+        app.logger.removeHandler(existing)
+    app.logger.addHandler(queue_handler)
+    app.logger.setLevel(logging.INFO)
+    app.logger.propagate = False
+
+    listener = _ReminderLogListener(queue_handler.queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,368 @@
+from flask import current_app
+from .. import db
+from ..models import Reminder, ReminderArchive, Event, Task, User
+from .reminder_rules import rules_enabled, DEFAULT_LOOKBACK_MINUTES
+from .reminder_policy import event_reminder_lead, user_offset, DEFAULT_TASK_REMINDER_HOUR, DEFAULT_SPREAD_MINUTES
+from .recurrence import expand_event
+from sqlalchemy import and_, or_, exists, func, literal, literal_column, null, select, Column, Integer, MetaData, Table
+from datetime import datetime, timedelta
+import time
+
+DEFAULT_BACKFILL_BATCH_SIZE = 5000
+DEFAULT_ARCHIVE_BATCH_SIZE = 1000
+DEFAULT_ARCHIVE_AFTER_DAYS = 30
+DEFAULT_REBUILD_BATCH_SIZE = 10000
+EVENT_REMINDER_BUFFER = timedelta(minutes=5) # Like the routes: no reminder for events starting within 5 minutes
+DEFAULT_OCCURRENCE_HORIZON_DAYS = 14 # Recurring events have reminders for the occurrences starting this far ahead
+DEFAULT_OCCURRENCE_REFRESH_MINUTES = 60 # How often the dispatcher moves that horizon forward
+DEFAULT_OCCURRENCE_BATCH_SIZE = 500
+FINISHED_STATUSES = ('sent', 'error', 'dead') # No dispatcher, outbox sender or route touches these again
+# Columns copied to reminders_archive (claim bookkeeping is dropped)
+ARCHIVED_COLUMNS = ('id', 'user_id', 'item_type', 'item_id', 'event_id', 'task_id', 'reminder_time', 'occurrence_start', 'notification_method',
+                    'offset_minutes', 'sent_status', 'attempts', 'created_at', 'updated_at')
+
+def backfill_reminder_links(batch_size=None, delete_orphans=False):
+    """
+    One-off migration for databases created before Reminder.event_id/task_id:
+    copies item_id into the typed column of every reminder whose event or
+    task still exists, walking the table in id ranges of `batch_size` with
+    one set-based UPDATE per type and a commit per range. Only rows whose
+    link is still NULL are touched, so an interrupted run can simply be repeated.
+
+    Reminders whose item is gone (orphans) cannot be linked; they are counted,
+    or deleted when delete_orphans is True, as ON DELETE CASCADE would have done.
+    Returns a dict with 'events', 'tasks' and 'orphans' counts.
+    """
+    batch_size = batch_size or current_app.config.get('REMINDER_BACKFILL_BATCH_SIZE', DEFAULT_BACKFILL_BATCH_SIZE)
+    stats = {'events': 0, 'tasks': 0, 'orphans': 0}
+    max_id = db.session.query(func.max(Reminder.id)).scalar() or 0
+    event_exists = exists().where(Event.id == Reminder.item_id)
+    task_exists = exists().where(Task.id == Reminder.item_id)
+
+    for start in range(0, max_id, batch_size):
+        in_range = and_(Reminder.id > start, Reminder.id <= start + batch_size)
+        try:
+            stats['events'] += Reminder.query.filter(
+                in_range, Reminder.item_type == 'event', Reminder.event_id.is_(None), event_exists
+            ).update({'event_id': Reminder.item_id}, synchronize_session=False)
+            stats['tasks'] += Reminder.query.filter(
+                in_range, Reminder.item_type == 'task', Reminder.task_id.is_(None), task_exists
+            ).update({'task_id': Reminder.item_id}, synchronize_session=False)
+
+            orphans = Reminder.query.filter(in_range, Reminder.event_id.is_(None), Reminder.task_id.is_(None))
+            if delete_orphans:
+                stats['orphans'] += orphans.delete(synchronize_session=False)
+            else:
+                stats['orphans'] += orphans.count()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    current_app.logger.info(f"Reminder link backfill done. Events: {stats['events']}, Tasks: {stats['tasks']}, Orphans: {stats['orphans']}{' (deleted)' if delete_orphans else ''}.")
+    return stats
+
+def _archive_cutoff(now, older_than):
+    """
+    The updated_at before which finished reminders are archived. In rules mode
+    it is kept past the materialization lookback: rows inside that window are
+    what stops materialize_due_reminders() from creating them again.
+    """
+    config = current_app.config
+    if older_than is None:
+        older_than = timedelta(days=config.get('REMINDER_ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS))
+    if rules_enabled():
+        lookback = timedelta(minutes=config.get('REMINDER_RULES_LOOKBACK_MINUTES', DEFAULT_LOOKBACK_MINUTES))
+        if older_than < lookback:
+            current_app.logger.warning(f"Archive age {older_than} is shorter than the reminder rules lookback; using {lookback}.")
+            older_than = lookback
+    return now - older_than
+
+def archive_reminders(older_than=None, batch_size=None, now=None):
+    """
+    Moves finished reminders ('sent', 'error', 'dead') whose updated_at is
+    older than `older_than` (a timedelta, default REMINDER_ARCHIVE_AFTER_DAYS)
+    from `reminders` to `reminders_archive`.
+
+    Rows are moved in id order, `batch_size` at a time, each chunk with one
+    INSERT ... SELECT and one DELETE in its own transaction, so the table is
+    never locked for long and an interrupted run loses nothing: the next run
+    simply continues with what is left.
+    Afterwards archive rows older than REMINDER_ARCHIVE_RETENTION_DAYS (if set) are purged.
+    Returns a dict with 'archived', 'batches' and 'purged' counts.
+    """
+    config = current_app.config
+    batch_size = batch_size or config.get('REMINDER_ARCHIVE_BATCH_SIZE', DEFAULT_ARCHIVE_BATCH_SIZE)
+    now = now or datetime.utcnow()
+    finished = and_(Reminder.sent_status.in_(FINISHED_STATUSES), Reminder.updated_at < _archive_cutoff(now, older_than))
+    columns = [getattr(Reminder, name) for name in ARCHIVED_COLUMNS] + [literal(now).label('archived_at')]
+    stats = {'archived': 0, 'batches': 0, 'purged': 0}
+
+    last_id = 0
+    while True:
+        reminder_ids = [reminder_id for (reminder_id,) in db.session.query(Reminder.id).filter(
+            finished, Reminder.id > last_id
+        ).order_by(Reminder.id).limit(batch_size)]
+        if not reminder_ids:
+            break
+        last_id = reminder_ids[-1]
+        chunk = and_(Reminder.id.in_(reminder_ids), finished)
+        try:
+            db.session.execute(ReminderArchive.__table__.insert().from_select(
+                ARCHIVED_COLUMNS + ('archived_at',), select(*columns).where(chunk)
+            ))
+            stats['archived'] += Reminder.query.filter(chunk).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        stats['batches'] += 1
+
+    retention_days = config.get('REMINDER_ARCHIVE_RETENTION_DAYS', 0)
+    if retention_days:
+        stats['purged'] = purge_archived_reminders(now - timedelta(days=retention_days), batch_size)
+
+    current_app.logger.info(f"Reminder archive done. Archived: {stats['archived']} in {stats['batches']} batches, Purged: {stats['purged']}.")
+    return stats
+
+def purge_archived_reminders(before, batch_size=None):
+    """Deletes archived reminders that finished before `before`, `batch_size` rows per transaction. Returns the count."""
+    batch_size = batch_size or current_app.config.get('REMINDER_ARCHIVE_BATCH_SIZE', DEFAULT_ARCHIVE_BATCH_SIZE)
+    purged = 0
+    while True:
+        archive_ids = db.session.query(ReminderArchive.id).filter(ReminderArchive.updated_at < before).limit(batch_size)
+        try:
+            deleted = ReminderArchive.query.filter(
+                ReminderArchive.id.in_(archive_ids.subquery().select())
+            ).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        purged += deleted
+        if deleted < batch_size:
+            return purged
+
+def _plus_seconds(dialect, column, seconds, keep_fraction):
+    """
+    SQL for `column` (a DATETIME, or a DATE at midnight) shifted by the
+    integer SQL expression `seconds`, stored the way SQLAlchemy stores DateTime.
+    """
+    if dialect == 'sqlite':
+        # SQLite keeps DateTime as 'YYYY-MM-DD HH:MM:SS.ffffff' text; re-attach the microseconds strftime drops
+        shifted = func.strftime('%Y-%m-%d %H:%M:%S', column, func.printf('%+d seconds', seconds))
+        return shifted.op('||')(func.substr(column, 20) if keep_fraction else literal('.000000'))
+    if dialect == 'postgresql':
+        return column + seconds * literal_column("interval '1 second'")
+    if dialect in ('mysql', 'mariadb'):
+        return func.timestampadd(literal_column('SECOND'), seconds, column)
+    raise RuntimeError(f"rebuild-reminders does not support the {dialect} database.")
+
+def _user_offsets_table(connection, user_id):
+    """
+    Fills a temporary table with every user's task reminder offset in
+    seconds. The offset comes from a CRC32 of the user id, which SQL cannot
+    compute, so the task INSERT ... SELECT joins against this table instead.
+    """
+    table = Table('tmp_reminder_user_offsets', MetaData(),
+                  Column('user_id', Integer, primary_key=True), Column('offset_seconds', Integer, nullable=False),
+                  prefixes=['TEMPORARY'])
+    table.drop(connection, checkfirst=True)
+    table.create(connection)
+    spread_minutes = current_app.config.get('REMINDER_SPREAD_MINUTES', DEFAULT_SPREAD_MINUTES)
+    users = select(User.id)
+    if user_id is not None:
+        users = users.where(User.id == user_id)
+    rows = [{'user_id': uid, 'offset_seconds': int(user_offset(uid, spread_minutes).total_seconds())}
+            for (uid,) in connection.execute(users)]
+    for start in range(0, len(rows), DEFAULT_REBUILD_BATCH_SIZE):
+        connection.execute(table.insert(), rows[start:start + DEFAULT_REBUILD_BATCH_SIZE])
+    return table
+
+def rebuild_reminders(user_id=None, batch_size=None, now=None):
+    """
+    Recomputes the pending reminders of every future event and due task (or
+    only `user_id`'s) from the current reminder policy, as if each item had
+    just been saved: future pending reminders are deleted and recreated with
+    EVENT_REMINDER_MINUTES / TASK_REMINDER_HOUR / REMINDER_SPREAD_MINUTES.
+
+    Works set-based in a single pass over events.id and then tasks.id: each
+    range of `batch_size` ids costs one DELETE and one INSERT ... SELECT, in
+    its own transaction. Reminders already due but not yet sent are left
+    alone, and their items get no second reminder. Recurring events are then
+    given one reminder per occurrence in the horizon by refresh_occurrence_reminders().
+    Not used in rules mode, where reminders are computed at dispatch time.
+
+    Returns a dict with 'deleted', 'events', 'occurrences', 'tasks', 'batches', 'seconds' and 'rows_per_second'.
+    """
+    if rules_enabled():
+        raise RuntimeError("Reminder rules are enabled: reminders are computed at dispatch time, nothing to rebuild.")
+    config = current_app.config
+    batch_size = batch_size or config.get('REMINDER_REBUILD_BATCH_SIZE', DEFAULT_REBUILD_BATCH_SIZE)
+    now = now or datetime.utcnow()
+    started = time.perf_counter()
+    stats = {'deleted': 0, 'events': 0, 'occurrences': 0, 'tasks': 0, 'batches': 0}
+    dialect = db.engine.dialect.name
+    columns = ('user_id', 'item_type', 'item_id', 'event_id', 'task_id', 'reminder_time', 'notification_method',
+               'sent_status', 'attempts', 'created_at', 'updated_at')
+    constants = [literal('pending'), literal(0), literal(now), literal(now)]
+    future_pending = and_(Reminder.sent_status == 'pending', Reminder.reminder_time > now, Reminder.offset_minutes.is_(None))
+
+    lead = event_reminder_lead()
+    event_due = and_(Event.rrule.is_(None), Event.start_time > now + max(lead, EVENT_REMINDER_BUFFER),
+                     ~exists().where(Reminder.event_id == Event.id, Reminder.sent_status == 'pending', Reminder.reminder_time <= now))
+    event_rows = select(
+        Event.user_id, literal('event'), Event.id, Event.id, null(),
+        _plus_seconds(dialect, Event.start_time, literal(-int(lead.total_seconds())), keep_fraction=True),
+        User.notification_method, *constants
+    ).join_from(Event, User, User.id == Event.user_id).where(event_due)
+
+    # One persistent connection: the offsets table is temporary, i.e. private to it
+    with db.engine.connect() as connection:
+        with connection.begin():
+            offsets = _user_offsets_table(connection, user_id)
+        today = now.date()
+        base_seconds = config.get('TASK_REMINDER_HOUR', DEFAULT_TASK_REMINDER_HOUR) * 3600
+        elapsed_today = (now - datetime.combine(today, datetime.min.time())).total_seconds() - base_seconds
+        task_due = and_(
+            Task.due_date >= today,
+            or_(Task.due_date > today, offsets.c.offset_seconds > elapsed_today), # Today's reminder may already be past
+            ~exists().where(Reminder.task_id == Task.id, Reminder.sent_status == 'pending', Reminder.reminder_time <= now)
+        )
+        task_rows = select(
+            Task.user_id, literal('task'), Task.id, null(), Task.id,
+            _plus_seconds(dialect, Task.due_date, offsets.c.offset_seconds + base_seconds, keep_fraction=False),
+            User.notification_method, *constants
+        ).join_from(Task, offsets, offsets.c.user_id == Task.user_id).join(User, User.id == Task.user_id).where(task_due)
+
+        for model, rows, link, key in ((Event, event_rows, Reminder.event_id, 'events'),
+                                       (Task, task_rows, Reminder.task_id, 'tasks')):
+            max_id = connection.execute(select(func.max(model.id))).scalar() or 0
+            for start in range(0, max_id, batch_size):
+                end = start + batch_size
+                stale = Reminder.__table__.delete().where(link > start, link <= end, future_pending)
+                fresh = rows.where(model.id > start, model.id <= end)
+                if user_id is not None:
+                    stale = stale.where(Reminder.user_id == user_id)
+                    fresh = fresh.where(model.user_id == user_id)
+                with connection.begin():
+                    stats['deleted'] += connection.execute(stale).rowcount
+                    stats[key] += connection.execute(Reminder.__table__.insert().from_select(columns, fresh)).rowcount
+                stats['batches'] += 1
+        with connection.begin():
+            offsets.drop(connection)
+    stats['occurrences'] = refresh_occurrence_reminders(user_id=user_id, now=now)['created']
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    written = stats['events'] + stats['occurrences'] + stats['tasks']
+    stats['rows_per_second'] = round(written / stats['seconds'], 1) if stats['seconds'] else 0.0
+    current_app.logger.info(f"Reminder rebuild done. Deleted: {stats['deleted']}, Events: {stats['events']}, Occurrences: {stats['occurrences']}, Tasks: {stats['tasks']}, "
+                            f"Batches: {stats['batches']}, {stats['rows_per_second']} rows/s.")
+    return stats
+
+def occurrence_horizon():
+    return timedelta(days=current_app.config.get('REMINDER_OCCURRENCE_HORIZON_DAYS', DEFAULT_OCCURRENCE_HORIZON_DAYS))
+
+def occurrence_reminder_rows(event, notification_method, now):
+    """
+    Reminder rows (dicts for an executemany INSERT) for the occurrences of
+    the recurring `event` starting within the horizon, with the routes'
+    policy: none for an occurrence starting within EVENT_REMINDER_BUFFER or
+    whose reminder time has passed. Cancelled occurrences get none; moved
+    ones are reminded of at their new time.
+    """
+    lead = event_reminder_lead()
+    first = now + max(lead, EVENT_REMINDER_BUFFER)
+    return [{'user_id': event.user_id, 'item_type': 'event', 'item_id': event.id, 'event_id': event.id, 'task_id': None,
+             'reminder_time': occurrence.start_time - lead, 'occurrence_start': occurrence.start_time,
+             'notification_method': notification_method, 'sent_status': 'pending', 'attempts': 0}
+            for occurrence in expand_event(event, first, now + occurrence_horizon(), cache=False)
+            if occurrence.start_time > first] # expand_event also returns occurrences still running at `first`
+
+def refresh_occurrence_reminders(user_id=None, event_ids=None, now=None, batch_size=None):
+    """
+    Moves the reminders of recurring events forward to the rolling horizon
+    (REMINDER_OCCURRENCE_HORIZON_DAYS, default 14): for every series still
+    running (or only `user_id`'s, or the `event_ids`), the occurrences in the
+    horizon are compared with the reminders already there. Missing ones are
+    inserted; pending ones for cancelled, moved or dropped occurrences are
+    deleted. Reminders already due, and occurrences that already had one
+    sent, are left alone.
+
+    Series are read `batch_size` at a time; each batch costs one query for
+    their reminders, one DELETE and one INSERT, in its own transaction.
+    Not used in rules mode, where occurrences are evaluated at dispatch time.
+    Returns a dict with 'series', 'created' and 'deleted' counts.
+    """
+    batch_size = batch_size or current_app.config.get('REMINDER_OCCURRENCE_BATCH_SIZE', DEFAULT_OCCURRENCE_BATCH_SIZE)
+    now = now or datetime.utcnow()
+    first = now + max(event_reminder_lead(), EVENT_REMINDER_BUFFER)
+    series = Event.query.filter(Event.rrule.isnot(None), Event.recurrence_end > first,
+                                Event.start_time <= now + occurrence_horizon())
+    if user_id is not None:
+        series = series.filter(Event.user_id == user_id)
+    if event_ids is not None:
+        series = series.filter(Event.id.in_(list(event_ids)))
+    stats = {'series': 0, 'created': 0, 'deleted': 0}
+
+    last_id = 0
+    while True:
+        events = series.filter(Event.id > last_id).order_by(Event.id).limit(batch_size).all()
+        if not events:
+            break
+        last_id = events[-1].id
+        methods = dict(db.session.query(User.id, User.notification_method).filter(
+            User.id.in_({event.user_id for event in events})))
+        wanted = {}
+        for event in events:
+            for row in occurrence_reminder_rows(event, methods.get(event.user_id) or 'email', now):
+                wanted[(row['event_id'], row['occurrence_start'])] = row
+
+        # The reminders of these occurrences in any state, plus pending ones from before occurrence_start
+        existing = db.session.query(Reminder.id, Reminder.event_id, Reminder.occurrence_start, Reminder.reminder_time,
+                                    Reminder.sent_status).filter(
+            Reminder.event_id.in_([event.id for event in events]), Reminder.offset_minutes.is_(None),
+            or_(Reminder.occurrence_start > first,
+                and_(Reminder.occurrence_start.is_(None), Reminder.sent_status == 'pending', Reminder.reminder_time > now)))
+        existing = existing.all()
+        covered = {(event_id, occurrence_start) for _, event_id, occurrence_start, _, status in existing if status != 'pending'}
+        stale = []
+        for reminder_id, event_id, occurrence_start, reminder_time, status in existing:
+            if status != 'pending':
+                continue
+            row = wanted.get((event_id, occurrence_start))
+            if row is not None and row['reminder_time'] == reminder_time and (event_id, occurrence_start) not in covered:
+                covered.add((event_id, occurrence_start)) # Still right: kept
+            else:
+                stale.append(reminder_id)
+        fresh = [row for key, row in wanted.items() if key not in covered]
+        try:
+            if stale:
+                Reminder.query.filter(Reminder.id.in_(stale)).delete(synchronize_session=False)
+            if fresh:
+                db.session.execute(Reminder.__table__.insert(), fresh)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        stats['series'] += len(events)
+        stats['created'] += len(fresh)
+        stats['deleted'] += len(stale)
+
+    current_app.logger.info(f"Occurrence reminders refreshed. Series: {stats['series']}, Created: {stats['created']}, Deleted: {stats['deleted']}.")
+    return stats
+
+def refresh_occurrence_reminders_if_due(now=None, app=None):
+    """
+    Runs refresh_occurrence_reminders() when REMINDER_OCCURRENCE_REFRESH_MINUTES
+    (default 60) have passed since this process last did; the horizon is
+    far longer, so no occurrence is missed in between. Returns the rows created.
+    """
+    app = app or current_app._get_current_object()
+    now = now or datetime.utcnow()
+    interval = timedelta(minutes=app.config.get('REMINDER_OCCURRENCE_REFRESH_MINUTES', DEFAULT_OCCURRENCE_REFRESH_MINUTES))
+    last_run = app.extensions.get('occurrence_reminders_refreshed_at')
+    if last_run is not None and last_run <= now < last_run + interval:
+        return 0
+    app.extensions['occurrence_reminders_refreshed_at'] = now
+    return refresh_occurrence_reminders(now=now)['created']
@@ -0,0 +1,283 @@
+from flask import current_app
+import bisect
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # Not available on Windows; snapshot writes are then not serialized across processes
+    fcntl = None
+
+# Histogram bucket upper bounds, in seconds
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MAX_SAMPLES = 10000 # Raw samples kept per histogram for exact percentiles
+
+def error_cause(error):
+    """Short label for why a send failed: 'smtp_<code>', 'http_<status>' or the exception class."""
+    code = getattr(error, 'smtp_code', None) or getattr(error, 'code', None)
+    if isinstance(code, int) and code > 0:
+        return f'smtp_{code}'
+    status = getattr(error, 'status', None)
+    if isinstance(status, int):
+        return f'http_{status}'
+    return type(error).__name__
+
+class Histogram:
+    """
+    Fixed-bucket histogram that also keeps a bounded random sample of raw
+    values, so percentiles are exact for small runs and close for large ones.
+    Bucket counts are cumulative-free (one count per bucket plus +Inf) and
+    can be merged across processes.
+    """
+
+    def __init__(self, buckets, max_samples=MAX_SAMPLES, rng=random):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max_samples = max_samples
+        self._samples = []
+        self._rng = rng
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if len(self._samples) < self.max_samples:
+            self._samples.append(value)
+        else: # Reservoir sampling keeps every value equally likely to be in the sample
+            slot = self._rng.randrange(self.count)
+            if slot < self.max_samples:
+                self._samples[slot] = value
+
+    def percentile(self, q):
+        """The q-th percentile (0-100) of the observed values, or None if there are none."""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+    def state(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+class ReminderMetrics:
+    """
+    Process-wide reminder pipeline metrics: dispatch lag (reminder_time to
+    actual send), send latency per channel, messages sent per channel,
+    failures by cause and dispatch run time (for throughput).
+
+    Thread-safe. Use get_metrics() to share one per application.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sent = {} # channel -> count
+        self.errors = {} # cause -> count
+        self.lag = Histogram(LAG_BUCKETS)
+        self.latency = {} # channel -> Histogram
+        self.runs = 0
+        self.run_seconds = 0.0
+        self.run_messages = 0
+        self.last_run_at = None
+        self._flushed = None # state() at the last write_snapshot()
+
+    def record_sent(self, channel, count=1, lags=()):
+        """Counts reminders sent on `channel`; `lags` are their delays past reminder_time, in seconds."""
+        with self._lock:
+            self.sent[channel] = self.sent.get(channel, 0) + count
+            for lag in lags:
+                self.lag.observe(max(0.0, lag))
+
+    def record_latency(self, channel, seconds):
+        with self._lock:
+            histogram = self.latency.get(channel)
+            if histogram is None:
+                histogram = self.latency[channel] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+
+    def record_error(self, cause, count=1):
+        if count:
+            with self._lock:
+                self.errors[cause] = self.errors.get(cause, 0) + count
+
+    def record_run(self, seconds, messages):
+        with self._lock:
+            self.runs += 1
+            self.run_seconds += seconds
+            self.run_messages += messages
+            self.last_run_at = time.time()
+
+    def snapshot(self):
+        """JSON-friendly summary with percentiles, as printed by send-reminders --stats-json."""
+        with self._lock:
+            return {
+                'sent': dict(self.sent),
+                'errors': dict(self.errors),
+                'lag_seconds': self.lag.summary(),
+                'send_latency_seconds': {channel: h.summary() for channel, h in self.latency.items()},
+                'runs': self.runs,
+                'run_seconds': round(self.run_seconds, 3),
+                'messages_per_second': round(self.run_messages / self.run_seconds, 2) if self.run_seconds else 0.0,
+            }
+
+    def state(self):
+        """Mergeable counters and bucket counts (what the snapshot file and Prometheus output use)."""
+        with self._lock:
+            return {
+                'sent': dict(self.sent),
+                'errors': dict(self.errors),
+                'lag': self.lag.state(),
+                'latency': {channel: h.state() for channel, h in self.latency.items()},
+                'runs': self.runs,
+                'run_seconds': self.run_seconds,
+                'run_messages': self.run_messages,
+                'last_run_at': self.last_run_at,
+            }
+
+    def unflushed_state(self):
+        """state() minus what the previous call already returned, so repeated flushes never double count."""
+        current = self.state()
+        delta = _subtract_state(current, self._flushed) if self._flushed else current
+        self._flushed = current
+        return delta
+
+def _subtract_counts(current, previous):
+    return {key: value - previous.get(key, 0) for key, value in current.items()}
+
+def _subtract_histogram(current, previous):
+    if not previous:
+        return current
+    return dict(current, counts=[a - b for a, b in zip(current['counts'], previous['counts'])],
+                sum=current['sum'] - previous['sum'], count=current['count'] - previous['count'])
+
+def _subtract_state(current, previous):
+    return {
+        'sent': _subtract_counts(current['sent'], previous['sent']),
+        'errors': _subtract_counts(current['errors'], previous['errors']),
+        'lag': _subtract_histogram(current['lag'], previous['lag']),
+        'latency': {channel: _subtract_histogram(h, previous['latency'].get(channel))
+                    for channel, h in current['latency'].items()},
+        'runs': current['runs'] - previous['runs'],
+        'run_seconds': current['run_seconds'] - previous['run_seconds'],
+        'run_messages': current['run_messages'] - previous['run_messages'],
+        'last_run_at': current['last_run_at'],
+    }
+
+def _add_histogram(total, delta):
+    if not total:
+        return delta
+    return dict(total, counts=[a + b for a, b in zip(total['counts'], delta['counts'])],
+                sum=total['sum'] + delta['sum'], count=total['count'] + delta['count'])
+
+def merge_states(total, delta):
+    """Adds a state() delta into an accumulated state (e.g. the snapshot file's)."""
+    if not total:
+        return delta
+    merged = dict(total)
+    for key in ('sent', 'errors'):
+        merged[key] = dict(total[key])
+        for name, value in delta[key].items():
+            merged[key][name] = merged[key].get(name, 0) + value
+    merged['lag'] = _add_histogram(total['lag'], delta['lag'])
+    merged['latency'] = dict(total['latency'])
+    for channel, histogram in delta['latency'].items():
+        merged['latency'][channel] = _add_histogram(total['latency'].get(channel), histogram)
+    for key in ('runs', 'run_seconds', 'run_messages'):
+        merged[key] = total[key] + delta[key]
+    merged['last_run_at'] = delta['last_run_at'] or total['last_run_at']
+    return merged
+
+def get_metrics(app=None):
+    """Returns the application's shared ReminderMetrics, creating it on first use."""
+    app = app or current_app._get_current_object()
+    metrics = app.extensions.get('reminder_metrics')
+    if metrics is None:
+        metrics = app.extensions['reminder_metrics'] = ReminderMetrics()
+    return metrics
+
+def read_snapshot(path):
+    """The accumulated state stored at `path`, or None if there is none yet."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def write_snapshot(metrics, path):
+    """
+    Adds what `metrics` recorded since its last flush to the snapshot file at
+    `path`, so several dispatcher processes (cron runs, daemons) accumulate
+    into one file that the /metrics endpoint serves. The file is replaced
+    atomically; on POSIX concurrent writers are serialized with a lock file.
+    """
+    delta = metrics.unflushed_state()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path + '.lock', 'a') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        merged = merge_states(read_snapshot(path), delta)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.reminder-metrics-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(merged, f)
+        os.replace(tmp_path, path)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+def _histogram_lines(name, histogram, labels=None):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram['buckets'] + ['+Inf'], histogram['counts']):
+        cumulative += count
+        lines.append(f"{name}_bucket{_format_labels(dict(labels or {}, le=bound))} {cumulative}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+    lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    return lines
+
+def render_prometheus(state):
+    """Prometheus text exposition (format 0.0.4) of a state() dict."""
+    state = state or ReminderMetrics().state()
+    lines = ['# HELP jupy_reminders_sent_total Reminder messages delivered, by channel.',
+             '# TYPE jupy_reminders_sent_total counter']
+    lines += [f'jupy_reminders_sent_total{_format_labels({"channel": c})} {n}' for c, n in sorted(state['sent'].items())]
+    lines += ['# HELP jupy_reminder_errors_total Reminder delivery failures, by cause.',
+              '# TYPE jupy_reminder_errors_total counter']
+    lines += [f'jupy_reminder_errors_total{_format_labels({"cause": c})} {n}' for c, n in sorted(state['errors'].items())]
+    lines += ['# HELP jupy_reminder_dispatch_lag_seconds Delay between reminder_time and the actual send.',
+              '# TYPE jupy_reminder_dispatch_lag_seconds histogram']
+    lines += _histogram_lines('jupy_reminder_dispatch_lag_seconds', state['lag'])
+    lines += ['# HELP jupy_reminder_send_latency_seconds Time to hand one message to the channel (SMTP, webhook).',
+              '# TYPE jupy_reminder_send_latency_seconds histogram']
+    for channel, histogram in sorted(state['latency'].items()):
+        lines += _histogram_lines('jupy_reminder_send_latency_seconds', histogram, {'channel': channel})
+    lines += ['# HELP jupy_reminder_dispatch_runs_total Dispatcher passes.',
+              '# TYPE jupy_reminder_dispatch_runs_total counter',
+              f"jupy_reminder_dispatch_runs_total {state['runs']}",
+              '# HELP jupy_reminder_dispatch_seconds_total Time spent in dispatcher passes.',
+              '# TYPE jupy_reminder_dispatch_seconds_total counter',
+              f"jupy_reminder_dispatch_seconds_total {state['run_seconds']}",
+              '# HELP jupy_reminder_dispatch_messages_total Reminders handled by dispatcher passes.',
+              '# TYPE jupy_reminder_dispatch_messages_total counter',
+              f"jupy_reminder_dispatch_messages_total {state['run_messages']}"]
+    if state.get('last_run_at'):
+        lines += ['# HELP jupy_reminder_last_run_timestamp_seconds When the last dispatcher pass finished.',
+                  '# TYPE jupy_reminder_last_run_timestamp_seconds gauge',
+                  f"jupy_reminder_last_run_timestamp_seconds {state['last_run_at']}"]
+    return '\n'.join(lines) + '\n'
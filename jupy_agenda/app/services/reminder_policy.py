@@ -0,0 +1,70 @@
+from flask import current_app
+from datetime import datetime, time, timedelta
+import random
+import zlib
+
+DEFAULT_TASK_REMINDER_HOUR = 9 # Task reminders go out from 09:00 on the due date
+DEFAULT_SPREAD_MINUTES = 60 # ...spread over the following hour
+DEFAULT_EVENT_REMINDER_MINUTES = 60 # Event reminders go out an hour before the start
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BASE_SECONDS = 60
+DEFAULT_RETRY_MAX_SECONDS = 3600
+
+def user_offset(user_id, spread_minutes):
+    """
+    Deterministic offset in [0, spread_minutes) for a user.
+    The same user always gets the same offset, so all of their reminders
+    keep arriving together while different users are spread out.
+    """
+    if not spread_minutes:
+        return timedelta(0)
+    spread_seconds = int(spread_minutes * 60)
+    return timedelta(seconds=zlib.crc32(str(user_id).encode()) % spread_seconds)
+
+def task_reminder_time(user_id, due_date):
+    """
+    When the reminder for a task due on `due_date` should fire: the configured
+    base hour (TASK_REMINDER_HOUR, default 9) plus the user's offset within
+    REMINDER_SPREAD_MINUTES (default 60, 0 = everyone at the base hour).
+    """
+    config = current_app.config
+    base = datetime.combine(due_date, time(config.get('TASK_REMINDER_HOUR', DEFAULT_TASK_REMINDER_HOUR), 0, 0))
+    return base + user_offset(user_id, config.get('REMINDER_SPREAD_MINUTES', DEFAULT_SPREAD_MINUTES))
+
+def event_reminder_time(start_time):
+    """When the reminder for an event starting at `start_time` should fire: EVENT_REMINDER_MINUTES (default 60) before."""
+    return start_time - event_reminder_lead()
+
+def event_reminder_lead():
+    return timedelta(minutes=current_app.config.get('EVENT_REMINDER_MINUTES', DEFAULT_EVENT_REMINDER_MINUTES))
+
+def deferred_reminder_times(now, count, rate, already_deferred=0):
+    """
+    New reminder times for `count` messages that exceeded the send rate:
+    one slot every 1/rate seconds after any slots handed out earlier in the run,
+    so the overflow is replayed at exactly the allowed rate.
+    """
+    return [now + timedelta(seconds=(already_deferred + i + 1) / rate) for i in range(count)]
+
+def retry_delay(attempts, base_seconds, max_seconds, rng=random):
+    """
+    Capped exponential backoff with jitter after `attempts` failed attempts:
+    base, 2*base, 4*base ... up to max_seconds, then a random point in the
+    upper half of that delay so a batch that failed together does not retry together.
+    """
+    delay = min(max_seconds, base_seconds * 2 ** (attempts - 1))
+    return timedelta(seconds=delay / 2 + rng.uniform(0, delay / 2))
+
+def retry_schedule(attempts, now, rng=random):
+    """
+    What to do with a reminder that has now failed `attempts` times:
+    ('retry', next_attempt_at), or ('dead', None) once REMINDER_MAX_ATTEMPTS is reached.
+    """
+    config = current_app.config
+    if attempts >= config.get('REMINDER_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS):
+        return 'dead', None
+    delay = retry_delay(attempts,
+                        config.get('REMINDER_RETRY_BASE_SECONDS', DEFAULT_RETRY_BASE_SECONDS),
+                        config.get('REMINDER_RETRY_MAX_SECONDS', DEFAULT_RETRY_MAX_SECONDS),
+                        rng)
+    return 'retry', now + delay
@@ -0,0 +1,117 @@
+from flask import current_app, has_request_context, url_for
+from flask_mail import Message
+from urllib.parse import urlsplit
+import threading
+import time
+
+REMINDER_TEMPLATES = {
+    'event': 'email/event_reminder',
+    'task': 'email/task_reminder',
+    'digest': 'email/digest',
+}
+
+# Headers added to every reminder email (RFC 3834: tells auto-responders not to reply).
+STATIC_HEADERS = {'Auto-Submitted': 'auto-generated', 'X-Auto-Response-Suppress': 'All'}
+
+def reminder_subject(item_type, item):
+    """Returns the email subject line for a reminder about the given item."""
+    if item_type == 'event':
+        return f"Event Reminder: {item.title if item else 'N/A'}"
+    return f"Task Reminder: {item.description[:30] if item else 'N/A'}..."
+
+def digest_subject(count):
+    """Returns the email subject line for a digest of `count` reminders."""
+    return f"Reminder Digest: {count} items"
+
+class ReminderRenderer:
+    """
+    Builds reminder emails from templates compiled once per process.
+
+    Both bodies of a message are rendered from one shared context straight
+    from the compiled templates, skipping render_template's per-call lookup.
+    Sender, headers and the calendar / task list links are worked out once.
+    Links come from APP_BASE_URL (or SERVER_NAME), so no request context is
+    needed; inside a request they fall back to the request's host.
+
+    Use get_renderer() to share one instance per application. It is safe to
+    use from several threads.
+    """
+
+    def __init__(self, app=None):
+        self.app = app or current_app._get_current_object()
+        env = self.app.jinja_env
+        self._templates = {
+            kind: (env.get_template(base + '.txt'), env.get_template(base + '.html'))
+            for kind, base in REMINDER_TEMPLATES.items()
+        }
+        self.sender = self.app.config.get('MAIL_DEFAULT_SENDER', 'noreply@jupy.agenda')
+        self._links = self._configured_links()
+        self._stats_lock = threading.Lock()
+        self.messages_rendered = 0
+        self.render_seconds = 0.0
+
+    def _configured_links(self):
+        """Absolute links built from configuration, or None if the host is unknown."""
+        base_url = self.app.config.get('APP_BASE_URL')
+        if base_url:
+            parts = urlsplit(base_url)
+            adapter = self.app.url_map.bind(parts.netloc, script_name=parts.path or '/', url_scheme=parts.scheme or 'http')
+        elif self.app.config.get('SERVER_NAME'):
+            adapter = self.app.create_url_adapter(None)
+        else:
+            return None
+        return {
+            'calendar_url': adapter.build('calendar.month_view', force_external=True),
+            'tasks_url': adapter.build('todo.list_tasks', force_external=True),
+        }
+
+    def links(self):
+        """The absolute calendar and task list links: {'calendar_url': ..., 'tasks_url': ...}."""
+        if self._links is None:
+            self._links = self._configured_links() # The host may have been configured after startup
+        if self._links is not None:
+            return self._links
+        if has_request_context():
+            return {
+                'calendar_url': url_for('calendar.month_view', _external=True),
+                'tasks_url': url_for('todo.list_tasks', _external=True),
+            }
+        raise RuntimeError("Set APP_BASE_URL (or SERVER_NAME) so reminder emails can link back to the site.")
+
+    def _render(self, kind, recipient, subject, context):
+        started = time.perf_counter()
+        text_template, html_template = self._templates[kind]
+        context.update(self.links())
+        msg = Message(subject, sender=self.sender, recipients=[recipient], extra_headers=dict(STATIC_HEADERS))
+        msg.body = text_template.render(context)
+        msg.html = html_template.render(context)
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self.messages_rendered += 1
+            self.render_seconds += elapsed
+        return msg
+
+    def reminder_message(self, reminder, user, item):
+        """Builds (but does not send) the email for one reminder."""
+        return self._render(reminder.item_type, user.email, reminder_subject(reminder.item_type, item),
+                            {'user': user, 'item': item})
+
+    def digest_message(self, user, entries):
+        """Builds one email listing several (reminder, item) pairs for the same user."""
+        events = [item for reminder, item in entries if reminder.item_type == 'event']
+        tasks = [item for reminder, item in entries if reminder.item_type == 'task']
+        return self._render('digest', user.email, digest_subject(len(entries)),
+                            {'user': user, 'events': events, 'tasks': tasks})
+
+    def stats(self):
+        """Messages rendered so far and the total time spent rendering them."""
+        with self._stats_lock:
+            return {'messages': self.messages_rendered, 'seconds': self.render_seconds}
+
+def get_renderer(app=None):
+    """Returns the application's shared ReminderRenderer, creating it on first use."""
+    app = app or current_app._get_current_object()
+    renderer = app.extensions.get('reminder_renderer')
+    if renderer is None:
+        renderer = app.extensions['reminder_renderer'] = ReminderRenderer(app)
+    return renderer
@@ -0,0 +1,169 @@
+from flask import current_app
+from .. import db
+from ..models import Reminder, ReminderRule, Event, Task, User
+from .reminder_policy import user_offset, DEFAULT_TASK_REMINDER_HOUR, DEFAULT_SPREAD_MINUTES
+from .recurrence import expand_event
+from sqlalchemy import and_, or_, exists
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, time, timedelta
+
+DEFAULT_EVENT_OFFSETS = [60] # One hour before the event
+DEFAULT_LOOKBACK_MINUTES = 24 * 60 # How late a missed reminder may still be sent
+
+def rules_enabled(app=None):
+    """True when reminders are computed from ReminderRule rows at dispatch time."""
+    app = app or current_app
+    return app.config.get('REMINDER_RULES_ENABLED', False)
+
+def default_offsets(item_type):
+    """Offsets applied to users who have no rule for `item_type`."""
+    if item_type == 'event':
+        return list(current_app.config.get('REMINDER_DEFAULT_EVENT_OFFSETS', DEFAULT_EVENT_OFFSETS))
+    return [current_app.config.get('TASK_REMINDER_HOUR', DEFAULT_TASK_REMINDER_HOUR) * 60]
+
+def user_rules(user_id):
+    """The user's offsets per item type, falling back to the defaults: {'event': [...], 'task': [...]}."""
+    rules = {'event': [], 'task': []}
+    for rule in ReminderRule.query.filter_by(user_id=user_id).order_by(ReminderRule.offset_minutes):
+        rules[rule.item_type].append(rule.offset_minutes)
+    return {item_type: offsets or default_offsets(item_type) for item_type, offsets in rules.items()}
+
+def set_user_rules(user_id, item_type, offsets):
+    """
+    Replaces the user's offsets for one item type (no commit). Only the small
+    rules table is written; no reminder row is touched.
+    """
+    ReminderRule.query.filter_by(user_id=user_id, item_type=item_type).delete(synchronize_session=False)
+    db.session.add_all([ReminderRule(user_id=user_id, item_type=item_type, offset_minutes=offset)
+                        for offset in sorted(set(offsets))])
+
+def _offsets_in_use(item_type):
+    offsets = {offset for (offset,) in db.session.query(ReminderRule.offset_minutes).filter(
+        ReminderRule.item_type == item_type).distinct()}
+    return offsets | set(default_offsets(item_type))
+
+def _rule_applies(owner_id, item_type, offset):
+    """SQL condition: the item's owner has this offset, or has no rule and it is a default."""
+    has_offset = exists().where(and_(
+        ReminderRule.user_id == owner_id,
+        ReminderRule.item_type == item_type,
+        ReminderRule.offset_minutes == offset
+    ))
+    if offset not in default_offsets(item_type):
+        return has_offset
+    has_any_rule = exists().where(and_(ReminderRule.user_id == owner_id, ReminderRule.item_type == item_type))
+    return or_(has_offset, ~has_any_rule)
+
+def _not_materialized(item_type, item_id, item_updated_at, offset):
+    """
+    SQL condition: no delivery row for (item, offset) was created since the
+    item was last edited. Edited items are re-checked in Python by fire time,
+    so moving an event produces a new reminder while renaming it does not.
+    """
+    return ~exists().where(and_(
+        Reminder.item_type == item_type,
+        Reminder.item_id == item_id,
+        Reminder.offset_minutes == offset,
+        Reminder.created_at >= item_updated_at
+    ))
+
+def _drop_existing(item_type, offset, rows):
+    """Removes candidates (user_id, item_id, fire_time, ...) whose (item, offset, fire time) already has a delivery row."""
+    if not rows:
+        return rows
+    existing = set(db.session.query(Reminder.item_id, Reminder.reminder_time).filter(
+        Reminder.item_type == item_type,
+        Reminder.offset_minutes == offset,
+        Reminder.item_id.in_({row[1] for row in rows})
+    ))
+    return [row for row in rows if (row[1], row[2]) not in existing]
+
+def _due_event_rows(since, now, offset):
+    """(user_id, event_id, fire_time, occurrence_start) of the one-off events and occurrences whose reminder came due."""
+    window = timedelta(minutes=offset)
+    query = db.session.query(Event.id, Event.user_id, Event.start_time).filter(
+        Event.rrule.is_(None),
+        Event.start_time > since + window,
+        Event.start_time <= now + window,
+        _rule_applies(Event.user_id, 'event', offset),
+        _not_materialized('event', Event.id, Event.updated_at, offset)
+    )
+    rows = [(user_id, event_id, start_time - window, None) for event_id, user_id, start_time in query]
+    return _drop_existing('event', offset, rows) + _due_occurrence_rows(since, now, offset)
+
+def _due_occurrence_rows(since, now, offset):
+    """
+    The same for recurring events: each occurrence starting in the window is
+    reminded of, cancelled ones are not, moved ones at their new time. A
+    series has many delivery rows, so only (item, offset, fire time) dedupes them.
+    """
+    window = timedelta(minutes=offset)
+    series = Event.query.filter(
+        Event.rrule.isnot(None),
+        Event.start_time <= now + window,
+        Event.recurrence_end > since + window,
+        _rule_applies(Event.user_id, 'event', offset)
+    )
+    rows = [(event.user_id, event.id, occurrence.start_time - window, occurrence.start_time)
+            for event in series for occurrence in expand_event(event, since + window, now + window, cache=False)
+            if since + window < occurrence.start_time <= now + window]
+    return _drop_existing('event', offset, rows)
+
+def _due_task_rows(since, now, offset):
+    spread_minutes = current_app.config.get('REMINDER_SPREAD_MINUTES', DEFAULT_SPREAD_MINUTES)
+    window = timedelta(minutes=offset)
+    first_day = (since - window - timedelta(minutes=spread_minutes)).date()
+    query = db.session.query(Task.id, Task.user_id, Task.due_date).filter(
+        Task.due_date >= first_day,
+        Task.due_date <= (now - window).date(),
+        Task.status != 'completed',
+        _rule_applies(Task.user_id, 'task', offset),
+        _not_materialized('task', Task.id, Task.updated_at, offset)
+    )
+    rows = []
+    for task_id, user_id, due_date in query:
+        fire_time = datetime.combine(due_date, time(0, 0)) + window + user_offset(user_id, spread_minutes)
+        if since < fire_time <= now:
+            rows.append((user_id, task_id, fire_time))
+    return _drop_existing('task', offset, rows)
+
+def materialize_due_reminders(now=None, lookback_minutes=None):
+    """
+    Evaluates every reminder rule against events and tasks and inserts a
+    pending delivery row for each (item, offset, fire time) that has come due
+    (within the lookback window) and has no row yet. Runs one range query over
+    Event.start_time / Task.due_date per distinct offset and commits.
+    Recurring events are expanded over the same window, one row per occurrence.
+    Returns the number of rows created.
+    """
+    now = now or datetime.utcnow()
+    if lookback_minutes is None:
+        lookback_minutes = current_app.config.get('REMINDER_RULES_LOOKBACK_MINUTES', DEFAULT_LOOKBACK_MINUTES)
+    since = now - timedelta(minutes=lookback_minutes)
+
+    rows = []
+    for offset in _offsets_in_use('event'):
+        rows.extend({'user_id': user_id, 'item_type': 'event', 'item_id': item_id, 'event_id': item_id, 'task_id': None,
+                     'reminder_time': fire_time, 'occurrence_start': occurrence_start, 'offset_minutes': offset}
+                    for user_id, item_id, fire_time, occurrence_start in _due_event_rows(since, now, offset))
+    for offset in _offsets_in_use('task'):
+        rows.extend({'user_id': user_id, 'item_type': 'task', 'item_id': item_id, 'event_id': None, 'task_id': item_id,
+                     'reminder_time': fire_time, 'occurrence_start': None, 'offset_minutes': offset}
+                    for user_id, item_id, fire_time in _due_task_rows(since, now, offset))
+    if not rows:
+        db.session.rollback() # End the read transaction
+        return 0
+    methods = dict(db.session.query(User.id, User.notification_method).filter(
+        User.id.in_({row['user_id'] for row in rows})))
+    for row in rows:
+        row['notification_method'] = methods.get(row['user_id'], 'email')
+
+    try:
+        db.session.execute(Reminder.__table__.insert(), rows)
+        db.session.commit()
+    except IntegrityError:
+        # Another dispatcher materialized some of these first; its rows win.
+        db.session.rollback()
+        current_app.logger.info("Reminder rows were materialized concurrently; skipping this pass.")
+        return 0
+    return len(rows)
@@ -0,0 +1,257 @@
+from flask import current_app
+from .reminder_policy import retry_delay
+from .reminder_renderer import get_renderer, reminder_subject
+from urllib.parse import urlsplit
+import http.client
+import hashlib
+import hmac
+import ipaddress
+import json
+import socket
+import ssl
+import threading
+import time
+
+DEFAULT_TIMEOUT_SECONDS = 10
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 4
+DEFAULT_ATTEMPTS = 3 # Tries per POST before the reminder is handed to the dispatcher's retry schedule
+DEFAULT_RETRY_BASE_SECONDS = 0.5
+DEFAULT_RETRY_MAX_SECONDS = 5
+
+# Errors that mean the HTTP connection is gone; a reused keep-alive connection is retried once at no cost.
+CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest, BrokenPipeError, ConnectionResetError)
+
+class WebhookError(Exception):
+    """A webhook POST that failed; `transient` tells the dispatcher whether a later retry may succeed."""
+
+    def __init__(self, message, status=None, transient=False):
+        super().__init__(message)
+        self.status = status
+        self.transient = transient
+
+def _is_transient_status(status):
+    return status == 429 or status >= 500
+
+def webhook_policy():
+    """
+    (allow_http, allow_private) from the config. Plain http is only accepted
+    in debug mode or with WEBHOOK_ALLOW_HTTP; internal addresses only with
+    WEBHOOK_ALLOW_PRIVATE_HOSTS.
+    """
+    config = current_app.config
+    return (current_app.debug or bool(config.get('WEBHOOK_ALLOW_HTTP', False)),
+            bool(config.get('WEBHOOK_ALLOW_PRIVATE_HOSTS', False)))
+
+def public_addresses(host, port):
+    """
+    Resolves `host` and returns its addresses, raising WebhookError if any of
+    them is loopback, private, link-local (e.g. 169.254.169.254) or otherwise
+    not a public unicast address, so users can't make the server POST to internal hosts.
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError) as e:
+        raise WebhookError(f"Cannot resolve webhook host {host}: {e}", transient=True)
+    addresses = []
+    for *_, sockaddr in infos:
+        address = ipaddress.ip_address(sockaddr[0].split('%')[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise WebhookError(f"Webhook host {host} resolves to a non-public address ({address})")
+        addresses.append(str(address))
+    return addresses
+
+def check_webhook_url(url, allow_http=False, allow_private=False):
+    """Returns urlsplit(url) if the server may POST to it; raises WebhookError otherwise."""
+    parts = urlsplit(url)
+    try:
+        port = parts.port
+    except ValueError:
+        port = -1
+    if parts.scheme not in ('http', 'https') or not parts.hostname or port == -1:
+        raise WebhookError(f"Invalid webhook URL: {url}")
+    if parts.scheme != 'https' and not allow_http:
+        raise WebhookError("The webhook URL must use https://.")
+    if not allow_private:
+        public_addresses(parts.hostname, port or (443 if parts.scheme == 'https' else 80))
+    return parts
+
+def _public_socket(connection):
+    """A TCP socket to a public address of the connection's host, resolved and checked now."""
+    address = public_addresses(connection.host, connection.port)[0]
+    sock = socket.create_connection((address, connection.port), connection.timeout, connection.source_address)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTPConnection for untrusted hosts: every connect() resolves and checks
+    the host again and opens the socket to the checked address, so a DNS
+    answer that changes after validation can't reach an internal host.
+    """
+
+    def connect(self):
+        self.sock = _public_socket(self)
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    """PublicHTTPConnection over TLS; the certificate is still verified against the host name."""
+
+    def __init__(self, host, port=None, timeout=DEFAULT_TIMEOUT_SECONDS, ssl_context=None):
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        super().__init__(host, port, timeout=timeout, context=self.ssl_context)
+
+    def connect(self):
+        self.sock = self.ssl_context.wrap_socket(_public_socket(self), server_hostname=self.host)
+
+def webhook_payload(user, entries):
+    """The JSON body for one POST: the user and a list of their due (reminder, item) pairs."""
+    links = get_renderer().links()
+    reminders = []
+    for reminder, item in entries:
+        entry = {
+            'reminder_id': reminder.id,
+            'item_type': reminder.item_type,
+            'item_id': reminder.item_id,
+            'title': reminder_subject(reminder.item_type, item),
+            'reminder_time': reminder.reminder_time.isoformat(),
+        }
+        if reminder.item_type == 'event':
+            entry.update(start_time=item.start_time.isoformat(), url=links['calendar_url'])
+        else:
+            entry.update(due_date=item.due_date.isoformat() if item.due_date else None, url=links['tasks_url'])
+        reminders.append(entry)
+    return {'user': {'id': user.id, 'username': user.username}, 'reminders': reminders}
+
+class WebhookConnectionPool:
+    """
+    Keep-alive HTTP(S) connections to webhook endpoints, shared by many threads.
+
+    Idle connections are kept per (scheme, host, port) and handed out again,
+    so a batch of POSTs to one host costs one TCP/TLS handshake. At most
+    `max_per_host` requests run against the same host at once; more callers
+    wait for a slot. Failed POSTs are retried with capped exponential backoff
+    and jitter; 429 and 5xx replies and network errors count as transient.
+    `connections_opened` counts real connections. Unless webhook_policy()
+    allows it, only https URLs are accepted and every connection is checked
+    to go to a public address.
+    """
+
+    def __init__(self, max_per_host=None, timeout=None, attempts=None, retry_base_seconds=None,
+                 retry_max_seconds=None, secret=None, sleep=time.sleep):
+        config = current_app.config
+        self.max_per_host = max_per_host or config.get('WEBHOOK_MAX_CONNECTIONS_PER_HOST', DEFAULT_MAX_CONNECTIONS_PER_HOST)
+        self.timeout = timeout or config.get('WEBHOOK_TIMEOUT_SECONDS', DEFAULT_TIMEOUT_SECONDS)
+        self.attempts = attempts or config.get('WEBHOOK_ATTEMPTS', DEFAULT_ATTEMPTS)
+        self.retry_base_seconds = retry_base_seconds or config.get('WEBHOOK_RETRY_BASE_SECONDS', DEFAULT_RETRY_BASE_SECONDS)
+        self.retry_max_seconds = retry_max_seconds or config.get('WEBHOOK_RETRY_MAX_SECONDS', DEFAULT_RETRY_MAX_SECONDS)
+        self.secret = secret if secret is not None else config.get('WEBHOOK_SECRET')
+        self.allow_http, self.allow_private = webhook_policy()
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._idle = {} # host key -> [HTTPConnection]
+        self._slots = {} # host key -> BoundedSemaphore
+        self.connections_opened = 0
+
+    def _slot(self, key):
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return slot
+
+    def _checkout(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, host, port = key
+        if self.allow_private:
+            connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        else:
+            connection_class = PublicHTTPSConnection if scheme == 'https' else PublicHTTPConnection
+        connection = connection_class(host, port, timeout=self.timeout)
+        with self._lock:
+            self.connections_opened += 1
+        return connection, False
+
+    def _checkin(self, key, connection):
+        with self._lock:
+            self._idle.setdefault(key, []).append(connection)
+
+    def _checkout_new(self, key):
+        with self._lock:
+            stale = self._idle.pop(key, []) # Its idle siblings were probably closed by the server too
+        for connection in stale:
+            connection.close()
+        return self._checkout(key)
+
+    def _headers(self, body):
+        headers = {'Content-Type': 'application/json', 'User-Agent': 'JupyAgenda-Webhook/1.0'}
+        if self.secret:
+            signature = hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+            headers['X-Jupy-Signature'] = f'sha256={signature}'
+        return headers
+
+    def _post_once(self, key, path, body):
+        connection, reused = self._checkout(key)
+        try:
+            try:
+                connection.request('POST', path, body=body, headers=self._headers(body))
+                response = connection.getresponse()
+            except CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                # The server closed an idle keep-alive connection; open a fresh one.
+                connection.close()
+                connection, reused = self._checkout_new(key)
+                connection.request('POST', path, body=body, headers=self._headers(body))
+                response = connection.getresponse()
+            response.read() # Drain the body so the connection can be reused
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._checkin(key, connection)
+        return response.status
+
+    def post_json(self, url, payload):
+        """
+        POSTs `payload` as JSON to `url`, retrying transient failures up to
+        `attempts` times. Returns the HTTP status of the 2xx reply; raises
+        WebhookError otherwise.
+        """
+        parts = check_webhook_url(url, allow_http=self.allow_http, allow_private=True) # Addresses are checked per connection
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        body = json.dumps(payload).encode()
+
+        for attempt in range(1, self.attempts + 1):
+            try:
+                with self._slot(key):
+                    status = self._post_once(key, path, body)
+            except WebhookError as e:
+                error = e
+            except (OSError, http.client.HTTPException) as e:
+                error = WebhookError(f"Webhook POST to {parts.hostname} failed: {e}", transient=True)
+            else:
+                if 200 <= status < 300:
+                    return status
+                error = WebhookError(f"Webhook POST to {parts.hostname} returned HTTP {status}", status=status,
+                                     transient=_is_transient_status(status))
+            if not error.transient or attempt == self.attempts:
+                raise error
+            self._sleep(retry_delay(attempt, self.retry_base_seconds, self.retry_max_seconds).total_seconds())
+
+    def close(self):
+        """Closes every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                try:
+                    connection.close()
+                except OSError:
+                    pass
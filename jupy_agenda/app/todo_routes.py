@@ -3,6 +3,8 @@ from flask_login import login_required, current_user
 from .forms import TaskForm
 from .models import Task, Reminder # Ensure Reminder is imported
 from . import db
+from .services.reminder_policy import task_reminder_time
+from .services.reminder_rules import rules_enabled
 from datetime import date, datetime, time, timedelta # Ensure datetime, time, timedelta are imported
 
 todo_bp = Blueprint('todo', __name__)
@@ -86,23 +88,28 @@ def _update_task_reminder(task):
     """
     Deletes existing pending reminders for a task and creates a new one
     if the task's due_date is set and in the future.
-    Reminder is set for 9 AM on the due_date.
+    Reminder is set for 9 AM on the due_date, plus a per-user offset
+    (see reminder_policy) so the dispatcher is not hit by a single spike.
+    Does nothing in rules mode: reminders are then computed at dispatch time.
     """
+    if rules_enabled():
+        return
     try:
         # Delete existing pending reminders for this task
         Reminder.query.filter_by(user_id=task.user_id, item_type='task', item_id=task.id, sent_status='pending').delete()
 
         if task.due_date and task.due_date >= date.today() + timedelta(days=0): # Only if task due_date is today or in future
-            # Combine due_date with 9 AM to create reminder_datetime
-            reminder_datetime = datetime.combine(task.due_date, time(9, 0, 0)) # 9 AM on due_date
+            # 9 AM on due_date, shifted by the user's spread offset
+            reminder_datetime = task_reminder_time(task.user_id, task.due_date)
             
             if reminder_datetime > datetime.utcnow(): # Ensure reminder time itself is in the future
                 new_reminder = Reminder(
                     user_id=task.user_id,
                     item_type='task',
                     item_id=task.id,
+                    task_id=task.id,
                     reminder_time=reminder_datetime,
-                    notification_method='email' # Default
+                    notification_method=task.user.notification_method # The user's channel
                 )
                 db.session.add(new_reminder)
                 current_app.logger.info(f"Created reminder for task {task.id} at {reminder_datetime}")
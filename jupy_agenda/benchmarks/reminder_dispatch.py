@@ -0,0 +1,218 @@
+"""
+Benchmark: end-to-end send-reminders throughput against a local SMTP sink.
+
+Seeds --users users with --reminders-per-user due reminders each (alternating
+events and tasks) in a throwaway SQLite file, starts an aiosmtpd sink and
+runs the same path as `flask send-reminders` (materialize when rules are on,
+count, dispatch; plus drain-outbox for the outbox backend). The report holds
+wall time, SQL statements executed, SMTP connections, messages the sink
+accepted and the memory high-water mark, as JSON so two commits can be compared:
+
+    python -m jupy_agenda.benchmarks.reminder_dispatch --users 200 --reminders-per-user 5 --output before.json
+    git checkout other-branch
+    python -m jupy_agenda.benchmarks.reminder_dispatch --users 200 --reminders-per-user 5 --compare before.json
+
+Needs aiosmtpd (and aiosmtplib for --backend async).
+"""
+from jupy_agenda.app import create_app, db
+from jupy_agenda.app.models import User, Event, Task, Reminder
+from jupy_agenda.app.services.reminder_dispatcher import dispatch_due_reminders, count_claimable_reminders
+from jupy_agenda.app.services.reminder_rules import rules_enabled, materialize_due_reminders
+from jupy_agenda.app.services.outbox import drain_outbox
+from jupy_agenda.benchmarks.reminder_spike import BenchmarkConfig
+from jupy_agenda.tests.smtp_sink import SMTPSink
+from sqlalchemy import event as sa_event
+from datetime import datetime, date, timedelta
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError: # Windows; the RSS high-water mark is then not reported
+    resource = None
+
+SEED_CHUNK = 5000 # Rows per executemany while seeding
+
+def seed(users, reminders_per_user):
+    """
+    Inserts `users` users and, for each, `reminders_per_user` reminders already
+    due, alternating between an event and a task. Uses Core executemany so
+    seeding a large backlog stays cheap next to the dispatch being measured.
+    """
+    now = datetime.utcnow()
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'bench{i}', 'email': f'bench{i}@example.com', 'password_hash': 'x', 'notification_method': 'email'}
+        for i in range(users)
+    ])
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+    event_count = (reminders_per_user + 1) // 2
+    task_count = reminders_per_user // 2
+
+    start = now + timedelta(hours=1)
+    events = [{'user_id': user_id, 'title': f'Benchmark event {n}', 'start_time': start, 'end_time': start + timedelta(hours=1),
+               'created_at': now, 'updated_at': now}
+              for user_id in user_ids for n in range(event_count)]
+    tasks = [{'user_id': user_id, 'description': f'Benchmark task {n}', 'due_date': date.today(), 'created_at': now,
+              'updated_at': now}
+             for user_id in user_ids for n in range(task_count)]
+    for rows, table in ((events, Event.__table__), (tasks, Task.__table__)):
+        for offset in range(0, len(rows), SEED_CHUNK):
+            db.session.execute(table.insert(), rows[offset:offset + SEED_CHUNK])
+
+    due = now - timedelta(minutes=1)
+    reminders = [{'user_id': user_id, 'item_type': 'event', 'item_id': event_id, 'event_id': event_id, 'task_id': None,
+                  'reminder_time': due, 'notification_method': 'email', 'sent_status': 'pending', 'attempts': 0}
+                 for event_id, user_id in db.session.query(Event.id, Event.user_id)]
+    reminders += [{'user_id': user_id, 'item_type': 'task', 'item_id': task_id, 'event_id': None, 'task_id': task_id,
+                   'reminder_time': due, 'notification_method': 'email', 'sent_status': 'pending', 'attempts': 0}
+                  for task_id, user_id in db.session.query(Task.id, Task.user_id)]
+    for offset in range(0, len(reminders), SEED_CHUNK):
+        db.session.execute(Reminder.__table__.insert(), reminders[offset:offset + SEED_CHUNK])
+    db.session.commit()
+    return len(reminders)
+
+class QueryCounter:
+    """Counts SQL statements sent to an engine while active (an executemany counts once)."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        sa_event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        sa_event.remove(self.engine, 'before_cursor_execute', self._count)
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1) # Bytes on macOS, KiB elsewhere
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def send_reminders_path(backend, concurrency, batch_size):
+    """What `flask send-reminders` does, plus `flask drain-outbox` for the outbox backend."""
+    if rules_enabled():
+        materialize_due_reminders()
+    if not count_claimable_reminders():
+        return {}
+    stats = dispatch_due_reminders(batch_size=batch_size, concurrency=concurrency, backend=backend)
+    if backend == 'outbox':
+        drained = drain_outbox()
+        stats['sent'] += drained['sent']
+        stats['error'] += drained['error']
+        stats['connections'] += drained['connections']
+    return stats
+
+def run_benchmark(users, reminders_per_user, backend='smtp', concurrency=1, batch_size=None, trace_memory=False):
+    """Seeds a fresh database, runs the send-reminders path once against an SMTP sink and returns the report dict."""
+    with tempfile.TemporaryDirectory(prefix='jupy_benchmark_') as directory, SMTPSink() as sink:
+        class Config(BenchmarkConfig):
+            # A file, not :memory:, so worker threads share the database
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(directory, 'benchmark.db')}"
+            MAIL_SUPPRESS_SEND = False
+            MAIL_SERVER = sink.host
+            MAIL_PORT = sink.port
+            UPLOAD_FOLDER = os.path.join(directory, 'uploads')
+
+        app = create_app(config_class=Config)
+        with app.app_context():
+            db.create_all()
+            seeded = seed(users, reminders_per_user)
+            db.session.remove()
+
+            if trace_memory:
+                tracemalloc.start()
+            with QueryCounter(db.engine) as queries:
+                started = time.perf_counter()
+                stats = send_reminders_path(backend, concurrency, batch_size)
+                wall_seconds = time.perf_counter() - started
+            python_peak = None
+            if trace_memory:
+                python_peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            left = Reminder.query.filter(Reminder.sent_status != 'sent').count()
+            db.session.remove()
+            db.drop_all()
+            db.engine.dispose()
+
+        return {
+            'benchmark': 'reminder_dispatch',
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'params': {'users': users, 'reminders_per_user': reminders_per_user, 'backend': backend,
+                       'concurrency': concurrency, 'batch_size': batch_size or app.config.get('REMINDER_BATCH_SIZE', 500)},
+            'reminders': seeded,
+            'sent': stats.get('sent', 0),
+            'not_sent': left,
+            'wall_seconds': round(wall_seconds, 3),
+            'reminders_per_second': round(seeded / wall_seconds, 1) if wall_seconds else None,
+            'queries': queries.count,
+            'queries_per_reminder': round(queries.count / seeded, 3) if seeded else None,
+            'smtp_connections': stats.get('connections', 0),
+            'smtp_messages': len(sink.envelopes),
+            'batches': stats.get('batches', 0),
+            'render_ms': round(stats.get('render_ms', 0.0), 3),
+            'python_peak_mb': round(python_peak / (1024 * 1024), 1) if python_peak is not None else None,
+            'max_rss_mb': _max_rss_mb(),
+        }
+
+COMPARED = ('wall_seconds', 'reminders_per_second', 'queries', 'smtp_connections', 'python_peak_mb', 'max_rss_mb')
+
+def compare(baseline, report):
+    """Lines showing each COMPARED figure of `report` next to `baseline` with the relative change."""
+    lines = [f"{'metric':<22}{'baseline':>12}{'current':>12}{'change':>9}"]
+    for key in COMPARED:
+        before, after = baseline.get(key), report.get(key)
+        change = f'{(after - before) / before * 100:+.1f}%' if before and after is not None else '-'
+        lines.append(f"{key:<22}{before if before is not None else '-':>12}{after if after is not None else '-':>12}{change:>9}")
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--reminders-per-user', type=int, default=5)
+    parser.add_argument('--backend', choices=['smtp', 'async', 'outbox'], default='smtp')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Also report the Python heap peak (tracemalloc; slows the run down)')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--compare', help='A previous JSON report to compare against')
+    args = parser.parse_args()
+
+    if not SMTPSink.available:
+        parser.error('aiosmtpd is required (pip install aiosmtpd)')
+    report = run_benchmark(args.users, args.reminders_per_user, args.backend, args.concurrency, args.batch_size,
+                           args.trace_memory)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != report['params']:
+            print('Warning: the baseline was run with different parameters.', file=sys.stderr)
+        print('\n'.join(compare(baseline, report)))
+
+if __name__ == '__main__':
+    main()
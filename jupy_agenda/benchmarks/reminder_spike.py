@@ -0,0 +1,112 @@
+"""
+Benchmark: peak sends per second for the daily task-reminder spike.
+
+Seeds one task reminder per user, all due "now" (like 09:00 today), and runs
+the real dispatcher in a daemon-style loop (sharing one TokenBucket) against
+an in-memory database with mail suppressed. Three scenarios are compared:
+
+    spike          every reminder at the same second, no send-rate limit
+    spike+bucket   same spike, MAIL_MAX_SEND_RATE with MAIL_RATE_OVERFLOW='defer'
+    spread         reminders spread per user over --spread-seconds, no limit
+
+Usage (from the repository root):
+    python -m jupy_agenda.benchmarks.reminder_spike --users 1000 --rate 100
+"""
+from jupy_agenda.app import create_app, db
+from jupy_agenda.app.models import User, Task, Reminder
+from jupy_agenda.app.services.reminder_dispatcher import dispatch_due_reminders
+from jupy_agenda.app.services.reminder_policy import user_offset
+from jupy_agenda.app.services.rate_limit import TokenBucket
+from flask_mail import email_dispatched
+from collections import Counter
+from datetime import datetime, date, timedelta
+import argparse
+import json
+import time
+
+class BenchmarkConfig:
+    TESTING = True
+    SECRET_KEY = 'benchmark'
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    MAIL_SUPPRESS_SEND = True
+    MAIL_DEFAULT_SENDER = 'benchmark@jupy.agenda'
+    SERVER_NAME = 'localhost' # Email templates build absolute URLs outside a request
+    UPLOAD_FOLDER = '/tmp/jupy_benchmark_uploads'
+
+def seed(users, spread_seconds):
+    """Creates `users` users with one task each and a reminder due from one second from now."""
+    start = datetime.utcnow() + timedelta(seconds=1)
+    db.session.add_all([User(username=f'bench{i}', email=f'bench{i}@example.com', password_hash='x') for i in range(users)])
+    db.session.commit()
+    user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+    db.session.add_all([Task(user_id=user_id, description='Benchmark task', due_date=date.today()) for user_id in user_ids])
+    db.session.commit()
+    db.session.add_all([
+        Reminder(user_id=task.user_id, item_type='task', item_id=task.id, task_id=task.id,
+                 reminder_time=start + user_offset(task.user_id, spread_seconds / 60))
+        for task in Task.query
+    ])
+    db.session.commit()
+
+def run_scenario(name, users, rate, spread_seconds, poll_interval, timeout):
+    app = create_app(config_class=BenchmarkConfig)
+    app.config['MAIL_RATE_OVERFLOW'] = 'defer'
+    send_seconds = Counter()
+
+    def record(app, message):
+        send_seconds[int(time.monotonic())] += 1
+
+    with app.app_context():
+        db.create_all()
+        seed(users, spread_seconds)
+        email_dispatched.connect(record)
+        totals = Counter()
+        rate_limiter = TokenBucket(rate) # One bucket for the whole run, as in the daemon
+        started = time.monotonic()
+        try:
+            while time.monotonic() - started < timeout:
+                stats = dispatch_due_reminders(rate_limiter=rate_limiter)
+                totals.update(stats)
+                db.session.remove()
+                if not Reminder.query.filter(Reminder.sent_status.in_(['pending', 'claimed'])).count():
+                    break
+                time.sleep(poll_interval)
+        finally:
+            email_dispatched.disconnect(record)
+            db.drop_all()
+
+    return {
+        'scenario': name,
+        'users': users,
+        'sent': totals['sent'],
+        'deferred': totals['deferred'],
+        'errors': totals['error'],
+        'peak_sends_per_second': max(send_seconds.values(), default=0),
+        'drain_seconds': round(time.monotonic() - started, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=100, help='MAIL_MAX_SEND_RATE for the bucket scenario')
+    parser.add_argument('--spread-seconds', type=float, default=10, help='Per-user spread window for the spread scenario')
+    parser.add_argument('--poll-interval', type=float, default=0.2)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    results = [
+        run_scenario('spike', args.users, 0, 0, args.poll_interval, args.timeout),
+        run_scenario('spike+bucket', args.users, args.rate, 0, args.poll_interval, args.timeout),
+        run_scenario('spread', args.users, 0, args.spread_seconds, args.poll_interval, args.timeout),
+    ]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'scenario':<14}{'sent':>8}{'deferred':>10}{'errors':>8}{'peak/s':>8}{'drain s':>9}")
+    for r in results:
+        print(f"{r['scenario']:<14}{r['sent']:>8}{r['deferred']:>10}{r['errors']:>8}{r['peak_sends_per_second']:>8}{r['drain_seconds']:>9}")
+
+if __name__ == '__main__':
+    main()
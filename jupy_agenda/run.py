@@ -1,91 +1,217 @@
 from dotenv import load_dotenv
 load_dotenv()
 from jupy_agenda.app import create_app, db
-from jupy_agenda.app.models import Reminder, Event, Task, User # Import models for context
-from jupy_agenda.app.services.notification_service import send_email_reminder
+from jupy_agenda.app.models import User
+from jupy_agenda.app.services.reminder_dispatcher import dispatch_due_reminders, count_claimable_reminders
+from jupy_agenda.app.services.reminder_daemon import run_reminder_daemon
+from jupy_agenda.app.services.outbox import drain_outbox, count_outbox
+from jupy_agenda.app.services.reminder_rules import rules_enabled, materialize_due_reminders
+from jupy_agenda.app.services.reminder_maintenance import backfill_reminder_links, archive_reminders, rebuild_reminders
+from jupy_agenda.app.services.reminder_metrics import get_metrics
+from jupy_agenda.app.services.reminder_logging import configure_reminder_logging
+from jupy_agenda.app.services.ical_import import import_ics
 import os
+import signal
+import threading
 import click # For Flask CLI
-from datetime import datetime
+import json
+from datetime import timedelta
 import sys # For test runner
 import unittest # For test runner
 
 # Create the Flask app using the factory function
 app = create_app()
 
+def _structured_logging():
+    """JSON, queue-backed logging for the reminder commands; REMINDER_LOG_FORMAT='text' keeps Flask's default handler."""
+    if app.config.get('REMINDER_LOG_FORMAT', 'json') == 'json':
+        configure_reminder_logging(app)
+
 # Flask CLI command to send reminders
 @app.cli.command("send-reminders")
-def send_reminders_command():
+@click.option('--batch-size', type=int, default=None,
+              help='Reminders processed per chunk (defaults to REMINDER_BATCH_SIZE, 500).')
+@click.option('--worker-id', default=None,
+              help='Name recorded on claimed reminders (defaults to hostname:pid).')
+@click.option('--concurrency', type=int, default=None,
+              help='Threads rendering and sending emails in parallel (defaults to REMINDER_CONCURRENCY, 1).')
+@click.option('--backend', type=click.Choice(['smtp', 'async', 'outbox']), default=None,
+              help="Delivery engine: blocking Flask-Mail ('smtp'), pooled aiosmtplib ('async') or spool to the outbox table for drain-outbox ('outbox'). Defaults to REMINDER_DELIVERY_BACKEND.")
+@click.option('--digest-window', type=int, default=None,
+              help="Merge a user's reminders due within this many minutes into one email (defaults to REMINDER_DIGEST_WINDOW_MINUTES, 0 = off).")
+@click.option('--stats-json', is_flag=True, default=False,
+              help='Print the run statistics and pipeline metrics (dispatch lag and send latency percentiles, throughput, errors by cause) as JSON.')
+def send_reminders_command(batch_size, worker_id, concurrency, backend, digest_window, stats_json):
     """
     Processes and sends pending reminders.
     This command should be run periodically by a scheduler (e.g., cron).
+    Due reminders are handled in chunks: users and items are preloaded with a
+    few IN (...) queries per chunk and statuses are committed once per chunk.
+    Chunks are claimed with a lease, so several instances may run at once.
     """
+    _structured_logging()
     with app.app_context(): # Ensure app context for db and mail
-        current_time = datetime.utcnow()
-        pending_reminders = Reminder.query.filter(
-            Reminder.reminder_time <= current_time,
-            Reminder.sent_status == 'pending'
-        ).order_by(Reminder.reminder_time).all()
+        materialized = 0
+        if rules_enabled():
+            # Rules mode: turn the rules that have come due into delivery rows first
+            materialized = materialize_due_reminders()
+            app.logger.info(f"Materialized {materialized} reminders from reminder rules.")
+        pending_count = count_claimable_reminders()
 
-        if not pending_reminders:
+        if not pending_count:
+            if stats_json:
+                click.echo(json.dumps({'stats': None, 'metrics': get_metrics(app).snapshot()}))
+                return
             click.echo("No pending reminders to send.")
             app.logger.info("No pending reminders to send.")
             return
 
-        click.echo(f"Found {len(pending_reminders)} pending reminders. Processing...")
-        app.logger.info(f"Found {len(pending_reminders)} pending reminders. Processing...")
-        
-        sent_count = 0
-        error_count = 0
+        if not stats_json:
+            click.echo(f"Found {pending_count} pending reminders. Processing...")
 
-        for reminder in pending_reminders:
-            click.echo(f"Processing reminder ID: {reminder.id} for item {reminder.item_type} {reminder.item_id}...")
-            app.logger.info(f"Processing reminder ID: {reminder.id} for item {reminder.item_type} {reminder.item_id}...")
-            try:
-                # Ensure the related item and user still exist
-                related_item = None
-                if reminder.item_type == 'event':
-                    related_item = Event.query.get(reminder.item_id)
-                elif reminder.item_type == 'task':
-                    related_item = Task.query.get(reminder.item_id)
-                
-                user = User.query.get(reminder.user_id)
-
-                if not related_item:
-                    click.echo(f"  Item {reminder.item_type} {reminder.item_id} for reminder {reminder.id} not found. Marking as error.")
-                    app.logger.warning(f"Item {reminder.item_type} {reminder.item_id} for reminder {reminder.id} not found. Marking as error.")
-                    reminder.sent_status = 'error'
-                    reminder.updated_at = datetime.utcnow()
-                    db.session.commit()
-                    error_count += 1
-                    continue
-                
-                if not user:
-                    click.echo(f"  User {reminder.user_id} for reminder {reminder.id} not found. Marking as error.")
-                    app.logger.warning(f"User {reminder.user_id} for reminder {reminder.id} not found. Marking as error.")
-                    reminder.sent_status = 'error'
-                    reminder.updated_at = datetime.utcnow()
-                    db.session.commit()
-                    error_count += 1
-                    continue
-
-                if send_email_reminder(reminder.id):
-                    click.echo(f"  Successfully sent reminder ID: {reminder.id}")
-                    app.logger.info(f"Successfully sent reminder ID: {reminder.id}")
-                    sent_count += 1
-                else:
-                    click.echo(f"  Failed to send reminder ID: {reminder.id}. Status set to 'error'.")
-                    app.logger.error(f"Failed to send reminder ID: {reminder.id}. Status already set to 'error' by send_email_reminder.")
-                    error_count += 1 # Status is updated in send_email_reminder
-            except Exception as e:
-                click.echo(f"  An unexpected error occurred processing reminder {reminder.id}: {e}")
-                app.logger.error(f"An unexpected error occurred processing reminder {reminder.id}: {e}", exc_info=True)
-                reminder.sent_status = 'error' # Ensure status is marked
-                reminder.updated_at = datetime.utcnow()
-                db.session.commit()
-                error_count += 1
-        
-        click.echo(f"Reminder processing complete. Sent: {sent_count}, Errors: {error_count}.")
-        app.logger.info(f"Reminder processing complete. Sent: {sent_count}, Errors: {error_count}.")
+        stats = dispatch_due_reminders(batch_size=batch_size, worker_id=worker_id, concurrency=concurrency,
+                                       backend=backend, digest_minutes=digest_window, materialize=False)
+        stats['materialized'] = materialized
+
+        if stats_json: # Machine-readable output only, so it can be piped into other tools
+            click.echo(json.dumps({'stats': stats, 'metrics': get_metrics(app).snapshot()}))
+            return
+
+        click.echo(f"Reminder processing complete. Sent: {stats['sent']}, Queued: {stats['queued']}, Errors: {stats['error']}, Retries: {stats['retry']}, Dead: {stats['dead']}, Deferred: {stats['deferred']}, Batches: {stats['batches']}, SMTP connections: {stats['connections']}, Avg render: {stats['render_ms']:.2f} ms/message.")
+
+
+@app.cli.command("reminder-daemon")
+@click.option('--poll-interval', type=float, default=None,
+              help='Seconds between checks for new or changed reminders (defaults to REMINDER_DAEMON_POLL_INTERVAL, 5).')
+@click.option('--batch-size', type=int, default=None,
+              help='Reminders processed per chunk when a dispatch pass runs.')
+def reminder_daemon_command(poll_interval, batch_size):
+    """
+    Long-running alternative to scheduling send-reminders with cron.
+    Keeps a min-heap of upcoming reminder times, sleeps until the next one is
+    due and picks up new reminders with a cheap "changed since" query.
+    Stops cleanly on Ctrl+C or SIGTERM.
+    """
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    _structured_logging()
+
+    with app.app_context():
+        click.echo("Reminder daemon running. Press Ctrl+C to stop.")
+        try:
+            run_reminder_daemon(poll_interval=poll_interval, stop_event=stop_event, batch_size=batch_size)
+        except KeyboardInterrupt:
+            stop_event.set()
+        click.echo("Reminder daemon stopped.")
+
+
+@app.cli.command("drain-outbox")
+@click.option('--batch-size', type=int, default=None,
+              help='Outbox messages claimed per chunk (defaults to OUTBOX_BATCH_SIZE, 200).')
+@click.option('--worker-id', default=None,
+              help='Name recorded on claimed outbox messages (defaults to hostname:pid).')
+def drain_outbox_command(batch_size, worker_id):
+    """
+    Sends the emails spooled by send-reminders --backend outbox.
+    Run it from cron (or a loop) next to send-reminders; several instances may run at once.
+    """
+    _structured_logging()
+    with app.app_context():
+        waiting = count_outbox()
+        if not waiting:
+            click.echo("Outbox is empty.")
+            return
+
+        click.echo(f"Found {waiting} messages in the outbox. Sending...")
+        stats = drain_outbox(batch_size=batch_size, worker_id=worker_id)
+        click.echo(f"Outbox drained. Sent: {stats['sent']}, Errors: {stats['error']}, Retries: {stats['retry']}, Dead: {stats['dead']}, Batches: {stats['batches']}, SMTP connections: {stats['connections']}.")
+        app.logger.info(f"Outbox drained. Sent: {stats['sent']}, Errors: {stats['error']}, Retries: {stats['retry']}, Dead: {stats['dead']}, Batches: {stats['batches']}, SMTP connections: {stats['connections']}.",
+                        extra=dict(stats, event='outbox_run'))
+
+
+@app.cli.command("backfill-reminder-links")
+@click.option('--batch-size', type=int, default=None,
+              help='Reminder ids updated per transaction (defaults to REMINDER_BACKFILL_BATCH_SIZE, 5000).')
+@click.option('--delete-orphans', is_flag=True, default=False,
+              help='Delete reminders whose event or task no longer exists.')
+def backfill_reminder_links_command(batch_size, delete_orphans):
+    """
+    Fills reminders.event_id / task_id for rows created before those columns existed.
+    Safe to run again: already linked rows are skipped.
+    """
+    with app.app_context():
+        stats = backfill_reminder_links(batch_size=batch_size, delete_orphans=delete_orphans)
+        click.echo(f"Linked {stats['events']} event reminders and {stats['tasks']} task reminders. Orphaned reminders {'deleted' if delete_orphans else 'found'}: {stats['orphans']}.")
+
+
+@app.cli.command("rebuild-reminders")
+@click.option('--user', 'user_id', type=int, default=None, help='Only rebuild the reminders of this user id.')
+@click.option('--batch-size', type=int, default=None,
+              help='Event/task ids per INSERT ... SELECT (defaults to REMINDER_REBUILD_BATCH_SIZE, 10000).')
+def rebuild_reminders_command(user_id, batch_size):
+    """
+    Recreates the pending reminders of all future events and due tasks from
+    the current reminder settings, e.g. after changing them or restoring a backup.
+    """
+    with app.app_context():
+        try:
+            stats = rebuild_reminders(user_id=user_id, batch_size=batch_size)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Rebuilt reminders. Events: {stats['events']}, Occurrences: {stats['occurrences']}, Tasks: {stats['tasks']}, Replaced: {stats['deleted']}, Batches: {stats['batches']}, "
+                   f"{stats['seconds']} s ({stats['rows_per_second']} rows/s).")
+
+
+def _parse_age(ctx, param, value):
+    """Click callback for ages like '30d', '12h' or '90m' (a bare number means days)."""
+    if value is None:
+        return None
+    units = {'d': 'days', 'h': 'hours', 'm': 'minutes'}
+    number, unit = (value[:-1], value[-1]) if value[-1:] in units else (value, 'd')
+    try:
+        return timedelta(**{units[unit]: float(number)})
+    except ValueError:
+        raise click.BadParameter("use a number followed by d, h or m, e.g. 30d")
+
+@app.cli.command("archive-reminders")
+@click.option('--older-than', callback=_parse_age, default=None,
+              help='Archive sent/error/dead reminders that finished longer ago than this, e.g. 30d or 12h (defaults to REMINDER_ARCHIVE_AFTER_DAYS, 30).')
+@click.option('--batch-size', type=int, default=None,
+              help='Reminders moved per transaction (defaults to REMINDER_ARCHIVE_BATCH_SIZE, 1000).')
+def archive_reminders_command(older_than, batch_size):
+    """
+    Moves finished reminders to the reminders_archive table and applies the
+    archive retention (REMINDER_ARCHIVE_RETENTION_DAYS). Run it daily from cron;
+    an interrupted run is resumed by the next one.
+    """
+    with app.app_context():
+        stats = archive_reminders(older_than=older_than, batch_size=batch_size)
+        click.echo(f"Archived {stats['archived']} reminders in {stats['batches']} batches. Purged from the archive: {stats['purged']}.")
+
+
+@app.cli.command("import-ics")
+@click.argument('ics_file', type=click.File('r', encoding='utf-8', errors='replace'))
+@click.option('--user', 'user_ref', required=True, help='Id or email of the user who gets the events.')
+@click.option('--batch-size', type=int, default=None,
+              help='Events per bulk INSERT and transaction (defaults to IMPORT_BATCH_SIZE, 500).')
+def import_ics_command(ics_file, user_ref, batch_size):
+    """
+    Imports the events of an iCalendar (.ics) file, e.g. a timetable export.
+    The file is read as a stream and written in bulk batches with their
+    reminders; importing the same file again skips events already there.
+    """
+    with app.app_context():
+        user = User.query.filter_by(email=user_ref).first() or (db.session.get(User, int(user_ref)) if user_ref.isdigit() else None)
+        if user is None:
+            raise click.ClickException(f"No user with id or email {user_ref}.")
+
+        def progress(stats):
+            click.echo(f"  batch {stats['batches']}: {stats['events']} events imported, {stats['reminders']} reminders", err=True)
+
+        stats = import_ics(ics_file, user.id, batch_size=batch_size, progress=progress)
+        click.echo(f"Imported {stats['events']} events ({stats['recurring']} recurring, {stats['exceptions']} changed occurrences) "
+                   f"and {stats['reminders']} reminders in {stats['seconds']} s ({stats['events_per_second']} events/s). "
+                   f"Skipped: {stats['skipped']}, invalid: {stats['invalid']}.")
 
 
 @app.cli.command("init-db")
@@ -59,5 +59,16 @@ class BaseTestCase(unittest.TestCase):
         # db.session.rollback() 
         pass
 
+    def clear_database(self):
+        """
+        Deletes every row, children first, so the next test starts from empty tables.
+        Call it from tearDown in test classes whose tests commit data.
+        """
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+        db.session.remove()
+
 if __name__ == '__main__':
     unittest.main()
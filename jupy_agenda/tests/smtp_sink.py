@@ -0,0 +1,70 @@
+import socket
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError: # aiosmtpd is optional; tests using the sink are skipped without it
+    Controller = None
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class _RecordingHandler:
+    """aiosmtpd handler that keeps every accepted envelope and counts SMTP sessions."""
+
+    def __init__(self):
+        self.envelopes = []
+        self.sessions = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.sessions += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.envelopes.append(envelope)
+        return '250 Message accepted for delivery'
+
+class SMTPSink:
+    """
+    Local SMTP server for tests and benchmarks.
+
+    Usage:
+        with SMTPSink() as sink:
+            app.config['MAIL_PORT'] = sink.port
+            ...
+            assert len(sink.envelopes) == 3
+    """
+
+    available = Controller is not None
+
+    def __init__(self, host='127.0.0.1', port=None):
+        self.host = host
+        self.port = port or _free_port()
+        self.handler = _RecordingHandler()
+        self._controller = None
+
+    @property
+    def envelopes(self):
+        return self.handler.envelopes
+
+    @property
+    def sessions(self):
+        return self.handler.sessions
+
+    def start(self):
+        self._controller = Controller(self.handler, hostname=self.host, port=self.port)
+        self._controller.start()
+        return self
+
+    def stop(self):
+        if self._controller is not None:
+            self._controller.stop()
+            self._controller = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
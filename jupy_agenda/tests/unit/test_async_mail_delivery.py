@@ -0,0 +1,85 @@
+import unittest
+from datetime import datetime, date, timedelta
+from flask_mail import Message
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.tests.smtp_sink import SMTPSink
+from jupy_agenda.app.models import User, Task, Reminder
+from jupy_agenda.app.services import async_mail_delivery, reminder_dispatcher
+from jupy_agenda.app.services.async_mail_delivery import AsyncSMTPDelivery
+from jupy_agenda.app import db, mail
+
+@unittest.skipUnless(SMTPSink.available and async_mail_delivery.aiosmtplib is not None,
+                     "aiosmtpd and aiosmtplib are required")
+class TestAsyncSMTPDelivery(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sink = SMTPSink().start()
+        self._saved_config = {key: self.app.config.get(key) for key in ('MAIL_SERVER', 'MAIL_PORT', 'MAIL_SUPPRESS_SEND')}
+        self.app.config.update(MAIL_SERVER=self.sink.host, MAIL_PORT=self.sink.port, MAIL_SUPPRESS_SEND=False)
+        mail.init_app(self.app)
+
+    def tearDown(self):
+        self.clear_database()
+        self.app.config.update(self._saved_config)
+        mail.init_app(self.app)
+        self.sink.stop()
+        super().tearDown()
+
+    def _keyed_messages(self, count):
+        return [(i, Message(f"Subject {i}", sender='test-noreply@jupy.agenda', recipients=[f'user{i}@example.com'], body='Body'))
+                for i in range(count)]
+
+    def test_pool_delivers_every_message(self):
+        engine = AsyncSMTPDelivery(self.app, pool_size=3)
+        try:
+            results = engine.deliver(self._keyed_messages(20))
+        finally:
+            engine.close()
+
+        self.assertEqual(results, {i: None for i in range(20)})
+        self.assertEqual(len(self.sink.envelopes), 20)
+        self.assertEqual(engine.connections_opened, 3)
+        self.assertEqual(self.sink.sessions, 3)
+
+    def test_connections_are_reused_across_calls_and_recycled(self):
+        engine = AsyncSMTPDelivery(self.app, pool_size=1, max_messages=4)
+        try:
+            engine.deliver(self._keyed_messages(3))
+            engine.deliver(self._keyed_messages(3))
+        finally:
+            engine.close()
+
+        self.assertEqual(len(self.sink.envelopes), 6)
+        self.assertEqual(engine.connections_opened, 2) # 4 messages on the first connection, 2 on the second
+
+    def test_unreachable_relay_reports_per_message_errors(self):
+        self.sink.stop()
+        engine = AsyncSMTPDelivery(self.app, pool_size=2)
+        try:
+            results = engine.deliver(self._keyed_messages(3))
+        finally:
+            engine.close()
+
+        self.assertEqual(set(results), {0, 1, 2})
+        self.assertTrue(all(error for error in results.values()))
+
+    def test_dispatcher_async_backend(self):
+        user = User(username='async_user', email='async@example.com')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        tasks = [Task(user_id=user.id, description=f"Async Task {i}", due_date=date.today()) for i in range(5)]
+        db.session.add_all(tasks)
+        db.session.commit()
+        db.session.add_all([Reminder(user_id=user.id, item_type='task', item_id=t.id,
+                                     reminder_time=datetime.utcnow() - timedelta(minutes=1)) for t in tasks])
+        db.session.commit()
+
+        with self.app.test_request_context():
+            stats = reminder_dispatcher.dispatch_due_reminders(backend='async')
+
+        self.assertEqual(stats['sent'], 5)
+        self.assertEqual(stats['error'], 0)
+        self.assertEqual(len(self.sink.envelopes), 5)
+        self.assertEqual(Reminder.query.filter_by(sent_status='sent').count(), 5)
@@ -0,0 +1,73 @@
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.app.models import User, Event
+from jupy_agenda.app.services.event_calendar import events_overlapping, bucket_by_day
+from jupy_agenda.app.services.recurrence import refresh_recurrence
+from jupy_agenda.app import db
+from flask import g
+from datetime import datetime, date
+
+class TestMonthView(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(username='calendar_user', email='calendar@example.com')
+        self.user.set_password('password')
+        db.session.add(self.user)
+        db.session.commit()
+        g.pop('_login_user', None) # The test app context outlives requests; don't reuse another test's user
+        self.client.post('/auth/login', data=dict(email='calendar@example.com', password='password'))
+
+    def tearDown(self):
+        self.clear_database()
+        super().tearDown()
+
+    def _event(self, title, start, end):
+        event = Event(user_id=self.user.id, title=title, start_time=start, end_time=end)
+        db.session.add(event)
+        db.session.commit()
+        return event
+
+    def test_overlapping_events_are_bucketed_on_every_day_they_cover(self):
+        trip = self._event('Trip', datetime(2024, 2, 27, 9), datetime(2024, 3, 3, 18)) # Starts in February
+        night = self._event('Night shift', datetime(2024, 3, 10, 22), datetime(2024, 3, 11, 0)) # Ends at midnight
+        self._event('Last year', datetime(2023, 3, 5, 9), datetime(2023, 3, 5, 10))
+        april = self._event('April', datetime(2024, 4, 1, 0), datetime(2024, 4, 1, 1))
+
+        events = events_overlapping(self.user.id, datetime(2024, 3, 1), datetime(2024, 4, 1))
+        self.assertEqual([e.title for e in events], ['Trip', 'Night shift'])
+        buckets = bucket_by_day(events, date(2024, 3, 1), date(2024, 3, 31))
+        self.assertEqual(sorted(buckets), [date(2024, 3, day) for day in (1, 2, 3, 10)])
+        self.assertEqual(buckets[date(2024, 3, 10)], [night])
+
+        # The March grid runs from Monday 26 February to Sunday 31 March
+        html = self.client.get('/calendar/calendar/2024/3').get_data(as_text=True)
+        self.assertEqual(html.count(f'/calendar/event/edit/{trip.id}"'), 6) # 27 Feb .. 3 Mar
+        self.assertEqual(html.count(f'/calendar/event/edit/{night.id}"'), 1)
+        self.assertNotIn('Last year', html)
+        self.assertNotIn(f'/calendar/event/edit/{april.id}"', html)
+
+    def test_api_streams_overlapping_events_as_json(self):
+        trip = self._event('Trip "east"', datetime(2024, 2, 27, 9), datetime(2024, 3, 3, 18))
+        self._event('Last year', datetime(2023, 3, 5, 9), datetime(2023, 3, 5, 10))
+        weekly = Event(user_id=self.user.id, title='Weekly', start_time=datetime(2024, 3, 4, 8),
+                       end_time=datetime(2024, 3, 4, 9), rrule='FREQ=WEEKLY;COUNT=2')
+        refresh_recurrence(weekly)
+        db.session.add(weekly)
+        db.session.commit()
+
+        response = self.client.get('/calendar/api/events?start=2024-03-01&end=2024-04-01T00:00:00Z')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.get_json(), {
+            'start': '2024-03-01T00:00:00', 'end': '2024-04-01T00:00:00',
+            'events': [
+                {'id': trip.id, 'title': 'Trip "east"', 'start': '2024-02-27T09:00:00', 'end': '2024-03-03T18:00:00'},
+                {'id': weekly.id, 'title': 'Weekly', 'start': '2024-03-04T08:00:00', 'end': '2024-03-04T09:00:00',
+                 'recurrence_id': '2024-03-04T08:00:00'},
+                {'id': weekly.id, 'title': 'Weekly', 'start': '2024-03-11T08:00:00', 'end': '2024-03-11T09:00:00',
+                 'recurrence_id': '2024-03-11T08:00:00'},
+            ],
+        })
+
+        self.assertEqual(self.client.get('/calendar/api/events?start=2024-03-01').status_code, 400)
+        self.assertEqual(self.client.get('/calendar/api/events?start=2024-03-01&end=2026-03-01').status_code, 400)
@@ -0,0 +1,86 @@
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.app.models import User, Event, EventException
+from jupy_agenda.app.services.ical import fold, export_rrule
+from jupy_agenda.app.services.recurrence import refresh_recurrence
+from jupy_agenda.app import db
+from flask import g
+from datetime import datetime
+
+class TestICalendarExport(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(username='ical_user', email='ical@example.com')
+        self.user.set_password('password')
+        db.session.add(self.user)
+        db.session.commit()
+        self.event = Event(user_id=self.user.id, title='Reunião; equipe, semanal', description='Sala 2\nAndar 3',
+                           start_time=datetime(2024, 3, 4, 12), end_time=datetime(2024, 3, 4, 13),
+                           rrule='FREQ=WEEKLY;UNTIL=20240401T000000Z')
+        refresh_recurrence(self.event)
+        db.session.add(self.event)
+        db.session.commit()
+        db.session.add_all([
+            EventException(event_id=self.event.id, original_start=datetime(2024, 3, 11, 12), cancelled=True),
+            EventException(event_id=self.event.id, original_start=datetime(2024, 3, 18, 12), start_time=datetime(2024, 3, 19, 15)),
+        ])
+        refresh_recurrence(self.event)
+        db.session.commit()
+
+    def tearDown(self):
+        self.clear_database()
+        super().tearDown()
+
+    def test_lines_are_folded_and_until_is_utc(self):
+        line = 'DESCRIPTION:' + 'ç' * 60
+        folded = fold(line)
+        self.assertTrue(all(len(part.encode('utf-8')) <= 75 for part in folded.split('\r\n')))
+        self.assertEqual(folded.replace('\r\n ', ''), line + '\r\n')
+        self.assertEqual(export_rrule('FREQ=WEEKLY;UNTIL=20240401T000000'), 'FREQ=WEEKLY;UNTIL=20240401T000000Z')
+        self.assertEqual(export_rrule('FREQ=DAILY;UNTIL=20240401;COUNT=2'), 'FREQ=DAILY;UNTIL=20240401T235959Z;COUNT=2')
+
+    def test_feed_streams_icalendar_and_answers_304_until_events_change(self):
+        self.user.calendar_token = 'feed-secret'
+        db.session.commit()
+        self.assertEqual(self.client.get('/calendar/feed/wrong.ics').status_code, 404)
+
+        response = self.client.get('/calendar/feed/feed-secret.ics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'text/calendar')
+        body = response.get_data(as_text=True)
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n') and body.endswith('END:VCALENDAR\r\n'))
+        self.assertIn('SUMMARY:Reunião\\; equipe\\, semanal\r\n', body)
+        self.assertIn('DESCRIPTION:Sala 2\\nAndar 3\r\n', body)
+        self.assertIn('RRULE:FREQ=WEEKLY;UNTIL=20240401T000000Z\r\n', body)
+        self.assertIn('EXDATE:20240311T120000Z\r\n', body)
+        self.assertIn('RECURRENCE-ID:20240318T120000Z\r\nLAST', body)
+        self.assertIn('DTSTART:20240319T150000Z\r\nDTEND:20240319T160000Z\r\n', body)
+        self.assertEqual(body.count('BEGIN:VEVENT'), 2)
+
+        etag = response.headers['ETag']
+        cached = self.client.get('/calendar/feed/feed-secret.ics', headers={'If-None-Match': etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.get_data(), b'')
+
+        db.session.delete(self.event) # A deletion changes the tag too
+        db.session.commit()
+        changed = self.client.get('/calendar/feed/feed-secret.ics', headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotIn('BEGIN:VEVENT', changed.get_data(as_text=True))
+
+    def test_export_needs_login_and_token_can_be_rotated(self):
+        self.assertEqual(self.client.get('/calendar/export.ics').status_code, 302)
+        g.pop('_login_user', None) # The test app context outlives requests; don't reuse another test's user
+        self.client.post('/auth/login', data=dict(email='ical@example.com', password='password'))
+
+        response = self.client.get('/calendar/export.ics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+
+        self.client.post('/calendar/feed/token')
+        first = db.session.get(User, self.user.id).calendar_token
+        self.client.post('/calendar/feed/token')
+        db.session.expire_all()
+        self.assertNotEqual(db.session.get(User, self.user.id).calendar_token, first)
+        self.assertEqual(self.client.get(f'/calendar/feed/{first}.ics').status_code, 404)
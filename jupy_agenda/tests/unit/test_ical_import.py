@@ -0,0 +1,145 @@
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.app.models import User, Event, EventException, Reminder
+from jupy_agenda.app.services.ical_import import import_ics, iter_vevents, parse_ical_time
+from jupy_agenda.app.services.recurrence import expand_event
+from jupy_agenda.app.services.ical import iter_calendar
+from jupy_agenda.app import db
+from flask import g
+from datetime import datetime
+import io
+
+TIMETABLE = """BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VTIMEZONE\r
+TZID:America/Sao_Paulo\r
+END:VTIMEZONE\r
+BEGIN:VEVENT\r
+UID:calculo-1@uni.example\r
+SUMMARY:Cálculo I\\, turma A\r
+DESCRIPTION:Sala 101\\nBloco B com uma descrição longa o bastante para ser \r
+ dobrada em duas linhas\r
+DTSTART;TZID=America/Sao_Paulo:20240304T080000\r
+DTEND;TZID=America/Sao_Paulo:20240304T100000\r
+RRULE:FREQ=WEEKLY;BYDAY=MO;UNTIL=20240701T000000Z\r
+EXDATE;TZID=America/Sao_Paulo:20240311T080000\r
+BEGIN:VALARM\r
+ACTION:DISPLAY\r
+DESCRIPTION:Alarme\r
+END:VALARM\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:calculo-1@uni.example\r
+RECURRENCE-ID;TZID=America/Sao_Paulo:20240318T080000\r
+SUMMARY:Cálculo I (prova)\r
+DTSTART;TZID=America/Sao_Paulo:20240318T140000\r
+DURATION:PT3H\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:feriado@uni.example\r
+SUMMARY:Feriado\r
+DTSTART;VALUE=DATE:20240401\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:sem-inicio@uni.example\r
+SUMMARY:Sem início\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+LISBON = """BEGIN:VCALENDAR\r
+BEGIN:VEVENT\r
+UID:aula@lisboa.example\r
+SUMMARY:Aula\r
+DTSTART;TZID=Europe/Lisbon:20260319T090000\r
+DTEND;TZID=Europe/Lisbon:20260319T100000\r
+RRULE:FREQ=WEEKLY;COUNT=5\r
+EXDATE;TZID=Europe/Lisbon:20260402T090000\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:aula@lisboa.example\r
+RECURRENCE-ID;TZID=Europe/Lisbon:20260409T090000\r
+SUMMARY:Aula (sala nova)\r
+DTSTART;TZID=Europe/Lisbon:20260409T090000\r
+DTEND;TZID=Europe/Lisbon:20260409T100000\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+class TestICalendarImport(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(username='import_user', email='import@example.com', notification_method='inapp')
+        self.user.set_password('password')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        self.clear_database()
+        self.app.extensions.pop('occurrence_cache', None)
+        super().tearDown()
+
+    def test_parser_streams_vevents_and_converts_times(self):
+        events = list(iter_vevents(io.StringIO(TIMETABLE)))
+        self.assertEqual(len(events), 4)
+        self.assertTrue(events[0]['DESCRIPTION'][0][1].endswith('ser dobrada em duas linhas'))
+        self.assertNotIn('ACTION', events[0]) # VALARM properties stay out
+        self.assertEqual(parse_ical_time('20240304T080000', {'TZID': 'America/Sao_Paulo'}), (datetime(2024, 3, 4, 11), False))
+        self.assertEqual(parse_ical_time('20240401', {'VALUE': 'DATE'}), (datetime(2024, 4, 1), True))
+
+    def test_import_writes_events_exceptions_and_reminders_and_is_repeatable(self):
+        now = datetime(2024, 3, 1)
+        batches = []
+        stats = import_ics(io.StringIO(TIMETABLE), self.user.id, batch_size=1, progress=batches.append, now=now)
+        self.assertEqual((stats['events'], stats['recurring'], stats['exceptions'], stats['invalid']), (2, 1, 2, 1))
+        self.assertEqual((stats['batches'], len(batches)), (2, 2))
+
+        series = Event.query.filter_by(ical_uid='calculo-1@uni.example').one()
+        self.assertEqual((series.title, series.start_time, series.end_time), ('Cálculo I, turma A', datetime(2024, 3, 4, 11), datetime(2024, 3, 4, 13)))
+        self.assertEqual(series.rrule, 'FREQ=WEEKLY;BYDAY=MO;UNTIL=20240701T000000')
+        self.assertEqual(series.recurrence_end, datetime(2024, 6, 24, 13)) # Last Monday class before UNTIL
+        holiday = Event.query.filter_by(ical_uid='feriado@uni.example').one()
+        self.assertEqual((holiday.start_time, holiday.end_time), (datetime(2024, 4, 1), datetime(2024, 4, 2)))
+
+        march = expand_event(series, datetime(2024, 3, 1), datetime(2024, 3, 26))
+        self.assertEqual([(o.start_time, o.title) for o in march], [
+            (datetime(2024, 3, 4, 11), 'Cálculo I, turma A'), # 11 March is cancelled
+            (datetime(2024, 3, 18, 17), 'Cálculo I (prova)'),
+            (datetime(2024, 3, 25, 11), 'Cálculo I, turma A'),
+        ])
+        self.assertEqual(EventException.query.filter_by(cancelled=True).count(), 1)
+
+        reminders = Reminder.query.order_by(Reminder.event_id).all()
+        self.assertEqual([(r.event_id, r.notification_method) for r in reminders], [(series.id, 'inapp'), (holiday.id, 'inapp')])
+
+        again = import_ics(io.StringIO(TIMETABLE), self.user.id, now=now)
+        self.assertEqual((again['events'], again['exceptions']), (0, 0))
+        self.assertEqual(Event.query.count(), 2)
+
+    def test_zoned_series_keeps_its_local_time_across_dst(self):
+        import_ics(io.StringIO(LISBON), self.user.id, now=datetime(2026, 3, 1))
+        series = Event.query.filter_by(ical_uid='aula@lisboa.example').one()
+        self.assertEqual((series.timezone, series.start_time), ('Europe/Lisbon', datetime(2026, 3, 19, 9)))
+        self.assertEqual(series.recurrence_end, datetime(2026, 4, 16, 9)) # 09:00-10:00 WEST, summer time since 29 March
+
+        occurrences = expand_event(series, datetime(2026, 3, 1), datetime(2026, 5, 1))
+        self.assertEqual([(o.start_time, o.title) for o in occurrences], [
+            (datetime(2026, 3, 19, 9), 'Aula'),
+            (datetime(2026, 3, 26, 9), 'Aula'),
+            # 2 April is the EXDATE; 09:00 local is 08:00 UTC from here on
+            (datetime(2026, 4, 9, 8), 'Aula (sala nova)'),
+            (datetime(2026, 4, 16, 8), 'Aula'),
+        ])
+
+        body = ''.join(iter_calendar(self.user.id, 'example.com'))
+        self.assertIn('DTSTART;TZID=Europe/Lisbon:20260319T090000\r\n', body)
+        self.assertIn('EXDATE;TZID=Europe/Lisbon:20260402T090000\r\n', body)
+        self.assertIn('RECURRENCE-ID;TZID=Europe/Lisbon:20260409T090000\r\n', body)
+
+    def test_upload_form_imports_the_file(self):
+        g.pop('_login_user', None) # The test app context outlives requests; don't reuse another test's user
+        self.client.post('/auth/login', data=dict(email='import@example.com', password='password'))
+        response = self.client.post('/calendar/import', data={'file': (io.BytesIO(TIMETABLE.encode('utf-8')), 'grade.ics')},
+                                    content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Event.query.filter_by(user_id=self.user.id).count(), 2)
@@ -0,0 +1,66 @@
+import unittest
+from flask_mail import Message
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.tests.smtp_sink import SMTPSink
+from jupy_agenda.app.services.mail_delivery import PersistentMailConnection
+from jupy_agenda.app import mail
+
+@unittest.skipUnless(SMTPSink.available, "aiosmtpd is not installed")
+class TestPersistentMailConnection(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sink = SMTPSink().start()
+        self._saved_config = {key: self.app.config.get(key) for key in ('MAIL_SERVER', 'MAIL_PORT', 'MAIL_SUPPRESS_SEND')}
+        self.app.config.update(MAIL_SERVER=self.sink.host, MAIL_PORT=self.sink.port, MAIL_SUPPRESS_SEND=False)
+        mail.init_app(self.app) # Flask-Mail reads its settings at init time
+
+    def tearDown(self):
+        self.app.config.update(self._saved_config)
+        mail.init_app(self.app)
+        self.sink.stop()
+        super().tearDown()
+
+    def _messages(self, count):
+        return [Message(f"Subject {i}", sender='test-noreply@jupy.agenda', recipients=[f'user{i}@example.com'], body='Body')
+                for i in range(count)]
+
+    def test_batch_shares_one_connection(self):
+        with PersistentMailConnection(max_messages=100) as connection:
+            for msg in self._messages(5):
+                connection.send(msg)
+
+        self.assertEqual(connection.connections_opened, 1)
+        self.assertEqual(connection.messages_sent, 5)
+        self.assertEqual(len(self.sink.envelopes), 5)
+        self.assertEqual(self.sink.sessions, 1)
+
+    def test_reconnects_after_max_messages(self):
+        with PersistentMailConnection(max_messages=2) as connection:
+            for msg in self._messages(5):
+                connection.send(msg)
+
+        self.assertEqual(connection.connections_opened, 3)
+        self.assertEqual(len(self.sink.envelopes), 5)
+
+    def test_reconnects_when_server_drops_connection(self):
+        messages = self._messages(2)
+        with PersistentMailConnection() as connection:
+            connection.send(messages[0])
+            connection._connection.host.close() # Simulate the relay hanging up between messages
+            connection.send(messages[1])
+
+        self.assertEqual(connection.connections_opened, 2)
+        self.assertEqual(len(self.sink.envelopes), 2)
+
+    def test_suppressed_mail_opens_no_connection(self):
+        self.app.config['MAIL_SUPPRESS_SEND'] = True
+        mail.init_app(self.app)
+        with mail.record_messages() as outbox:
+            with PersistentMailConnection() as connection:
+                for msg in self._messages(3):
+                    connection.send(msg)
+
+        self.assertEqual(connection.connections_opened, 0)
+        self.assertEqual(len(outbox), 3)
+        self.assertEqual(len(self.sink.envelopes), 0)
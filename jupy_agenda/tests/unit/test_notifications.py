@@ -0,0 +1,106 @@
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.app.models import User, Event, Reminder, Notification
+from jupy_agenda.app.services.notifications import NotificationBroker, get_broker
+from jupy_agenda.app.services.reminder_dispatcher import dispatch_due_reminders
+from jupy_agenda.app import db
+from flask import g
+from flask_mail import email_dispatched
+from datetime import datetime, timedelta
+import json
+
+class TestNotificationBroker(BaseTestCase):
+
+    def test_publish_fans_out_per_user_and_never_blocks(self):
+        broker = NotificationBroker(queue_size=1)
+        first, second, other = broker.subscribe(1), broker.subscribe(1), broker.subscribe(2)
+        self.assertEqual(broker.publish(1, {'id': 1}), 2)
+        self.assertEqual(broker.publish(1, {'id': 2}), 0) # Both queues are full: dropped, not waited for
+        self.assertEqual((first.get_nowait(), second.get_nowait()), ({'id': 1}, {'id': 1}))
+        self.assertTrue(other.empty())
+
+        broker.unsubscribe(1, first)
+        broker.unsubscribe(1, second)
+        self.assertEqual(broker.subscriber_count(), 1)
+
+class TestInAppNotifications(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['SERVER_NAME'] = 'localhost'
+        self.user = User(username='inapp_user', email='inapp@example.com', notification_method='inapp')
+        self.user.set_password('password')
+        db.session.add(self.user)
+        db.session.commit()
+        g.pop('_login_user', None) # The test app context outlives requests; don't reuse another test's user
+        self.client.post('/auth/login', data=dict(email='inapp@example.com', password='password'))
+        start = datetime.utcnow() + timedelta(minutes=30)
+        self.event = Event(user_id=self.user.id, title='In-app Event', start_time=start, end_time=start + timedelta(hours=1))
+        db.session.add(self.event)
+        db.session.commit()
+
+    def tearDown(self):
+        self.clear_database()
+        self.app.config.pop('SERVER_NAME')
+        self.app.config.pop('NOTIFICATION_STREAM_MAX_SECONDS', None)
+        super().tearDown()
+
+    def _due_reminder(self):
+        reminder = Reminder(user_id=self.user.id, item_type='event', item_id=self.event.id, event_id=self.event.id,
+                            reminder_time=datetime.utcnow() - timedelta(minutes=1), notification_method='inapp')
+        db.session.add(reminder)
+        db.session.commit()
+        return reminder
+
+    def test_dispatch_creates_and_publishes_notifications_without_email(self):
+        reminder_id = self._due_reminder().id
+        subscriber = get_broker().subscribe(self.user.id)
+        outbox = []
+        email_dispatched.connect(lambda app, message: outbox.append(message), weak=False)
+        try:
+            stats = dispatch_due_reminders()
+        finally:
+            email_dispatched.receivers.clear()
+            get_broker().unsubscribe(self.user.id, subscriber)
+
+        self.assertEqual(stats['sent'], 1)
+        self.assertEqual(outbox, [])
+        self.assertEqual(db.session.get(Reminder, reminder_id).sent_status, 'sent')
+        notification = Notification.query.one()
+        self.assertEqual(notification.title, 'Event Reminder: In-app Event')
+        self.assertEqual(subscriber.get_nowait(), notification.to_dict())
+
+    def test_catch_up_endpoint_returns_notifications_after_since(self):
+        first = Notification(user_id=self.user.id, title='First')
+        second = Notification(user_id=self.user.id, title='Second')
+        db.session.add_all([first, second])
+        db.session.commit()
+
+        data = self.client.get(f'/notifications/?since={first.id}').get_json()
+        self.assertEqual([n['title'] for n in data['notifications']], ['Second'])
+        self.assertEqual(data['last_id'], second.id)
+
+        self.assertEqual(self.client.post('/notifications/read').get_json(), {'updated': 2})
+
+    def test_stream_replays_missed_notifications_as_events(self):
+        notification = Notification(user_id=self.user.id, title='Missed')
+        db.session.add(notification)
+        db.session.commit()
+        notification_id = notification.id
+        self.app.config['NOTIFICATION_STREAM_MAX_SECONDS'] = 0
+
+        response = self.client.get('/notifications/stream', headers={'Last-Event-ID': '0'})
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        body = response.get_data(as_text=True)
+        self.assertIn(f'id: {notification_id}\nevent: notification\n', body)
+        self.assertEqual(json.loads(body.split('data: ')[1].split('\n')[0])['title'], 'Missed')
+        self.assertEqual(get_broker().subscriber_count(), 0) # The stream unsubscribed when it ended
+
+    def test_only_inapp_users_hold_a_stream(self):
+        self.assertIn('new EventSource(', self.client.get('/calendar/calendar').get_data(as_text=True))
+
+        self.user.notification_method = 'email'
+        db.session.commit()
+        self.assertNotIn('new EventSource(', self.client.get('/calendar/calendar').get_data(as_text=True))
+        response = self.client.get('/notifications/stream')
+        self.assertEqual(response.status_code, 204) # EventSource does not reconnect after a 204
+        self.assertEqual(get_broker().subscriber_count(), 0)
@@ -0,0 +1,101 @@
+import unittest
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.tests.smtp_sink import SMTPSink
+from jupy_agenda.app.models import User, Task, Reminder, OutboxMessage
+from jupy_agenda.app.services import outbox, reminder_dispatcher
+from jupy_agenda.app.services.mail_delivery import PersistentMailConnection
+from jupy_agenda.app import db, mail
+from datetime import datetime, date, timedelta
+from email import message_from_bytes
+from unittest import mock
+
+class TestOutbox(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['APP_BASE_URL'] = 'http://localhost'
+        self.user = User(username='outbox_user', email='outbox@example.com')
+        self.user.set_password('password123')
+        db.session.add(self.user)
+        db.session.commit()
+        tasks = [Task(user_id=self.user.id, description=f"Outbox Task {i}", due_date=date.today()) for i in range(5)]
+        db.session.add_all(tasks)
+        db.session.commit()
+        db.session.add_all([Reminder(user_id=self.user.id, item_type='task', item_id=t.id,
+                                     reminder_time=datetime.utcnow() - timedelta(minutes=1)) for t in tasks])
+        db.session.commit()
+
+    def tearDown(self):
+        self.app.config.pop('APP_BASE_URL')
+        self.clear_database()
+        super().tearDown()
+
+    def test_dispatch_spools_messages_and_queues_reminders(self):
+        with mail.record_messages() as sent:
+            stats = reminder_dispatcher.dispatch_due_reminders(backend='outbox')
+
+        self.assertEqual(stats['queued'], 5)
+        self.assertEqual(stats['sent'], 0)
+        self.assertEqual(len(sent), 0) # Nothing goes to SMTP in stage one
+        self.assertEqual(Reminder.query.filter_by(sent_status='queued').count(), 5)
+        spooled = OutboxMessage.query.all()
+        self.assertEqual(len(spooled), 5)
+        self.assertEqual(len({m.message_id for m in spooled}), 5)
+        parsed = message_from_bytes(spooled[0].payload)
+        self.assertEqual(parsed['Message-ID'], spooled[0].message_id)
+        self.assertEqual(spooled[0].recipients, 'outbox@example.com')
+
+    def test_drain_marks_messages_and_reminders_sent(self):
+        reminder_dispatcher.dispatch_due_reminders(backend='outbox')
+        stats = outbox.drain_outbox(batch_size=2)
+
+        self.assertEqual(stats['sent'], 5)
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual(OutboxMessage.query.filter_by(status='sent').count(), 5)
+        self.assertEqual(Reminder.query.filter_by(sent_status='sent').count(), 5)
+        self.assertEqual(outbox.count_outbox(), 0)
+
+    def test_message_abandoned_mid_send_is_sent_again(self):
+        reminder_dispatcher.dispatch_due_reminders(backend='outbox')
+        crashed = outbox.claim_outbox_messages('crashed-worker', 5, lease_seconds=-1)
+        self.assertEqual(len(crashed), 5)
+
+        stats = outbox.drain_outbox(worker_id='healthy-worker')
+        self.assertEqual(stats['sent'], 5)
+        self.assertEqual(Reminder.query.filter_by(sent_status='sent').count(), 5)
+
+    def test_transient_failure_backs_off_and_keeps_reminders_queued(self):
+        reminder_dispatcher.dispatch_due_reminders(backend='outbox')
+        with mock.patch.object(PersistentMailConnection, 'send_raw', side_effect=ConnectionResetError()):
+            stats = outbox.drain_outbox()
+
+        self.assertEqual(stats['retry'], 5)
+        self.assertEqual(OutboxMessage.query.filter_by(status='retry', attempts=1).count(), 5)
+        self.assertEqual(Reminder.query.filter_by(sent_status='queued').count(), 5)
+        self.assertEqual(outbox.count_outbox(), 0) # Not due again until the backoff has passed
+
+@unittest.skipUnless(SMTPSink.available, "aiosmtpd is not installed")
+class TestOutboxDelivery(TestOutbox):
+    """Runs stage two against a real SMTP server."""
+
+    def setUp(self):
+        super().setUp()
+        self.sink = SMTPSink().start()
+        self._saved_config = {key: self.app.config.get(key) for key in ('MAIL_SERVER', 'MAIL_PORT', 'MAIL_SUPPRESS_SEND')}
+        self.app.config.update(MAIL_SERVER=self.sink.host, MAIL_PORT=self.sink.port, MAIL_SUPPRESS_SEND=False)
+        mail.init_app(self.app)
+
+    def tearDown(self):
+        self.app.config.update(self._saved_config)
+        mail.init_app(self.app)
+        self.sink.stop()
+        super().tearDown()
+
+    def test_spooled_bytes_reach_the_relay_unchanged(self):
+        reminder_dispatcher.dispatch_due_reminders(backend='outbox')
+        stats = outbox.drain_outbox()
+
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(len(self.sink.envelopes), 5)
+        delivered = {message_from_bytes(e.content)['Message-ID'] for e in self.sink.envelopes}
+        self.assertEqual(delivered, {m.message_id for m in OutboxMessage.query})
@@ -0,0 +1,46 @@
+import unittest
+from jupy_agenda.app.services.rate_limit import TokenBucket
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_refill(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=2, clock=clock, sleep=clock.sleep)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire()) # Burst used up
+
+        clock.now += 0.5 # Half a second refills one token at 2/s
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+
+    def test_acquire_waits_for_tokens(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, capacity=1, clock=clock, sleep=clock.sleep)
+        for _ in range(5):
+            bucket.acquire()
+        # First token was available immediately, the next four each waited 1/10 s.
+        self.assertAlmostEqual(clock.now, 0.4)
+
+    def test_zero_rate_is_unlimited(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=0, clock=clock, sleep=clock.sleep)
+        for _ in range(1000):
+            bucket.acquire()
+            self.assertTrue(bucket.try_acquire())
+        self.assertEqual(clock.sleeps, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.app.models import User, Event, EventException, Reminder, Notification
+from jupy_agenda.app.services.recurrence import (
+    OccurrenceCache, expand_event, get_occurrence_cache, parse_rrule, refresh_recurrence, NO_END
+)
+from jupy_agenda.app.services.event_calendar import occurrences_overlapping
+from jupy_agenda.app.services.reminder_maintenance import refresh_occurrence_reminders
+from jupy_agenda.app.services.reminder_dispatcher import dispatch_due_reminders
+from jupy_agenda.app.services.reminder_rules import materialize_due_reminders
+from jupy_agenda.app import db
+from flask import g
+from datetime import datetime, timedelta
+import time
+
+class TestRecurrence(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app.extensions.pop('occurrence_cache', None)
+        self.user = User(username='recurring_user', email='recurring@example.com')
+        self.user.set_password('password')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        self.clear_database()
+        self.app.extensions.pop('occurrence_cache', None)
+        super().tearDown()
+
+    def _series(self, rule, start=datetime(2024, 1, 1, 9), hours=2):
+        event = Event(user_id=self.user.id, title='Weekly class', start_time=start,
+                      end_time=start.replace(hour=start.hour + hours), rrule=rule)
+        refresh_recurrence(event)
+        db.session.add(event)
+        db.session.commit()
+        return event
+
+    def test_rule_validation_and_series_end(self):
+        for bad in ('BYDAY=MO', 'FREQ=HOURLY', 'FREQ=WEEKLY;INTERVAL=0', 'FREQ=WEEKLY\nEXDATE:20240101'):
+            with self.assertRaises(ValueError):
+                parse_rrule(bad, datetime(2024, 1, 1))
+
+        self.assertEqual(self._series('rrule:freq=weekly;byday=mo').recurrence_end, NO_END)
+        counted = self._series('FREQ=WEEKLY;COUNT=3')
+        self.assertEqual(counted.rrule, 'FREQ=WEEKLY;COUNT=3')
+        self.assertEqual(counted.recurrence_end, datetime(2024, 1, 15, 11))
+        self.assertEqual(self._series('FREQ=DAILY;UNTIL=20240105T235959Z').recurrence_end, datetime(2024, 1, 5, 11))
+        self.assertEqual(self._series('FREQ=WEEKLY;BYDAY=MO,WE;COUNT=5').recurrence_end, datetime(2024, 1, 15, 11))
+
+    def test_unbounded_count_and_until_are_rejected_without_listing_the_series(self):
+        for bad in ('FREQ=DAILY;UNTIL=99991231', 'FREQ=DAILY;COUNT=100000000', 'FREQ=DAILY;COUNT=0'):
+            with self.assertRaises(ValueError):
+                parse_rrule(bad, datetime(2024, 1, 1))
+
+        started = time.perf_counter()
+        longest = self._series('FREQ=DAILY;UNTIL=20731231')
+        sparse = self._series('FREQ=DAILY;BYMONTH=2;BYMONTHDAY=30;COUNT=5') # Never happens; dateutil would walk to 9999
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertEqual(longest.recurrence_end, datetime(2073, 12, 30, 11))
+        self.assertEqual(sparse.recurrence_end, datetime(2074, 1, 1, 11)) # An upper bound is enough
+
+        g.pop('_login_user', None) # The test app context outlives requests; don't reuse another test's user
+        self.client.post('/auth/login', data=dict(email='recurring@example.com', password='password'))
+        html = self.client.post('/calendar/event/add', data={
+            'title': 'Forever', 'start_time': '2024-01-01 09:00:00', 'end_time': '2024-01-01 10:00:00',
+            'rrule': 'FREQ=DAILY;UNTIL=99991231'}).get_data(as_text=True)
+        self.assertIn('Invalid recurrence rule: UNTIL must be at most 50 years after the start', html)
+        self.assertIsNone(Event.query.filter_by(title='Forever').first())
+
+    def test_expands_only_the_window_and_applies_exceptions(self):
+        series = self._series('FREQ=WEEKLY;BYDAY=MO') # Mondays 09:00-11:00 from 1 January 2024
+        db.session.add_all([
+            EventException(event_id=series.id, original_start=datetime(2024, 3, 4, 9), cancelled=True),
+            EventException(event_id=series.id, original_start=datetime(2024, 3, 11, 9), title='Moved class',
+                           start_time=datetime(2024, 3, 13, 14), end_time=datetime(2024, 3, 13, 16)),
+        ])
+        refresh_recurrence(series)
+        db.session.commit()
+
+        occurrences = expand_event(series, datetime(2024, 3, 1), datetime(2024, 4, 1))
+        self.assertEqual([(o.start_time, o.title) for o in occurrences], [
+            (datetime(2024, 3, 13, 14), 'Moved class'),
+            (datetime(2024, 3, 18, 9), 'Weekly class'),
+            (datetime(2024, 3, 25, 9), 'Weekly class'),
+        ])
+        self.assertEqual(occurrences[0].recurrence_id, datetime(2024, 3, 11, 9))
+        self.assertEqual(occurrences[0].id, series.id)
+
+        # A later window in a year with no other rows: one row, 52 Mondays, nothing else read
+        year = occurrences_overlapping(self.user.id, datetime(2030, 1, 1), datetime(2031, 1, 1))
+        self.assertEqual(len(year), 52)
+        self.assertEqual(occurrences_overlapping(self.user.id, datetime(2023, 1, 1), datetime(2024, 1, 1)), [])
+
+    def test_expanded_windows_are_cached_per_rule_version(self):
+        series = self._series('FREQ=DAILY')
+        cache = get_occurrence_cache(self.app)
+        window = (datetime(2024, 2, 1), datetime(2024, 2, 8))
+
+        self.assertEqual(len(expand_event(series, *window)), 7)
+        self.assertEqual(len(expand_event(series, *window)), 7)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        series.rrule = 'FREQ=DAILY;INTERVAL=2'
+        refresh_recurrence(series) # New version: the cached window is not reused
+        self.assertEqual(len(expand_event(series, *window)), 3) # 2, 4 and 6 February
+        self.assertEqual(cache.misses, 2)
+
+        lru = OccurrenceCache(maxsize=2)
+        lru.put('a', (1,))
+        lru.put('b', (2,))
+        lru.get('a')
+        lru.put('c', (3,))
+        self.assertEqual((lru.get('a'), lru.get('b')), ((1,), None))
+
+    def test_month_view_shows_occurrences_and_cancels_one(self):
+        series = self._series('FREQ=WEEKLY;BYDAY=MO')
+        g.pop('_login_user', None) # The test app context outlives requests; don't reuse another test's user
+        self.client.post('/auth/login', data=dict(email='recurring@example.com', password='password'))
+
+        link = f'/calendar/event/edit/{series.id}?occurrence='
+        html = self.client.get('/calendar/calendar/2024/3').get_data(as_text=True)
+        self.assertEqual(html.count(link), 5) # Mondays 4 .. 25 March and 26 February, shown in the grid
+
+        response = self.client.post(f'/calendar/event/{series.id}/occurrence/cancel',
+                                    data={'occurrence': '2024-03-04T09:00:00'})
+        self.assertEqual(response.status_code, 302)
+        html = self.client.get('/calendar/calendar/2024/3').get_data(as_text=True)
+        self.assertEqual(html.count(link), 4)
+        self.assertNotIn(f'{link}2024-03-04T09:00:00', html)
+        self.assertEqual(self.client.post(f'/calendar/event/{series.id}/occurrence/cancel',
+                                          data={'occurrence': '2024-03-05T09:00:00'}).status_code, 400) # Not a Monday
+
+    def test_each_occurrence_in_the_horizon_gets_a_reminder(self):
+        series = self._series('FREQ=DAILY') # 09:00-11:00 every day from 1 January 2024
+        series.exceptions.append(EventException(original_start=datetime(2024, 3, 3, 9), cancelled=True))
+        refresh_recurrence(series)
+        db.session.commit()
+        pending = lambda: [r.occurrence_start for r in Reminder.query.filter_by(event_id=series.id).order_by(Reminder.reminder_time)]
+
+        now = datetime(2024, 3, 1, 12)
+        self.assertEqual(refresh_occurrence_reminders(now=now), {'series': 1, 'created': 13, 'deleted': 0})
+        self.assertEqual(pending()[:2], [datetime(2024, 3, 2, 9), datetime(2024, 3, 4, 9)]) # Not the cancelled 3 March
+        self.assertEqual(Reminder.query.filter_by(event_id=series.id).first().reminder_time, datetime(2024, 3, 2, 8))
+        self.assertEqual(refresh_occurrence_reminders(now=now)['created'], 0) # Repeatable
+
+        series.exceptions.append(EventException(original_start=datetime(2024, 3, 10, 9), cancelled=True))
+        refresh_recurrence(series)
+        db.session.commit()
+        stats = refresh_occurrence_reminders(now=now + timedelta(days=2)) # The horizon moves on
+        self.assertEqual((stats['created'], stats['deleted']), (2, 1))
+        self.assertEqual(pending()[-1], datetime(2024, 3, 17, 9))
+        self.assertNotIn(datetime(2024, 3, 10, 9), pending())
+
+    def test_dispatch_and_rules_remind_of_the_occurrence(self):
+        self.user.notification_method = 'inapp'
+        self.app.config['SERVER_NAME'] = 'localhost'
+        series = self._series('FREQ=DAILY')
+        series.exceptions.append(EventException(original_start=datetime(2024, 3, 3, 9), cancelled=True))
+        refresh_recurrence(series)
+        db.session.commit()
+        try:
+            refresh_occurrence_reminders(now=datetime(2024, 3, 1, 12))
+            dispatch_due_reminders(now=datetime(2024, 3, 2, 8, 30))
+            self.assertEqual([n.body for n in Notification.query], ['Início: 2024-03-02 09:00 UTC'])
+
+            Reminder.query.delete()
+            self.app.config['REMINDER_RULES_ENABLED'] = True
+            self.assertEqual(materialize_due_reminders(now=datetime(2024, 3, 2, 8, 30), lookback_minutes=60), 1)
+            self.assertEqual(Reminder.query.one().occurrence_start, datetime(2024, 3, 2, 9))
+            self.assertEqual(materialize_due_reminders(now=datetime(2024, 3, 3, 8, 30), lookback_minutes=60), 0) # Cancelled
+        finally:
+            self.app.config['SERVER_NAME'] = None
+            self.app.config.pop('REMINDER_RULES_ENABLED', None)
+            self.app.extensions.pop('occurrence_reminders_refreshed_at', None)
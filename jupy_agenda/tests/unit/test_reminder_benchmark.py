@@ -0,0 +1,17 @@
+import unittest
+from jupy_agenda.tests.smtp_sink import SMTPSink
+from jupy_agenda.benchmarks.reminder_dispatch import run_benchmark, compare
+
+@unittest.skipUnless(SMTPSink.available, "aiosmtpd is required")
+class TestReminderDispatchBenchmark(unittest.TestCase):
+
+    def test_report_and_query_count_independent_of_backlog_size(self):
+        small = run_benchmark(users=2, reminders_per_user=2)
+        large = run_benchmark(users=20, reminders_per_user=3)
+
+        self.assertEqual((small['reminders'], small['sent'], small['not_sent'], small['smtp_messages']), (4, 4, 0, 4))
+        self.assertEqual((large['reminders'], large['sent'], large['smtp_messages']), (60, 60, 60))
+        # One chunk either way: the dispatcher's query count must not grow per reminder
+        self.assertEqual(small['queries'], large['queries'])
+        self.assertIsNotNone(large['max_rss_mb'])
+        self.assertEqual(len(compare(small, large)), 7)
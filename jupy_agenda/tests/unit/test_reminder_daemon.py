@@ -0,0 +1,95 @@
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.app.models import User, Task, Reminder
+from jupy_agenda.app.services.reminder_daemon import ReminderScheduler, run_reminder_daemon
+from jupy_agenda.app import db
+from datetime import datetime, date, timedelta
+
+class _StopAfter:
+    """Stand-in for threading.Event that lets the daemon loop run a fixed number of times."""
+
+    def __init__(self, iterations):
+        self.remaining = iterations
+        self.waits = []
+
+    def is_set(self):
+        return self.remaining <= 0
+
+    def wait(self, timeout):
+        self.waits.append(timeout)
+        self.remaining -= 1
+
+class TestReminderScheduler(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(username='daemon_user', email='daemon@example.com')
+        self.user.set_password('password123')
+        db.session.add(self.user)
+        db.session.commit()
+        self.task = Task(user_id=self.user.id, description="Daemon Task", due_date=date.today())
+        db.session.add(self.task)
+        db.session.commit()
+        self.now = datetime.utcnow()
+
+    def tearDown(self):
+        self.clear_database()
+        super().tearDown()
+
+    def _add_reminder(self, reminder_time, **kwargs):
+        reminder = Reminder(user_id=self.user.id, item_type='task', item_id=self.task.id, reminder_time=reminder_time, **kwargs)
+        db.session.add(reminder)
+        db.session.commit()
+        return reminder
+
+    def test_load_orders_by_reminder_time_within_horizon(self):
+        later = self._add_reminder(self.now + timedelta(minutes=30))
+        sooner = self._add_reminder(self.now + timedelta(minutes=10))
+        self._add_reminder(self.now + timedelta(days=3)) # Beyond the horizon
+
+        scheduler = ReminderScheduler(horizon=timedelta(hours=24))
+        self.assertEqual(scheduler.load(self.now), 2)
+        self.assertEqual(scheduler.next_due_time(), sooner.reminder_time)
+        self.assertEqual(scheduler.pop_due(self.now + timedelta(minutes=15)), [sooner.id])
+        self.assertEqual(scheduler.pop_due(self.now + timedelta(hours=1)), [later.id])
+        self.assertIsNone(scheduler.next_due_time())
+
+    def test_refresh_picks_up_new_rows(self):
+        scheduler = ReminderScheduler()
+        scheduler.load(self.now)
+        self.assertIsNone(scheduler.next_due_time())
+
+        reminder = self._add_reminder(self.now + timedelta(minutes=5))
+        scheduler.refresh(datetime.utcnow())
+        self.assertEqual(scheduler.next_due_time(), reminder.reminder_time)
+
+    def test_rescheduled_reminder_replaces_old_heap_entry(self):
+        reminder = self._add_reminder(self.now + timedelta(minutes=5))
+        scheduler = ReminderScheduler()
+        scheduler.load(self.now)
+
+        reminder.reminder_time = self.now + timedelta(minutes=50)
+        db.session.commit()
+        scheduler.refresh(datetime.utcnow())
+
+        self.assertEqual(len(scheduler), 1)
+        self.assertEqual(scheduler.pop_due(self.now + timedelta(minutes=10)), [])
+        self.assertEqual(scheduler.next_due_time(), self.now + timedelta(minutes=50))
+
+    def test_sleep_is_capped_by_next_due_time(self):
+        self._add_reminder(self.now + timedelta(seconds=3))
+        scheduler = ReminderScheduler()
+        scheduler.load(self.now)
+        self.assertAlmostEqual(scheduler.seconds_until_next(self.now, 60), 3, places=3)
+        self.assertEqual(scheduler.seconds_until_next(self.now + timedelta(minutes=1), 60), 0)
+
+    def test_daemon_dispatches_due_reminders(self):
+        due_id = self._add_reminder(self.now - timedelta(minutes=1)).id
+        upcoming_id = self._add_reminder(self.now + timedelta(minutes=30)).id
+
+        stop_event = _StopAfter(1)
+        with self.app.test_request_context():
+            run_reminder_daemon(poll_interval=10, stop_event=stop_event)
+
+        self.assertEqual(db.session.get(Reminder, due_id).sent_status, 'sent')
+        self.assertEqual(db.session.get(Reminder, upcoming_id).sent_status, 'pending')
+        self.assertEqual(stop_event.waits, [10]) # Next reminder is 30 min away, so sleep the full poll interval
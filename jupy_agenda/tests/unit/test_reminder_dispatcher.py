@@ -0,0 +1,224 @@
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.app.models import User, Task, Event, Reminder
+from jupy_agenda.app.services import reminder_dispatcher
+from jupy_agenda.app.services.mail_delivery import PersistentMailConnection, is_transient_error
+from jupy_agenda.app import db, mail
+from sqlalchemy import event as sa_event
+from datetime import datetime, date, timedelta
+from unittest import mock
+import smtplib
+
+class TestReminderDispatcher(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(username='dispatch_user', email='dispatch@example.com')
+        self.user.set_password('password123')
+        db.session.add(self.user)
+        db.session.commit()
+
+        self.past = datetime.utcnow() - timedelta(minutes=5)
+        self.tasks = [Task(user_id=self.user.id, description=f"Dispatch Task {i}", due_date=date.today()) for i in range(7)]
+        self.event = Event(user_id=self.user.id, title="Dispatch Event",
+                           start_time=datetime.utcnow() + timedelta(minutes=55),
+                           end_time=datetime.utcnow() + timedelta(hours=2))
+        db.session.add_all(self.tasks + [self.event])
+        db.session.commit()
+
+        self.reminders = [Reminder(user_id=self.user.id, item_type='task', item_id=t.id, reminder_time=self.past) for t in self.tasks]
+        self.reminders.append(Reminder(user_id=self.user.id, item_type='event', item_id=self.event.id, reminder_time=self.past))
+        db.session.add_all(self.reminders)
+        db.session.commit()
+
+    def tearDown(self):
+        self.clear_database()
+        super().tearDown()
+
+    def _dispatch(self, **kwargs):
+        # Email templates build absolute URLs, which need a request context.
+        with self.app.test_request_context():
+            with mail.record_messages() as outbox:
+                stats = reminder_dispatcher.dispatch_due_reminders(**kwargs)
+        return stats, outbox
+
+    def test_dispatch_sends_all_due_reminders_in_batches(self):
+        stats, outbox = self._dispatch(batch_size=3)
+        self.assertEqual(stats['sent'], 8)
+        self.assertEqual(stats['error'], 0)
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual(len(outbox), 8)
+        self.assertEqual(Reminder.query.filter_by(sent_status='sent').count(), 8)
+
+    def test_future_reminders_are_left_pending(self):
+        future = Reminder(user_id=self.user.id, item_type='task', item_id=self.tasks[0].id,
+                          reminder_time=datetime.utcnow() + timedelta(hours=1))
+        db.session.add(future)
+        db.session.commit()
+
+        stats, _ = self._dispatch()
+        self.assertEqual(stats['sent'], 8)
+        self.assertEqual(db.session.get(Reminder, future.id).sent_status, 'pending')
+
+    def test_missing_item_is_marked_error(self):
+        orphan = Reminder(user_id=self.user.id, item_type='task', item_id=999999, reminder_time=self.past)
+        db.session.add(orphan)
+        db.session.commit()
+
+        stats, outbox = self._dispatch()
+        self.assertEqual(stats['sent'], 8)
+        self.assertEqual(stats['error'], 1)
+        self.assertEqual(len(outbox), 8)
+        self.assertEqual(db.session.get(Reminder, orphan.id).sent_status, 'error')
+
+    def test_query_count_does_not_grow_with_chunk_size(self):
+        statements = []
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        sa_event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            self._dispatch(batch_size=100)
+        finally:
+            sa_event.remove(db.engine, 'before_cursor_execute', count)
+
+        # One chunk: claim (UPDATE + SELECT), users, events, tasks, one status UPDATE, then the empty claim.
+        self.assertLessEqual(len(statements), 8)
+
+    def test_concurrent_workers_claim_disjoint_rows(self):
+        first = reminder_dispatcher.claim_due_reminders('worker-a', 5)
+        second = reminder_dispatcher.claim_due_reminders('worker-b', 5)
+
+        self.assertEqual(len(first), 5)
+        self.assertEqual(len(second), 3)
+        self.assertFalse({r.id for r in first} & {r.id for r in second})
+        self.assertEqual(reminder_dispatcher.claim_due_reminders('worker-c', 5), [])
+        self.assertEqual(Reminder.query.filter_by(sent_status='claimed', claimed_by='worker-a').count(), 5)
+
+    def test_expired_lease_is_reclaimed(self):
+        crashed = reminder_dispatcher.claim_due_reminders('crashed-worker', 8, lease_seconds=-1)
+        self.assertEqual(len(crashed), 8)
+
+        stats, outbox = self._dispatch(worker_id='healthy-worker')
+        self.assertEqual(stats['sent'], 8)
+        self.assertEqual(len(outbox), 8)
+        self.assertEqual(Reminder.query.filter_by(sent_status='sent', claimed_by='healthy-worker').count(), 8)
+
+    def test_live_lease_is_not_taken_over(self):
+        reminder_dispatcher.claim_due_reminders('busy-worker', 8)
+        stats, outbox = self._dispatch(worker_id='other-worker')
+        self.assertEqual(stats['sent'], 0)
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(Reminder.query.filter_by(sent_status='claimed').count(), 8)
+
+    def test_thread_pool_delivery_sends_everything_once(self):
+        # Worker threads have no request context, so URLs are built from SERVER_NAME.
+        self.app.config['SERVER_NAME'] = 'localhost'
+        try:
+            with mail.record_messages() as outbox:
+                stats = reminder_dispatcher.dispatch_due_reminders(batch_size=5, concurrency=3)
+        finally:
+            self.app.config['SERVER_NAME'] = None
+
+        self.assertEqual(stats['sent'], 8)
+        self.assertEqual(stats['error'], 0)
+        self.assertEqual(len(outbox), 8)
+        self.assertEqual(sorted(msg.subject for msg in outbox), sorted(
+            [f"Task Reminder: Dispatch Task {i}..." for i in range(7)] + ["Event Reminder: Dispatch Event"]))
+        self.assertEqual(Reminder.query.filter_by(sent_status='sent').count(), 8)
+
+    def test_digest_merges_a_users_due_reminders_into_one_email(self):
+        stats, outbox = self._dispatch(digest_minutes=15)
+        self.assertEqual(stats['sent'], 8)
+        self.assertEqual(len(outbox), 1)
+        self.assertEqual(outbox[0].subject, "Reminder Digest: 8 items")
+        self.assertIn("Dispatch Event", outbox[0].body)
+        self.assertIn("Dispatch Task 6", outbox[0].html)
+        self.assertEqual(Reminder.query.filter_by(sent_status='sent').count(), 8)
+
+    def test_digest_window_splits_reminders_far_apart(self):
+        earlier = Reminder(user_id=self.user.id, item_type='task', item_id=self.tasks[0].id,
+                           reminder_time=self.past - timedelta(hours=2))
+        other_user = User(username='digest_other', email='digest_other@example.com')
+        other_user.set_password('password123')
+        db.session.add_all([earlier, other_user])
+        db.session.commit()
+        other_task = Task(user_id=other_user.id, description="Other Task", due_date=date.today())
+        db.session.add(other_task)
+        db.session.commit()
+        db.session.add(Reminder(user_id=other_user.id, item_type='task', item_id=other_task.id, reminder_time=self.past))
+        db.session.commit()
+
+        stats, outbox = self._dispatch(digest_minutes=30)
+        self.assertEqual(stats['sent'], 10)
+        # The 8 reminders share a digest; the early one and the other user's get their own email.
+        self.assertEqual(len(outbox), 3)
+        self.assertEqual(sorted(msg.subject for msg in outbox), sorted(
+            ["Reminder Digest: 8 items", "Task Reminder: Dispatch Task 0...", "Task Reminder: Other Task..."]))
+
+    def test_rate_overflow_is_deferred_instead_of_failing(self):
+        self.app.config.update(MAIL_MAX_SEND_RATE=2, MAIL_RATE_OVERFLOW='defer')
+        try:
+            before = datetime.utcnow()
+            stats, outbox = self._dispatch()
+        finally:
+            self.app.config.update(MAIL_MAX_SEND_RATE=0, MAIL_RATE_OVERFLOW='wait')
+
+        self.assertEqual(stats['error'], 0)
+        self.assertGreaterEqual(stats['sent'], 2) # The bucket starts with one second's worth of tokens
+        self.assertEqual(stats['sent'] + stats['deferred'], 8)
+        self.assertEqual(len(outbox), stats['sent'])
+        deferred = Reminder.query.filter_by(sent_status='pending').order_by(Reminder.reminder_time).all()
+        self.assertEqual(len(deferred), stats['deferred'])
+        # Rescheduled into the future, one slot every 1/rate seconds.
+        self.assertTrue(all(r.reminder_time > before for r in deferred))
+        self.assertEqual(len({r.reminder_time for r in deferred}), len(deferred))
+        self.assertIsNone(deferred[0].claimed_by)
+
+    def test_transient_failure_schedules_a_backed_off_retry(self):
+        before = datetime.utcnow()
+        with mock.patch.object(PersistentMailConnection, 'send', side_effect=smtplib.SMTPServerDisconnected('relay down')):
+            stats, _ = self._dispatch()
+
+        self.assertEqual(stats['sent'], 0)
+        self.assertEqual(stats['error'], 0)
+        self.assertEqual(stats['retry'], 8)
+        retries = Reminder.query.filter_by(sent_status='retry').all()
+        self.assertEqual(len(retries), 8)
+        for reminder in retries:
+            self.assertEqual(reminder.attempts, 1)
+            self.assertIsNone(reminder.lease_until)
+            # First backoff: half to all of REMINDER_RETRY_BASE_SECONDS (60 s).
+            self.assertGreaterEqual(reminder.next_attempt_at, before + timedelta(seconds=30))
+            self.assertLessEqual(reminder.next_attempt_at, datetime.utcnow() + timedelta(seconds=60))
+
+        # Not due yet, so an immediate second pass leaves them alone; once due they are sent.
+        stats, _ = self._dispatch()
+        self.assertEqual(stats['sent'], 0)
+        stats, outbox = self._dispatch(now=datetime.utcnow() + timedelta(minutes=2))
+        self.assertEqual(stats['sent'], 8)
+        self.assertEqual(len(outbox), 8)
+
+    def test_reminder_goes_dead_after_max_attempts(self):
+        self.app.config['REMINDER_MAX_ATTEMPTS'] = 2
+        try:
+            with mock.patch.object(PersistentMailConnection, 'send', side_effect=TimeoutError('timed out')):
+                self._dispatch()
+                stats, _ = self._dispatch(now=datetime.utcnow() + timedelta(minutes=2))
+        finally:
+            self.app.config.pop('REMINDER_MAX_ATTEMPTS')
+
+        self.assertEqual(stats['dead'], 8)
+        self.assertEqual(Reminder.query.filter_by(sent_status='dead', attempts=2).count(), 8)
+        self.assertEqual(reminder_dispatcher.count_claimable_reminders(datetime.utcnow() + timedelta(days=1)), 0)
+
+    def test_permanent_failure_is_an_error(self):
+        rejected = smtplib.SMTPRecipientsRefused({'dispatch@example.com': (550, b'No such user')})
+        with mock.patch.object(PersistentMailConnection, 'send', side_effect=rejected):
+            stats, _ = self._dispatch()
+        self.assertEqual(stats['error'], 8)
+        self.assertEqual(stats['retry'], 0)
+
+    def test_transient_error_classification(self):
+        self.assertTrue(is_transient_error(smtplib.SMTPDataError(451, b'Try again later')))
+        self.assertFalse(is_transient_error(smtplib.SMTPDataError(554, b'Rejected')))
+        self.assertTrue(is_transient_error(ConnectionRefusedError()))
+        self.assertFalse(is_transient_error(KeyError('template')))
@@ -0,0 +1,77 @@
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.app.models import User, Task, Reminder
+from jupy_agenda.app.services.reminder_logging import configure_reminder_logging, SamplingFilter
+from jupy_agenda.app.services.reminder_dispatcher import dispatch_due_reminders
+from jupy_agenda.app import db, mail
+from datetime import datetime, date, timedelta
+import io
+import json
+import logging
+
+class TestReminderLogging(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._handlers = list(self.app.logger.handlers)
+        self._level, self._propagate = self.app.logger.level, self.app.logger.propagate
+        self.stream = io.StringIO()
+        self.app.config['REMINDER_LOG_SAMPLE_RATE'] = 0
+        self.listener = configure_reminder_logging(self.app, stream=self.stream)
+
+    def tearDown(self):
+        self.listener.stop()
+        for handler in list(self.app.logger.handlers):
+            self.app.logger.removeHandler(handler)
+        for handler in self._handlers:
+            self.app.logger.addHandler(handler)
+        self.app.logger.setLevel(self._level)
+        self.app.logger.propagate = self._propagate
+        self.app.config.pop('REMINDER_LOG_SAMPLE_RATE')
+        self.clear_database()
+        super().tearDown()
+
+    def _lines(self):
+        self.listener.stop() # Flushes the queue
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_records_are_json_with_extra_fields_and_tracebacks(self):
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            self.app.logger.error("Send failed for %s", 'reminder 7', exc_info=True,
+                                  extra={'event': 'reminder_failed', 'reminder_ids': [7]})
+        line, = self._lines()
+        self.assertEqual((line['level'], line['message'], line['event'], line['reminder_ids']),
+                         ('ERROR', 'Send failed for reminder 7', 'reminder_failed', [7]))
+        self.assertIn('ValueError: boom', line['exc_info'])
+
+    def test_success_lines_are_sampled_and_each_run_is_summarized(self):
+        user = User(username='log_user', email='log@example.com')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        tasks = [Task(user_id=user.id, description=f'Logged Task {i}', due_date=date.today()) for i in range(3)]
+        db.session.add_all(tasks)
+        db.session.commit()
+        past = datetime.utcnow() - timedelta(minutes=1)
+        db.session.add_all([Reminder(user_id=user.id, item_type='task', item_id=t.id, reminder_time=past) for t in tasks])
+        db.session.add(Reminder(user_id=user.id, item_type='task', item_id=tasks[-1].id + 100, reminder_time=past))
+        db.session.commit()
+
+        with self.app.test_request_context():
+            with mail.record_messages():
+                dispatch_due_reminders()
+
+        events = [line.get('event') for line in self._lines()]
+        self.assertNotIn('reminder_sent', events) # Sample rate 0
+        summary, = [line for line in self._lines() if line.get('event') == 'dispatch_run']
+        self.assertEqual((summary['sent'], summary['error']), (3, 1))
+        self.assertEqual(summary['error_causes'], {'invalid': 1})
+
+    def test_sampling_filter_keeps_unsampled_records(self):
+        sampler = SamplingFilter(0.5, rng=type('Rng', (), {'random': staticmethod(lambda: 0.7)}))
+        routine = logging.makeLogRecord({'msg': 'sent', 'sample': True})
+        failure = logging.makeLogRecord({'msg': 'failed', 'levelno': logging.ERROR})
+        self.assertFalse(sampler.filter(routine))
+        self.assertTrue(sampler.filter(failure))
+        self.assertEqual(sampler.dropped, 1)
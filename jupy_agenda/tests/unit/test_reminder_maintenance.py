@@ -0,0 +1,181 @@
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.app.models import User, Event, Task, Reminder, ReminderArchive
+from jupy_agenda.app.services.reminder_maintenance import backfill_reminder_links, archive_reminders, rebuild_reminders
+from jupy_agenda.app.services.reminder_policy import event_reminder_time, task_reminder_time
+from jupy_agenda.app.services.reminder_dispatcher import claim_due_reminders
+from jupy_agenda.app import db
+from sqlalchemy import inspect
+from datetime import datetime, date, timedelta
+
+class TestReminderLinks(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(username='links_user', email='links@example.com')
+        self.user.set_password('password123')
+        db.session.add(self.user)
+        db.session.commit()
+        start = datetime.utcnow() + timedelta(days=1)
+        self.event = Event(user_id=self.user.id, title='Linked Event', start_time=start, end_time=start + timedelta(hours=1))
+        self.task = Task(user_id=self.user.id, description='Linked Task', due_date=date.today() + timedelta(days=1))
+        db.session.add_all([self.event, self.task])
+        db.session.commit()
+
+    def tearDown(self):
+        self.clear_database()
+        super().tearDown()
+
+    def _reminder(self, item_type, item_id, linked=True, **kwargs):
+        link = {'event_id' if item_type == 'event' else 'task_id': item_id} if linked else {}
+        reminder = Reminder(user_id=self.user.id, item_type=item_type, item_id=item_id,
+                            reminder_time=kwargs.pop('reminder_time', datetime.utcnow() + timedelta(hours=1)),
+                            **link, **kwargs)
+        db.session.add(reminder)
+        db.session.commit()
+        return reminder
+
+    def test_deleting_an_item_deletes_its_reminders(self):
+        self._reminder('event', self.event.id)
+        self._reminder('task', self.task.id)
+
+        db.session.delete(self.event)
+        db.session.delete(self.task)
+        db.session.commit()
+        self.assertEqual(Reminder.query.count(), 0)
+
+    def test_backfill_links_legacy_rows_and_is_repeatable(self):
+        event_reminder = self._reminder('event', self.event.id, linked=False)
+        task_reminder = self._reminder('task', self.task.id, linked=False)
+        self._reminder('event', 9999, linked=False) # Its event was deleted long ago
+
+        stats = backfill_reminder_links(batch_size=2)
+        self.assertEqual(stats, {'events': 1, 'tasks': 1, 'orphans': 1})
+        db.session.expire_all()
+        self.assertEqual((event_reminder.event_id, task_reminder.task_id), (self.event.id, self.task.id))
+        self.assertEqual(backfill_reminder_links(batch_size=2), {'events': 0, 'tasks': 0, 'orphans': 1})
+
+        self.assertEqual(backfill_reminder_links(delete_orphans=True)['orphans'], 1)
+        self.assertEqual(Reminder.query.count(), 2)
+
+    def test_claim_returns_reminders_joined_to_user_and_item(self):
+        self._reminder('event', self.event.id, reminder_time=datetime.utcnow() - timedelta(minutes=1))
+        db.session.remove()
+
+        claimed = claim_due_reminders('links-worker', 10)
+        self.assertEqual(len(claimed), 1)
+        unloaded = inspect(claimed[0]).unloaded
+        self.assertNotIn('user', unloaded)
+        self.assertNotIn('event', unloaded)
+        self.assertEqual(claimed[0].event.title, 'Linked Event')
+
+class TestReminderArchive(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(username='archive_user', email='archive@example.com')
+        self.user.set_password('password123')
+        db.session.add(self.user)
+        db.session.commit()
+        self.task = Task(user_id=self.user.id, description='Archived Task', due_date=date.today())
+        db.session.add(self.task)
+        db.session.commit()
+
+    def tearDown(self):
+        self.clear_database()
+        self.app.config.pop('REMINDER_ARCHIVE_RETENTION_DAYS', None)
+        super().tearDown()
+
+    def _reminder(self, status, finished_days_ago):
+        finished = datetime.utcnow() - timedelta(days=finished_days_ago)
+        reminder = Reminder(user_id=self.user.id, item_type='task', item_id=self.task.id, task_id=self.task.id,
+                            reminder_time=finished, sent_status=status, updated_at=finished)
+        db.session.add(reminder)
+        db.session.commit()
+        return reminder.id
+
+    def test_moves_only_old_finished_reminders_in_batches(self):
+        old_ids = [self._reminder(status, 40) for status in ('sent', 'sent', 'error', 'dead', 'sent')]
+        recent_id = self._reminder('sent', 1)
+        pending_id = self._reminder('pending', 40)
+
+        stats = archive_reminders(older_than=timedelta(days=30), batch_size=2)
+        self.assertEqual((stats['archived'], stats['batches']), (5, 3))
+        self.assertEqual(sorted(r.id for r in Reminder.query), sorted([recent_id, pending_id]))
+        archived = ReminderArchive.query.order_by(ReminderArchive.id).all()
+        self.assertEqual([a.id for a in archived], old_ids)
+        self.assertEqual([a.sent_status for a in archived], ['sent', 'sent', 'error', 'dead', 'sent'])
+        self.assertEqual(archived[0].task_id, self.task.id)
+
+        self.assertEqual(archive_reminders(older_than=timedelta(days=30))['archived'], 0) # Nothing left to resume
+
+    def test_retention_purges_old_archive_rows(self):
+        self._reminder('sent', 400)
+        self._reminder('sent', 40)
+        self.app.config['REMINDER_ARCHIVE_RETENTION_DAYS'] = 365
+
+        stats = archive_reminders(older_than=timedelta(days=30))
+        self.assertEqual((stats['archived'], stats['purged']), (2, 1))
+        self.assertEqual(ReminderArchive.query.count(), 1)
+
+class TestReminderRebuild(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(username='rebuild_user', email='rebuild@example.com', notification_method='inapp')
+        self.other = User(username='rebuild_other', email='rebuild_other@example.com')
+        for user in (self.user, self.other):
+            user.set_password('password123')
+        db.session.add_all([self.user, self.other])
+        db.session.commit()
+
+    def tearDown(self):
+        self.clear_database()
+        super().tearDown()
+
+    def _event(self, user, starts_in):
+        start = datetime.utcnow() + starts_in
+        event = Event(user_id=user.id, title='Rebuilt Event', start_time=start, end_time=start + timedelta(hours=1))
+        db.session.add(event)
+        db.session.commit()
+        return event
+
+    def _task(self, user, due_date):
+        task = Task(user_id=user.id, description='Rebuilt Task', due_date=due_date)
+        db.session.add(task)
+        db.session.commit()
+        return task
+
+    def test_rebuild_matches_the_per_item_policy(self):
+        future = self._event(self.user, timedelta(hours=3))
+        self._event(self.user, timedelta(minutes=30)) # Reminder time already past
+        backlog = self._event(self.user, timedelta(hours=5))
+        tomorrow = self._task(self.user, date.today() + timedelta(days=1))
+        self._task(self.user, date.today() - timedelta(days=1))
+        self._task(self.user, None)
+        db.session.add_all([
+            Reminder(user_id=self.user.id, item_type='event', item_id=future.id, event_id=future.id,
+                     reminder_time=future.start_time - timedelta(minutes=10)), # Outdated policy
+            Reminder(user_id=self.user.id, item_type='event', item_id=backlog.id, event_id=backlog.id,
+                     reminder_time=datetime.utcnow() - timedelta(minutes=1)), # Due, not yet sent
+        ])
+        db.session.commit()
+
+        stats = rebuild_reminders(batch_size=2)
+        self.assertEqual((stats['deleted'], stats['events'], stats['tasks']), (1, 1, 1))
+        db.session.expire_all()
+        rows = {(r.item_type, r.item_id): r for r in Reminder.query}
+        self.assertEqual(set(rows), {('event', future.id), ('event', backlog.id), ('task', tomorrow.id)})
+        self.assertEqual(rows[('event', future.id)].reminder_time, event_reminder_time(future.start_time))
+        self.assertEqual(rows[('task', tomorrow.id)].reminder_time, task_reminder_time(self.user.id, tomorrow.due_date))
+        self.assertEqual(rows[('task', tomorrow.id)].notification_method, 'inapp')
+        self.assertEqual(rows[('task', tomorrow.id)].sent_status, 'pending')
+
+        self.assertEqual(rebuild_reminders()['deleted'], 2) # Repeatable: the same rows are recreated
+
+    def test_rebuild_for_one_user(self):
+        self._event(self.user, timedelta(hours=3))
+        other_event = self._event(self.other, timedelta(hours=3))
+
+        stats = rebuild_reminders(user_id=self.other.id)
+        self.assertEqual(stats['events'], 1)
+        self.assertEqual([r.item_id for r in Reminder.query], [other_event.id])
@@ -0,0 +1,109 @@
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.app.models import User, Task, Reminder
+from jupy_agenda.app.services.reminder_metrics import (
+    Histogram, ReminderMetrics, error_cause, get_metrics, read_snapshot, render_prometheus, write_snapshot
+)
+from jupy_agenda.app.services.mail_delivery import PersistentMailConnection
+from jupy_agenda.app.services.reminder_dispatcher import dispatch_due_reminders
+from jupy_agenda.app import db, mail
+from datetime import datetime, date, timedelta
+from unittest import mock
+import os
+import smtplib
+import tempfile
+
+class TestReminderMetrics(BaseTestCase):
+
+    def test_histogram_percentiles_and_cumulative_buckets(self):
+        histogram = Histogram((1, 10))
+        for value in range(1, 101):
+            histogram.observe(value / 10) # 0.1 .. 10.0
+        self.assertEqual(histogram.counts, [10, 90, 0])
+        self.assertEqual(histogram.percentile(50), 5.1)
+        self.assertEqual(histogram.percentile(99), 9.9)
+
+        metrics = ReminderMetrics()
+        metrics.record_sent('email', 2, [0.5, 20])
+        metrics.record_error(error_cause(smtplib.SMTPDataError(550, b'rejected')))
+        text = render_prometheus(metrics.state())
+        self.assertIn('jupy_reminders_sent_total{channel="email"} 2', text)
+        self.assertIn('jupy_reminder_errors_total{cause="smtp_550"} 1', text)
+        self.assertIn('jupy_reminder_dispatch_lag_seconds_bucket{le="1"} 1', text)
+        self.assertIn('jupy_reminder_dispatch_lag_seconds_bucket{le="30"} 2', text)
+        self.assertIn('jupy_reminder_dispatch_lag_seconds_count 2', text)
+
+    def test_snapshot_file_accumulates_processes_without_double_counting(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'metrics.json')
+            first, second = ReminderMetrics(), ReminderMetrics()
+            first.record_sent('email', 1, [3])
+            write_snapshot(first, path)
+            first.record_sent('email', 1, [4])
+            write_snapshot(first, path) # Only the new send is added
+            second.record_sent('webhook', 1, [2])
+            second.record_run(2.0, 1)
+            write_snapshot(second, path)
+
+            state = read_snapshot(path)
+        self.assertEqual(state['sent'], {'email': 2, 'webhook': 1})
+        self.assertEqual(state['lag']['count'], 3)
+        self.assertEqual(state['runs'], 1)
+
+class TestDispatchMetrics(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app.extensions.pop('reminder_metrics', None)
+        self.user = User(username='metrics_user', email='metrics@example.com')
+        self.user.set_password('password123')
+        db.session.add(self.user)
+        db.session.commit()
+        self.task = Task(user_id=self.user.id, description='Metrics Task', due_date=date.today())
+        db.session.add(self.task)
+        db.session.commit()
+
+    def tearDown(self):
+        self.clear_database()
+        self.app.extensions.pop('reminder_metrics', None)
+        self.app.config.pop('METRICS_TOKEN', None)
+        super().tearDown()
+
+    def _due_reminder(self, item_id, minutes_late):
+        db.session.add(Reminder(user_id=self.user.id, item_type='task', item_id=item_id,
+                                reminder_time=datetime.utcnow() - timedelta(minutes=minutes_late)))
+        db.session.commit()
+
+    def _dispatch(self):
+        with self.app.test_request_context():
+            with mail.record_messages():
+                return dispatch_due_reminders()
+
+    def test_dispatch_records_lag_latency_and_error_causes(self):
+        self._due_reminder(self.task.id, 2)
+        self._due_reminder(self.task.id + 1000, 2) # Its task does not exist
+
+        stats = self._dispatch()
+        self.assertEqual((stats['sent'], stats['error']), (1, 1))
+        snapshot = get_metrics(self.app).snapshot()
+        self.assertEqual(snapshot['sent'], {'email': 1})
+        self.assertEqual(snapshot['errors'], {'invalid': 1})
+        self.assertGreaterEqual(snapshot['lag_seconds']['p50'], 120)
+        self.assertEqual(snapshot['send_latency_seconds']['email']['count'], 1)
+        self.assertEqual(snapshot['runs'], 1)
+
+    def test_smtp_failures_are_counted_by_reply_code(self):
+        self._due_reminder(self.task.id, 1)
+        with mock.patch.object(PersistentMailConnection, 'send', side_effect=smtplib.SMTPDataError(554, b'Rejected')):
+            stats = self._dispatch()
+        self.assertEqual(stats['error'], 1)
+        self.assertEqual(get_metrics(self.app).snapshot()['errors'], {'smtp_554': 1})
+
+    def test_metrics_endpoint_serves_prometheus_text_behind_token(self):
+        get_metrics(self.app).record_sent('inapp', 3, [1, 2, 3])
+        self.app.config['METRICS_TOKEN'] = 'scrape-me'
+
+        self.assertEqual(self.client.get('/metrics/').status_code, 401)
+        response = self.client.get('/metrics/', headers={'Authorization': 'Bearer scrape-me'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        self.assertIn('jupy_reminders_sent_total{channel="inapp"} 3', response.get_data(as_text=True))
@@ -0,0 +1,55 @@
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.app.models import User, Task, Reminder
+from jupy_agenda.app.services import reminder_policy
+from jupy_agenda.app.todo_routes import _update_task_reminder
+from jupy_agenda.app import db
+from datetime import datetime, date, time, timedelta
+
+class TestReminderPolicy(BaseTestCase):
+
+    def tearDown(self):
+        self.clear_database()
+        super().tearDown()
+
+    def test_user_offset_is_deterministic_and_within_spread(self):
+        offsets = [reminder_policy.user_offset(user_id, 60) for user_id in range(1, 501)]
+        self.assertEqual(offsets, [reminder_policy.user_offset(user_id, 60) for user_id in range(1, 501)])
+        self.assertTrue(all(timedelta(0) <= offset < timedelta(minutes=60) for offset in offsets))
+        self.assertGreater(len(set(offsets)), 400) # Users are spread out, not bunched at 09:00
+        self.assertEqual(reminder_policy.user_offset(42, 0), timedelta(0))
+
+    def test_task_reminder_time_uses_base_hour_and_spread(self):
+        due = date(2030, 1, 15)
+        self.app.config['REMINDER_SPREAD_MINUTES'] = 0
+        try:
+            self.assertEqual(reminder_policy.task_reminder_time(7, due), datetime(2030, 1, 15, 9, 0))
+        finally:
+            self.app.config.pop('REMINDER_SPREAD_MINUTES')
+        self.assertEqual(reminder_policy.task_reminder_time(7, due),
+                         datetime.combine(due, time(9, 0)) + reminder_policy.user_offset(7, 60))
+
+    def test_all_of_a_users_task_reminders_share_the_offset(self):
+        user = User(username='policy_user', email='policy@example.com')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        due = date.today() + timedelta(days=3)
+        tasks = [Task(user_id=user.id, description=f"Policy Task {i}", due_date=due) for i in range(3)]
+        db.session.add_all(tasks)
+        db.session.commit()
+
+        for task in tasks:
+            _update_task_reminder(task)
+        db.session.commit()
+
+        times = {r.reminder_time for r in Reminder.query.filter_by(user_id=user.id)}
+        self.assertEqual(times, {reminder_policy.task_reminder_time(user.id, due)})
+
+    def test_retry_delay_doubles_up_to_the_cap(self):
+        class Top:
+            def uniform(self, low, high):
+                return high
+        delays = [reminder_policy.retry_delay(attempt, 60, 600, Top()) for attempt in range(1, 7)]
+        self.assertEqual([d.total_seconds() for d in delays], [60, 120, 240, 480, 600, 600])
+        jittered = reminder_policy.retry_delay(3, 60, 600)
+        self.assertTrue(timedelta(seconds=120) <= jittered <= timedelta(seconds=240))
@@ -0,0 +1,51 @@
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.app.models import User, Task, Event, Reminder
+from jupy_agenda.app.services.reminder_renderer import ReminderRenderer, get_renderer
+from jupy_agenda.app import db
+from datetime import datetime, date, timedelta
+from unittest import mock
+
+class TestReminderRenderer(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(username='render_user', email='render@example.com')
+        self.user.set_password('password123')
+        db.session.add(self.user)
+        db.session.commit()
+        self.task = Task(user_id=self.user.id, description="Render Task\nsecond line", due_date=date.today())
+        self.event = Event(user_id=self.user.id, title="Render Event",
+                           start_time=datetime.utcnow() + timedelta(hours=1),
+                           end_time=datetime.utcnow() + timedelta(hours=2))
+        db.session.add_all([self.task, self.event])
+        db.session.commit()
+        self.app.config['APP_BASE_URL'] = 'https://agenda.example.com/app'
+
+    def tearDown(self):
+        self.app.config.pop('APP_BASE_URL')
+        self.clear_database()
+        super().tearDown()
+
+    def test_renders_both_bodies_without_a_request_context(self):
+        renderer = ReminderRenderer(self.app)
+        reminder = Reminder(user_id=self.user.id, item_type='task', item_id=self.task.id, reminder_time=datetime.utcnow())
+        msg = renderer.reminder_message(reminder, self.user, self.task)
+
+        self.assertEqual(msg.subject, "Task Reminder: Render Task\nsecond line...")
+        self.assertEqual(msg.recipients, ['render@example.com'])
+        self.assertEqual(msg.sender, 'test-noreply@jupy.agenda')
+        self.assertIn('https://agenda.example.com/app/todo/', msg.body)
+        self.assertIn('Render Task<br>\nsecond line', msg.html)
+        self.assertEqual(msg.extra_headers['Auto-Submitted'], 'auto-generated')
+        self.assertEqual(renderer.stats()['messages'], 1)
+
+    def test_templates_are_compiled_once_per_app(self):
+        renderer = get_renderer(self.app)
+        self.assertIs(get_renderer(self.app), renderer)
+        reminder = Reminder(user_id=self.user.id, item_type='event', item_id=self.event.id, reminder_time=datetime.utcnow())
+        with mock.patch.object(self.app.jinja_env, 'get_template') as get_template:
+            for _ in range(3):
+                msg = renderer.reminder_message(reminder, self.user, self.event)
+            renderer.digest_message(self.user, [(reminder, self.event)])
+        get_template.assert_not_called()
+        self.assertIn('https://agenda.example.com/app/calendar/', msg.html)
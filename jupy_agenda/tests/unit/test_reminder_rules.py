@@ -0,0 +1,111 @@
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.app.models import User, Event, Task, Reminder, ReminderRule
+from jupy_agenda.app.services import reminder_rules
+from jupy_agenda.app.services.reminder_dispatcher import dispatch_due_reminders
+from jupy_agenda.app.calendar_routes import _update_event_reminder
+from jupy_agenda.app.todo_routes import _update_task_reminder
+from jupy_agenda.app import db
+from datetime import datetime, date, timedelta
+
+class TestReminderRules(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['REMINDER_RULES_ENABLED'] = True
+        self.app.config['REMINDER_SPREAD_MINUTES'] = 0
+        self.user = User(username='rules_user', email='rules@example.com')
+        self.user.set_password('password123')
+        db.session.add(self.user)
+        db.session.commit()
+        self.now = datetime(2030, 3, 10, 12, 0)
+
+    def tearDown(self):
+        self.clear_database()
+        self.app.config.pop('REMINDER_RULES_ENABLED')
+        self.app.config.pop('REMINDER_SPREAD_MINUTES')
+        super().tearDown()
+
+    def _event(self, start_time):
+        event = Event(user_id=self.user.id, title='Rules Event', start_time=start_time,
+                      end_time=start_time + timedelta(hours=1))
+        db.session.add(event)
+        db.session.commit()
+        return event
+
+    def test_default_event_rule_fires_one_hour_before(self):
+        event = self._event(self.now + timedelta(minutes=30))
+        self._event(self.now + timedelta(hours=3)) # Not due yet
+
+        self.assertEqual(reminder_rules.materialize_due_reminders(self.now), 1)
+        reminder = Reminder.query.one()
+        self.assertEqual((reminder.item_type, reminder.item_id, reminder.offset_minutes), ('event', event.id, 60))
+        self.assertEqual(reminder.reminder_time, event.start_time - timedelta(hours=1))
+        self.assertEqual(reminder.sent_status, 'pending')
+
+    def test_materialize_is_idempotent(self):
+        self._event(self.now + timedelta(minutes=30))
+        self.assertEqual(reminder_rules.materialize_due_reminders(self.now), 1)
+        self.assertEqual(reminder_rules.materialize_due_reminders(self.now + timedelta(minutes=1)), 0)
+        self.assertEqual(Reminder.query.count(), 1)
+
+    def test_user_rules_replace_the_default_and_allow_several_offsets(self):
+        reminder_rules.set_user_rules(self.user.id, 'event', [1440, 15])
+        db.session.commit()
+        self.assertEqual(reminder_rules.user_rules(self.user.id)['event'], [15, 1440])
+        event = self._event(self.now + timedelta(minutes=10))
+
+        reminder_rules.materialize_due_reminders(self.now)
+        offsets = sorted(r.offset_minutes for r in Reminder.query.filter_by(item_id=event.id))
+        self.assertEqual(offsets, [15, 1440]) # No default 60-minute reminder for this user
+
+    def test_task_rule_fires_at_nine_on_the_due_date(self):
+        task = Task(user_id=self.user.id, description='Rules Task', due_date=date(2030, 3, 10))
+        done = Task(user_id=self.user.id, description='Done Task', due_date=date(2030, 3, 10), status='completed')
+        db.session.add_all([task, done])
+        db.session.commit()
+
+        self.assertEqual(reminder_rules.materialize_due_reminders(datetime(2030, 3, 10, 8, 59)), 0)
+        self.assertEqual(reminder_rules.materialize_due_reminders(datetime(2030, 3, 10, 9, 0)), 1)
+        reminder = Reminder.query.one()
+        self.assertEqual((reminder.item_id, reminder.reminder_time), (task.id, datetime(2030, 3, 10, 9, 0)))
+
+    def test_moved_event_gets_a_new_reminder_but_renamed_one_does_not(self):
+        event = self._event(self.now + timedelta(minutes=30))
+        reminder_rules.materialize_due_reminders(self.now)
+
+        event.title = 'Renamed'
+        db.session.commit()
+        self.assertEqual(reminder_rules.materialize_due_reminders(self.now + timedelta(minutes=1)), 0)
+
+        event.start_time = self.now + timedelta(minutes=45)
+        db.session.commit()
+        self.assertEqual(reminder_rules.materialize_due_reminders(self.now + timedelta(minutes=1)), 1)
+        self.assertEqual(Reminder.query.filter_by(item_id=event.id).count(), 2)
+
+    def test_item_edits_do_not_touch_reminders(self):
+        event = self._event(datetime.utcnow() + timedelta(days=2))
+        task = Task(user_id=self.user.id, description='Rules Task', due_date=date.today() + timedelta(days=2))
+        db.session.add(task)
+        db.session.commit()
+
+        _update_event_reminder(event)
+        _update_task_reminder(task)
+        db.session.commit()
+        self.assertEqual(Reminder.query.count(), 0)
+
+    def test_dispatch_materializes_and_sends(self):
+        self.app.config['SERVER_NAME'] = 'localhost'
+        try:
+            self._event(self.now + timedelta(minutes=30))
+            stats = dispatch_due_reminders(now=self.now)
+        finally:
+            self.app.config.pop('SERVER_NAME')
+        self.assertEqual((stats['materialized'], stats['sent']), (1, 1))
+        self.assertEqual(Reminder.query.one().sent_status, 'sent')
+        self.assertEqual(ReminderRule.query.count(), 0) # Defaults need no rule rows
+
+    def test_dispatch_can_skip_materializing(self):
+        self._event(self.now + timedelta(minutes=30))
+        stats = dispatch_due_reminders(now=self.now, materialize=False) # The caller materializes (send-reminders, daemon)
+        self.assertEqual((stats['materialized'], stats['sent']), (0, 0))
+        self.assertEqual(Reminder.query.count(), 0)
@@ -0,0 +1,176 @@
+from jupy_agenda.tests.base_test import BaseTestCase
+from jupy_agenda.tests.webhook_sink import WebhookSink
+from jupy_agenda.app.models import User, Event, Reminder
+from jupy_agenda.app.services import webhook_delivery
+from jupy_agenda.app.services.webhook_delivery import WebhookConnectionPool, WebhookError, check_webhook_url, PublicHTTPSConnection
+from jupy_agenda.app.forms import NotificationSettingsForm
+from jupy_agenda.app.services.mail_delivery import is_transient_error
+from jupy_agenda.app.services.reminder_dispatcher import dispatch_due_reminders
+from jupy_agenda.app import db
+from datetime import datetime, timedelta
+import hashlib
+import hmac
+import json
+from unittest import mock
+
+class TestWebhookConnectionPool(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app.config.update(WEBHOOK_ALLOW_HTTP=True, WEBHOOK_ALLOW_PRIVATE_HOSTS=True) # The sink is http on loopback
+        self.sink = WebhookSink().start()
+        self.pool = WebhookConnectionPool(retry_base_seconds=0.01, retry_max_seconds=0.01, secret='s3cret')
+
+    def tearDown(self):
+        self.pool.close()
+        self.sink.stop()
+        self.app.config.pop('WEBHOOK_ALLOW_HTTP')
+        self.app.config.pop('WEBHOOK_ALLOW_PRIVATE_HOSTS')
+        super().tearDown()
+
+    def test_posts_reuse_one_keep_alive_connection(self):
+        for i in range(5):
+            self.assertEqual(self.pool.post_json(self.sink.url, {'n': i}), 200)
+        self.assertEqual([r['json']['n'] for r in self.sink.requests], list(range(5)))
+        self.assertEqual(self.pool.connections_opened, 1)
+        self.assertEqual(len(self.sink.connections), 1)
+
+    def test_requests_are_signed(self):
+        self.pool.post_json(self.sink.url, {'n': 1})
+        request = self.sink.requests[0]
+        expected = hmac.new(b's3cret', json.dumps({'n': 1}).encode(), hashlib.sha256).hexdigest()
+        self.assertEqual(request['headers']['X-Jupy-Signature'], f'sha256={expected}')
+
+    def test_transient_failures_are_retried(self):
+        self.sink.statuses = [503, 429]
+        self.assertEqual(self.pool.post_json(self.sink.url, {'n': 1}), 200)
+        self.assertEqual([r['status'] for r in self.sink.requests], [503, 429, 200])
+
+    def test_permanent_and_exhausted_failures_raise(self):
+        self.sink.statuses = [404]
+        with self.assertRaises(WebhookError) as caught:
+            self.pool.post_json(self.sink.url, {'n': 1})
+        self.assertEqual(caught.exception.status, 404)
+        self.assertFalse(is_transient_error(caught.exception))
+        self.assertEqual(len(self.sink.requests), 1)
+
+        self.sink.statuses = [500, 500, 500]
+        with self.assertRaises(WebhookError) as caught:
+            self.pool.post_json(self.sink.url, {'n': 2})
+        self.assertTrue(is_transient_error(caught.exception))
+
+    def _pinned(self, host, port):
+        # hook.invalid can't resolve: reaching the sink proves the socket went to the checked address
+        self.assertEqual(host, 'hook.invalid')
+        return ['127.0.0.1']
+
+    def test_connections_go_to_the_checked_address(self):
+        self.app.config.update(WEBHOOK_ALLOW_PRIVATE_HOSTS=False)
+        strict = WebhookConnectionPool()
+        port = self.sink.url.split(':')[2].split('/')[0]
+        with mock.patch.object(webhook_delivery, 'public_addresses', side_effect=self._pinned) as checked:
+            self.assertEqual(strict.post_json(f'http://hook.invalid:{port}/hook', {'n': 1}), 200)
+        checked.assert_called_once_with('hook.invalid', int(port))
+        self.assertEqual(self.sink.requests[0]['headers']['Host'], f'hook.invalid:{port}')
+        strict.close()
+
+    def test_tls_connections_go_to_the_checked_address_and_verify_the_host_name(self):
+        context = mock.Mock()
+        context.wrap_socket.side_effect = lambda sock, server_hostname: sock # Plain TCP to the sink
+        port = int(self.sink.url.split(':')[2].split('/')[0])
+        connection = PublicHTTPSConnection('hook.invalid', port, timeout=5, ssl_context=context)
+        with mock.patch.object(webhook_delivery, 'public_addresses', side_effect=self._pinned):
+            connection.connect()
+        try:
+            self.assertEqual(connection.sock.getpeername()[0], '127.0.0.1')
+            self.assertEqual(context.wrap_socket.call_args.kwargs['server_hostname'], 'hook.invalid')
+        finally:
+            connection.close()
+
+    def test_internal_hosts_are_refused_unless_allowed(self):
+        self.app.config.update(WEBHOOK_ALLOW_HTTP=False, WEBHOOK_ALLOW_PRIVATE_HOSTS=False)
+        strict = WebhookConnectionPool(retry_base_seconds=0.01, retry_max_seconds=0.01)
+        with self.assertRaises(WebhookError) as caught:
+            strict.post_json(self.sink.url, {'n': 1}) # http
+        self.assertFalse(is_transient_error(caught.exception))
+
+        strict.allow_http = True # Only the per-connection address check is left
+        with self.assertRaises(WebhookError) as caught:
+            strict.post_json(self.sink.url, {'n': 1})
+        self.assertIn('non-public address', str(caught.exception))
+        self.assertFalse(is_transient_error(caught.exception))
+        self.assertEqual(self.sink.requests, [])
+        strict.close()
+
+    def test_url_check_rejects_internal_addresses(self):
+        for url in ('https://127.0.0.1/hook', 'https://169.254.169.254/latest', 'https://10.0.0.1/', 'https://[::1]/',
+                    'https://[::ffff:192.168.0.1]/', 'ftp://example.com/'):
+            with self.assertRaises(WebhookError, msg=url):
+                check_webhook_url(url)
+        with self.assertRaises(WebhookError):
+            check_webhook_url('http://93.184.215.14/hook')
+        self.assertEqual(check_webhook_url('https://93.184.215.14/hook').hostname, '93.184.215.14')
+        self.assertEqual(check_webhook_url('http://127.0.0.1/', allow_http=True, allow_private=True).port, None)
+
+    def test_settings_form_rejects_internal_and_plain_http_urls(self):
+        self.app.config.update(WEBHOOK_ALLOW_HTTP=False, WEBHOOK_ALLOW_PRIVATE_HOSTS=False)
+        for url in ('https://169.254.169.254/latest/meta-data', 'https://10.0.0.1/', 'http://93.184.215.14/hook'):
+            with self.app.test_request_context(method='POST', data={'notification_method': 'webhook', 'webhook_url': url}):
+                form = NotificationSettingsForm(meta={'csrf': False})
+                self.assertFalse(form.validate(), url)
+                self.assertIn('webhook_url', form.errors)
+        with self.app.test_request_context(method='POST', data={'notification_method': 'webhook',
+                                                                'webhook_url': 'https://93.184.215.14/hook'}):
+            self.assertTrue(NotificationSettingsForm(meta={'csrf': False}).validate())
+
+class TestWebhookChannel(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sink = WebhookSink().start()
+        self.app.config['SERVER_NAME'] = 'localhost'
+        self.app.config.update(WEBHOOK_ALLOW_HTTP=True, WEBHOOK_ALLOW_PRIVATE_HOSTS=True)
+        self.user = User(username='hook_user', email='hook@example.com', notification_method='webhook',
+                         webhook_url=self.sink.url)
+        self.user.set_password('password')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        self.clear_database()
+        self.sink.stop()
+        self.app.config.pop('SERVER_NAME')
+        self.app.config.pop('WEBHOOK_BATCH_SIZE', None)
+        self.app.config.pop('WEBHOOK_ALLOW_HTTP')
+        self.app.config.pop('WEBHOOK_ALLOW_PRIVATE_HOSTS')
+        super().tearDown()
+
+    def _due_reminders(self, count):
+        start = datetime.utcnow() + timedelta(minutes=30)
+        for i in range(count):
+            event = Event(user_id=self.user.id, title=f'Hook Event {i}', start_time=start, end_time=start + timedelta(hours=1))
+            db.session.add(event)
+            db.session.flush()
+            db.session.add(Reminder(user_id=self.user.id, item_type='event', item_id=event.id, event_id=event.id,
+                                    reminder_time=datetime.utcnow() - timedelta(minutes=1), notification_method='webhook'))
+        db.session.commit()
+
+    def test_dispatch_batches_a_users_reminders_into_posts(self):
+        self.app.config['WEBHOOK_BATCH_SIZE'] = 2
+        self._due_reminders(3)
+
+        stats = dispatch_due_reminders()
+        self.assertEqual(stats['sent'], 3)
+        self.assertEqual(sorted(len(r['json']['reminders']) for r in self.sink.requests), [1, 2])
+        first = self.sink.requests[0]['json']
+        self.assertEqual(first['user']['username'], 'hook_user')
+        self.assertTrue(first['reminders'][0]['title'].startswith('Event Reminder: Hook Event'))
+        self.assertEqual(Reminder.query.filter_by(sent_status='sent').count(), 3)
+
+    def test_rejected_post_marks_reminders_error(self):
+        self.sink.statuses = [410]
+        self._due_reminders(1)
+
+        stats = dispatch_due_reminders()
+        self.assertEqual((stats['sent'], stats['error']), (0, 1))
+        self.assertEqual(Reminder.query.one().sent_status, 'error')
@@ -0,0 +1,62 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+
+class _RecordingHandler(BaseHTTPRequestHandler):
+    """Accepts JSON POSTs, records them and answers with the sink's next scripted status."""
+    protocol_version = 'HTTP/1.1' # Keep-alive
+
+    def do_POST(self):
+        sink = self.server.sink
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with sink.lock:
+            sink.connections.add(self.client_address)
+            status = sink.statuses.pop(0) if sink.statuses else 200
+            sink.requests.append({'path': self.path, 'headers': dict(self.headers), 'json': json.loads(body), 'status': status})
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class WebhookSink:
+    """
+    Local HTTP server standing in for a webhook receiver in tests.
+
+    Usage:
+        with WebhookSink() as sink:
+            sink.statuses = [503] # The first POST fails, the rest succeed
+            ...
+            assert len(sink.requests) == 2
+    """
+
+    def __init__(self, host='127.0.0.1'):
+        self.requests = []
+        self.statuses = []
+        self.connections = set() # Distinct client (host, port) pairs, i.e. TCP connections
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, 0), _RecordingHandler)
+        self._server.daemon_threads = True
+        self._server.sink = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/hook'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()